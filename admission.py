@@ -0,0 +1,145 @@
+from typing import Any, List, Optional
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+from config import (
+    LLM_CONCURRENCY_INITIAL,
+    LLM_CONCURRENCY_MIN,
+    LLM_CONCURRENCY_MAX,
+    LLM_LATENCY_TARGET_SEC,
+    TRANSCRIPTION_CONCURRENCY_INITIAL,
+    TRANSCRIPTION_CONCURRENCY_MIN,
+    TRANSCRIPTION_CONCURRENCY_MAX,
+    TRANSCRIPTION_LATENCY_TARGET_SEC,
+    ADMISSION_BUSY_QUEUE_DEPTH,
+    logger,
+)
+
+
+# Приоритет текущего запроса: меньше — раньше. Выставляется на задачу обработки апдейта,
+# агенты его не передают явно — он наследуется через контекст asyncio-задачи.
+_request_priority: contextvars.ContextVar[float] = contextvars.ContextVar("request_priority", default=100.0)
+
+
+def set_request_priority(priority: float) -> None:
+    _request_priority.set(priority)
+
+
+def message_priority(text: Optional[str] = None, voice_duration: Optional[int] = None) -> float:
+    # Короткий текст идёт раньше длинного, любой голос — после текста (его ещё транскрибировать)
+    if voice_duration is not None:
+        return 1000.0 + float(voice_duration)
+    return float(min(len(text or ""), 999))
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    return getattr(exc, "status_code", None) == 429 or exc.__class__.__name__ == "RateLimitError"
+
+
+class AdaptiveLimiter:
+    """Ограничитель параллельных вызовов с AIMD-подстройкой лимита.
+
+    Успешный быстрый ответ увеличивает лимит примерно на 1 за окно из `limit` вызовов,
+    429 уменьшает его вдвое, медленный ответ — на 20%. Ожидающие вызовы обслуживаются по приоритету.
+    """
+
+    def __init__(self, name: str, initial: int, min_limit: int, max_limit: int, latency_target_sec: float) -> None:
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_target_sec = latency_target_sec
+        self.in_flight = 0
+        self._waiters: List[List[Any]] = []  # [priority, seq, future]
+        self._seq = itertools.count()
+        self._last_decrease = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    def is_busy(self) -> bool:
+        return self.queue_depth >= ADMISSION_BUSY_QUEUE_DEPTH
+
+    async def acquire(self, priority: float) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), fut])
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # Слот уже передан нам, но задачу отменили — вернём его
+            if fut.done() and not fut.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self.in_flight += 1
+            fut.set_result(None)
+
+    def _decrease(self, factor: float, reason: str) -> None:
+        now = time.monotonic()
+        # Не режем лимит чаще раза за целевое время ответа: одна волна 429 — одно уменьшение
+        if now - self._last_decrease < self.latency_target_sec:
+            return
+        self._last_decrease = now
+        old = self.limit
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        logger.info("Admission[%s]: лимит %.1f → %.1f (%s)", self.name, old, self.limit, reason)
+
+    def _record(self, latency: float, rate_limited: bool) -> None:
+        if rate_limited:
+            self._decrease(0.5, "429")
+        elif latency > self.latency_target_sec:
+            self._decrease(0.8, f"latency {latency:.1f}s")
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[float] = None):
+        await self.acquire(_request_priority.get() if priority is None else priority)
+        started = time.monotonic()
+        rate_limited = False
+        cancelled = False
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Отменённая попытка (проигравший хедж) ничего не говорит о нагрузке — в AIMD её не учитываем
+            cancelled = True
+            raise
+        except Exception as exc:
+            rate_limited = is_rate_limited(exc)
+            raise
+        finally:
+            self.in_flight -= 1
+            if not cancelled:
+                self._record(time.monotonic() - started, rate_limited)
+            self._wake()
+
+
+llm_limiter = AdaptiveLimiter(
+    "llm",
+    initial=LLM_CONCURRENCY_INITIAL,
+    min_limit=LLM_CONCURRENCY_MIN,
+    max_limit=LLM_CONCURRENCY_MAX,
+    latency_target_sec=LLM_LATENCY_TARGET_SEC,
+)
+
+transcription_limiter = AdaptiveLimiter(
+    "transcription",
+    initial=TRANSCRIPTION_CONCURRENCY_INITIAL,
+    min_limit=TRANSCRIPTION_CONCURRENCY_MIN,
+    max_limit=TRANSCRIPTION_CONCURRENCY_MAX,
+    latency_target_sec=TRANSCRIPTION_LATENCY_TARGET_SEC,
+)
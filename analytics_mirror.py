@@ -0,0 +1,578 @@
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+
+from config import DB_PATH, ANALYTICS_MIRROR_ENABLED, logger
+from sql_text import (
+    CREATED_AT,
+    created_at_range,
+    has_comments,
+    normalize,
+    split_clauses,
+    split_conjuncts,
+    split_select_item,
+    split_top_level,
+    strip_parens,
+)
+import metrics
+
+try:
+    import numpy as np  # опционально: без NumPy зеркало выключено, запросы идут в SQLite
+except ImportError:
+    np = None
+
+
+# Колоночное зеркало таблицы leads для типовых агрегатов (COUNT с GROUP BY по проекту/тегам/периодам).
+# Всё, что планировщик не понимает, выполняется в SQLite как раньше.
+
+_DIMENSIONS = ("project_code", "gck_tag", "project_tag")
+# created_at, для которых date(created_at) = первые 10 символов (без часового пояса)
+_SAFE_CREATED_AT = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?$")
+# strftime-форматы не мельче дня: метку можно посчитать по дню
+_DAY_FORMAT = re.compile(r"^(?:%[YmdWjw]|[-/. _])+$")
+_EPOCH = date(1970, 1, 1)
+_NO_DAY = -(2 ** 31)
+
+
+def _day_number(value: str) -> int:
+    return (date.fromisoformat(value[:10]) - _EPOCH).days
+
+
+def _unquote(literal: str) -> str:
+    return literal[1:-1].replace("''", "'")
+
+
+def _ident(text: str) -> str:
+    return text.strip().strip('"`').lower()
+
+
+# ---------------------------------------------------------------------------
+# Планировщик: SQL → план для зеркала (или None)
+# ---------------------------------------------------------------------------
+
+def _parse_expr(expr: str) -> Optional[Tuple[str, str]]:
+    """('count', '') | ('dim', column) | ('bucket', strftime-формат)."""
+    norm = normalize(strip_parens(expr))
+    if norm in ("count(*)", "count(1)", "count(id)", "count(leads.id)"):
+        return "count", ""
+    ident = _ident(norm.replace("leads.", "", 1) if norm.startswith("leads.") else norm)
+    if ident in _DIMENSIONS:
+        return "dim", ident
+    m = re.fullmatch(rf"date\({CREATED_AT}\)", norm)
+    if m:
+        return "bucket", "%Y-%m-%d"
+    m = re.fullmatch(rf"strftime\(('(?:[^']|'')*'),{CREATED_AT}\)", norm)
+    if m:
+        fmt = _unquote(m.group(1))
+        if _DAY_FORMAT.match(fmt):
+            return "bucket", fmt
+    return None
+
+
+def _parse_item(item: str) -> Optional[Tuple[str, Tuple[str, str]]]:
+    # Имя колонки — как у SQLite: алиас, голое имя для leads.col, иначе текст выражения
+    expr, name = split_select_item(item)
+    spec = _parse_expr(expr)
+    return (name, spec) if spec else None
+
+
+def _parse_condition(cond: str) -> Optional[Tuple[str, Any]]:
+    """('dim', (column, values, negate)) | ('days', (lo, hi)) — полуинтервал номеров дней."""
+    m = re.fullmatch(r"(?is)(\S+)\s*(=|==|!=|<>)\s*('(?:[^']|'')*')", cond)
+    if m and _ident(m.group(1).split(".")[-1]) in _DIMENSIONS:
+        return "dim", (_ident(m.group(1).split(".")[-1]), {_unquote(m.group(3))}, m.group(2) in ("!=", "<>"))
+    m = re.fullmatch(r"(?is)(\S+)\s+(NOT\s+)?IN\s*\((.*)\)", cond)
+    if m and _ident(m.group(1).split(".")[-1]) in _DIMENSIONS:
+        values = []
+        for item in split_top_level(m.group(3)):
+            if not re.fullmatch(r"'(?:[^']|'')*'", item):
+                return None
+            values.append(_unquote(item))
+        return "dim", (_ident(m.group(1).split(".")[-1]), set(values), bool(m.group(2)))
+
+    bounds = created_at_range(cond)
+    if bounds is not None:
+        lo, hi = bounds
+        return "days", (_day_number(lo) if lo else None, _day_number(hi) if hi else None)
+    return None
+
+
+def plan_query(sql: str) -> Optional[Dict[str, Any]]:
+    if has_comments(sql):
+        return None
+    clauses = split_clauses(sql)
+    if not clauses or "HAVING" in clauses or _ident(clauses.get("FROM", "")) != "leads":
+        return None
+    select = clauses["SELECT"]
+    if re.match(r"(?i)(DISTINCT|ALL)\b", select):
+        return None
+
+    items = []
+    for raw in split_top_level(select):
+        parsed = _parse_item(raw)
+        if parsed is None:
+            return None
+        items.append(parsed)
+
+    group: List[Tuple[str, str]] = []
+    for raw in split_top_level(clauses.get("GROUP BY", "")):
+        if raw.isdigit() and 1 <= int(raw) <= len(items):
+            spec = items[int(raw) - 1][1]
+        else:
+            by_alias = [spec for name, spec in items if name.lower() == _ident(raw)]
+            spec = by_alias[0] if by_alias else _parse_expr(raw)
+        if spec is None or spec[0] == "count":
+            return None
+        group.append(spec)
+    for _, spec in items:
+        if spec[0] != "count" and spec not in group:
+            return None  # «голые» колонки без GROUP BY SQLite считает по-своему
+
+    filters: List[Tuple[str, Any]] = []
+    lo, hi = None, None
+    if clauses.get("WHERE"):
+        conjuncts = split_conjuncts(clauses["WHERE"])
+        if conjuncts is None:
+            return None
+        for cond in conjuncts:
+            parsed_cond = _parse_condition(cond)
+            if parsed_cond is None:
+                return None
+            kind, payload = parsed_cond
+            if kind == "dim":
+                filters.append(parsed_cond)
+            else:
+                c_lo, c_hi = payload
+                lo = c_lo if lo is None or (c_lo is not None and c_lo > lo) else lo
+                hi = c_hi if hi is None or (c_hi is not None and c_hi < hi) else hi
+
+    order: List[Tuple[int, bool]] = []
+    for raw in split_top_level(clauses.get("ORDER BY", "")):
+        m = re.fullmatch(r"(?is)(.+?)(?:\s+(ASC|DESC))?", raw.strip())
+        ref, desc = m.group(1).strip(), (m.group(2) or "").upper() == "DESC"
+        idx = None
+        if ref.isdigit() and 1 <= int(ref) <= len(items):
+            idx = int(ref) - 1
+        else:
+            for i, (name, spec) in enumerate(items):
+                if name.lower() == _ident(ref) or normalize(name) == normalize(ref) or spec == _parse_expr(ref):
+                    idx = i
+                    break
+        if idx is None:
+            return None
+        order.append((idx, desc))
+
+    limit, offset = None, 0
+    if clauses.get("LIMIT"):
+        m = re.fullmatch(r"(?is)(\d+)(?:\s*(?:,|OFFSET)\s*(\d+))?", clauses["LIMIT"].strip())
+        if not m:
+            return None
+        if "," in clauses["LIMIT"]:
+            offset, limit = int(m.group(1)), int(m.group(2))
+        else:
+            limit, offset = int(m.group(1)), int(m.group(2) or 0)
+
+    uses_time = (lo is not None or hi is not None) or any(spec[0] == "bucket" for spec in group)
+    return {
+        "items": items, "group": group, "filters": filters, "days": (lo, hi),
+        "order": order, "limit": limit, "offset": offset, "uses_time": uses_time,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Зеркало
+# ---------------------------------------------------------------------------
+
+class _Dictionary:
+    """Словарное кодирование текстовой колонки: значение ↔ целочисленный код."""
+
+    def __init__(self) -> None:
+        self.values: List[Optional[str]] = []
+        self.index: Dict[Optional[str], int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class LeadsMirror:
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self.n = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.day = np.zeros(0, dtype=np.int32)      # номер дня (для date()/strftime по дням)
+        self.dims = {col: np.zeros(0, dtype=np.int32) for col in _DIMENSIONS}
+        self.dicts = {col: _Dictionary() for col in _DIMENSIONS}
+        self.unsafe_rows = 0                        # created_at в формате, где date() ≠ первые 10 символов
+        self.max_id = 0
+        self.max_updated_at = ""
+        self.data_version = ""
+        self._labels: Dict[Tuple[str, int], str] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True)
+
+    def _encode(self, rows: List[tuple]) -> Dict[str, Any]:
+        ids = np.empty(len(rows), dtype=np.int64)
+        day = np.empty(len(rows), dtype=np.int32)
+        dims = {col: np.empty(len(rows), dtype=np.int32) for col in _DIMENSIONS}
+        unsafe = 0
+        for i, (row_id, created_at, project_code, gck_tag, project_tag, _updated) in enumerate(rows):
+            ids[i] = row_id
+            text = created_at if isinstance(created_at, str) else None
+            if text is not None and _SAFE_CREATED_AT.match(text):
+                try:
+                    parsed = datetime.fromisoformat(text.replace("T", " "))
+                    day[i] = (parsed - datetime(1970, 1, 1)).days
+                except ValueError:
+                    day[i] = _NO_DAY
+                    unsafe += 1
+            else:
+                day[i] = _NO_DAY
+                unsafe += 1
+            dims["project_code"][i] = self.dicts["project_code"].code(project_code)
+            dims["gck_tag"][i] = self.dicts["gck_tag"].code(gck_tag)
+            dims["project_tag"][i] = self.dicts["project_tag"].code(project_tag)
+        return {"ids": ids, "day": day, "dims": dims, "unsafe": unsafe}
+
+    def _fetch(self, conn: sqlite3.Connection, where: str, params: tuple) -> List[tuple]:
+        cur = conn.execute(
+            "SELECT id, created_at, project_code, gck_tag, project_tag, COALESCE(updated_at, '') "
+            f"FROM leads {where} ORDER BY id",
+            params,
+        )
+        return cur.fetchall()
+
+    def _track(self, rows: List[tuple]) -> None:
+        if rows:
+            self.max_id = max(self.max_id, rows[-1][0])
+            # updated_at хранится с точностью до секунды: последние пару секунд перечитаем в следующий раз,
+            # иначе строка, обновлённая в ту же секунду после чтения, потеряется
+            recent = datetime.utcfromtimestamp(time.time() - 2).strftime("%Y-%m-%d %H:%M:%S")
+            self.max_updated_at = min(max(self.max_updated_at, max(r[5] for r in rows)), recent)
+
+    def rebuild(self) -> None:
+        started = time.monotonic()
+        conn = self._connect()
+        try:
+            rows = self._fetch(conn, "", ())
+        finally:
+            conn.close()
+        self.__init__(self.db_path)
+        enc = self._encode(rows)
+        self.ids, self.day, self.dims = enc["ids"], enc["day"], enc["dims"]
+        self.unsafe_rows = enc["unsafe"]
+        self.n = len(rows)
+        self._track(rows)
+        logger.info(
+            "Mirror: загружено %s строк leads за %.2fs (небезопасных created_at: %s)",
+            self.n, time.monotonic() - started, self.unsafe_rows,
+        )
+
+    def sync(self, data_version: str) -> None:
+        """Инкрементальная синхронизация по водяным знакам id и updated_at."""
+        if data_version == self.data_version:
+            return
+        if self.n == 0:
+            self.rebuild()
+            self.data_version = data_version
+            return
+        conn = self._connect()
+        try:
+            total = conn.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+            new_rows = self._fetch(conn, "WHERE id > ?", (self.max_id,))
+            changed = self._fetch(conn, "WHERE COALESCE(updated_at, '') > ? AND id <= ?",
+                                  (self.max_updated_at, self.max_id))
+        finally:
+            conn.close()
+        if total != self.n + len(new_rows):
+            # Удаления водяными знаками не видны — перестраиваем целиком
+            self.rebuild()
+            self.data_version = data_version
+            return
+        if changed:
+            enc = self._encode(changed)
+            pos = np.searchsorted(self.ids, enc["ids"])
+            self.unsafe_rows += int(np.count_nonzero(enc["day"] == _NO_DAY)) - int(np.count_nonzero(self.day[pos] == _NO_DAY))
+            self.day[pos] = enc["day"]
+            for col in _DIMENSIONS:
+                self.dims[col][pos] = enc["dims"][col]
+            self._track(changed)
+        if new_rows:
+            enc = self._encode(new_rows)
+            self.ids = np.concatenate([self.ids, enc["ids"]])
+            self.day = np.concatenate([self.day, enc["day"]])
+            for col in _DIMENSIONS:
+                self.dims[col] = np.concatenate([self.dims[col], enc["dims"][col]])
+            self.unsafe_rows += enc["unsafe"]
+            self.n += len(new_rows)
+            self._track(new_rows)
+        self.data_version = data_version
+        if new_rows or changed:
+            logger.info("Mirror: синхронизация +%s новых, %s обновлённых строк", len(new_rows), len(changed))
+
+    def _bucket_labels(self, fmt: str, days: "np.ndarray") -> List[str]:
+        # Метки считает сам SQLite по дню — ровно как strftime(fmt, created_at)
+        missing = [int(d) for d in days if (fmt, int(d)) not in self._labels]
+        if missing:
+            conn = sqlite3.connect(":memory:")
+            try:
+                for d in missing:
+                    iso = (_EPOCH.fromordinal(_EPOCH.toordinal() + d)).isoformat()
+                    self._labels[(fmt, d)] = conn.execute("SELECT strftime(?, ?)", (fmt, iso)).fetchone()[0]
+            finally:
+                conn.close()
+        return [self._labels[(fmt, int(d))] for d in days]
+
+    def execute(self, plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+        selected = np.ones(self.n, dtype=bool)
+        for _, (col, values, negate) in plan["filters"]:
+            codes = [self.dicts[col].index[v] for v in values if v in self.dicts[col].index]
+            hit = np.isin(self.dims[col], np.array(codes, dtype=np.int32))
+            selected &= ~hit if negate else hit
+        lo, hi = plan["days"]
+        if lo is not None:
+            selected &= self.day >= lo
+        if hi is not None:
+            selected &= self.day < hi
+
+        # Ключи группировки → коды, затем один bincount по составному ключу
+        key_codes: List["np.ndarray"] = []
+        key_values: List[List[Any]] = []
+        for kind, arg in plan["group"]:
+            if kind == "dim":
+                key_codes.append(self.dims[arg][selected])
+                key_values.append(self.dicts[arg].values)
+            else:
+                uniq_days, inverse = np.unique(self.day[selected], return_inverse=True)
+                labels = self._bucket_labels(arg, uniq_days)
+                label_values = sorted(set(labels))
+                label_index = {v: i for i, v in enumerate(label_values)}
+                day_to_label = np.array([label_index[v] for v in labels], dtype=np.int64)
+                key_codes.append(day_to_label[inverse] if len(uniq_days) else np.zeros(0, dtype=np.int64))
+                key_values.append(label_values)
+
+        groups: List[Tuple[Tuple[Any, ...], int]] = []
+        if not key_codes:
+            groups.append(((), int(np.count_nonzero(selected))))
+        else:
+            combined = np.zeros(int(np.count_nonzero(selected)), dtype=np.int64)
+            stride = 1
+            strides = []
+            for codes, values in zip(key_codes, key_values):
+                strides.append(stride)
+                combined += codes.astype(np.int64) * stride
+                stride *= max(1, len(values))
+            keys, counts = np.unique(combined, return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                decoded = tuple(
+                    values[(key // st) % max(1, len(values))] for st, values in zip(strides, key_values)
+                )
+                groups.append((decoded, count))
+            # Без ORDER BY SQLite отдаёт группы в порядке ключа
+            groups.sort(key=lambda g: tuple((v is not None, v) for v in g[0]))
+
+        rows: List[Dict[str, Any]] = []
+        for key, count in groups:
+            by_spec = dict(zip(plan["group"], key))
+            rows.append({name: (count if spec[0] == "count" else by_spec[spec]) for name, spec in plan["items"]})
+
+        names = [name for name, _ in plan["items"]]
+        for idx, desc in reversed(plan["order"]):
+            col = names[idx]
+            rows.sort(key=lambda r: (r[col] is not None, r[col]), reverse=desc)
+        start = plan["offset"]
+        end = None if plan["limit"] is None else start + plan["limit"]
+        return rows[start:end]
+
+
+_mirror: Optional[LeadsMirror] = None
+_lock = threading.Lock()
+# «auto» включает зеркало, пока configure() не скажет, что воркеров несколько
+_enabled = ANALYTICS_MIRROR_ENABLED in ("1", "auto")
+
+
+def configure(workers: int) -> None:
+    """Зеркало строится в каждом процессе-воркере, и память растёт с их числом: в режиме auto — только при одном."""
+    global _enabled
+    if ANALYTICS_MIRROR_ENABLED == "auto":
+        _enabled = workers <= 1
+
+
+_plans: Dict[str, Optional[Dict[str, Any]]] = {}
+
+
+def try_execute(sql: str, params: Optional[tuple] = None) -> Optional[List[Dict[str, Any]]]:
+    """Выполняет проверенный SELECT на зеркале, если план поддерживается; иначе None (→ SQLite)."""
+    global _mirror
+    if not _enabled or np is None or params:
+        return None
+    if sql not in _plans:
+        if len(_plans) > 512:
+            _plans.clear()
+        try:
+            _plans[sql] = plan_query(sql)
+        except ValueError as exc:
+            # нераспознанный литерал и т.п.: зеркало не должно ронять запрос, который выполнит SQLite
+            logger.info("Mirror: план не построен (%s), выполняем в SQLite", exc)
+            _plans[sql] = None
+    plan = _plans[sql]
+    if plan is None:
+        metrics.incr("mirror.fallback")
+        return None
+    from db import get_data_version  # локально: db импортирует этот модуль
+
+    started = time.monotonic()
+    try:
+        with _lock:
+            if _mirror is None:
+                _mirror = LeadsMirror(DB_PATH)
+            _mirror.sync(get_data_version())
+            if plan["uses_time"] and _mirror.unsafe_rows:
+                metrics.incr("mirror.fallback")
+                return None
+            rows = _mirror.execute(plan)
+    except Exception as exc:
+        logger.error("Mirror: ошибка, выполняем в SQLite: %s", exc)
+        metrics.incr("mirror.errors")
+        return None
+    metrics.incr("mirror.hits")
+    metrics.observe("mirror.latency", time.monotonic() - started)
+    logger.info("Mirror: запрос выполнен на зеркале за %.1f мс, строк=%s", (time.monotonic() - started) * 1000, len(rows))
+    return rows
+
+
+def warm() -> int:
+    """Строит и догоняет зеркало заранее (прогрев при старте); число строк, 0 — если зеркало выключено."""
+    global _mirror
+    if not _enabled or np is None:
+        return 0
+    from db import get_data_version
+
+    with _lock:
+        if _mirror is None:
+            _mirror = LeadsMirror(DB_PATH)
+        _mirror.sync(get_data_version())
+        return _mirror.n
+
+
+# ---------------------------------------------------------------------------
+# Проверка эквивалентности зеркала и SQLite
+# ---------------------------------------------------------------------------
+
+CHECK_QUERIES = [
+    "SELECT COUNT(*) AS cnt FROM leads",
+    "SELECT COUNT(*) AS cnt FROM leads WHERE date(created_at) = date('now','-1 day')",
+    "SELECT COUNT(*) FROM leads WHERE date(created_at) >= date('now','-6 day')",
+    "SELECT project_code, COUNT(*) AS cnt FROM leads GROUP BY project_code ORDER BY cnt DESC, project_code",
+    "SELECT gck_tag, COUNT(*) AS cnt FROM leads WHERE date(created_at) = date('now') GROUP BY gck_tag",
+    "SELECT date(created_at) AS day, COUNT(*) AS cnt FROM leads GROUP BY day ORDER BY day",
+    "SELECT strftime('%Y-%m', created_at) AS month, project_code, COUNT(*) AS cnt FROM leads GROUP BY month, project_code",
+    "SELECT strftime('%Y-%W', created_at) AS week, COUNT(*) AS cnt FROM leads "
+    "WHERE date(created_at) >= date('now','-27 day') GROUP BY strftime('%Y-%W', created_at) ORDER BY week",
+    "SELECT COUNT(*) AS cnt FROM leads WHERE date(created_at) BETWEEN date('now','-40 day') AND date('now','-10 day')",
+    "SELECT project_tag, gck_tag, COUNT(*) AS cnt FROM leads WHERE project_code IN ('[LR166]', '[LR165]') "
+    "GROUP BY project_tag, gck_tag ORDER BY cnt DESC LIMIT 5",
+    "SELECT COUNT(*) AS cnt FROM leads WHERE created_at >= date('now','-7 day') AND created_at < date('now')",
+    "SELECT gck_tag, COUNT(*) FROM leads WHERE project_code <> '[LR100]' GROUP BY 1 ORDER BY 2 DESC",
+    "SELECT leads.project_code, COUNT(*) FROM leads GROUP BY leads.project_code ORDER BY leads.project_code",
+    'SELECT "gck_tag", count(*) c FROM leads GROUP BY "gck_tag" ORDER BY c DESC, 1',
+]
+
+
+def _build_synthetic(path: str, rows: int) -> None:
+    import random
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(
+            """
+            CREATE TABLE leads(id INTEGER PRIMARY KEY, created_at TEXT NOT NULL, google_sheets_id INTEGER,
+                               phone INTEGER NOT NULL, unused TEXT, project_tag TEXT NOT NULL,
+                               project_code TEXT NOT NULL, gck_tag TEXT NOT NULL, check_mark TEXT,
+                               updated_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+            """
+        )
+        rnd = random.Random(42)
+        now = datetime.utcnow()
+        formats = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]
+        batch = []
+        for _ in range(rows):
+            moment = now.timestamp() - rnd.randint(0, 120 * 86400)
+            created = datetime.utcfromtimestamp(moment).strftime(rnd.choice(formats))
+            code = rnd.choice(["[LR100]", "[LR165]", "[LR166]", "[LR200]"])
+            batch.append((created, rnd.randint(79000000000, 79999999999), f"tag {code}", code, rnd.choice(["ГЦК1", "ГЦК2", "ГЦК3"])))
+        conn.executemany(
+            "INSERT INTO leads(created_at, phone, project_tag, project_code, gck_tag) VALUES (?, ?, ?, ?, ?)", batch
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def check_equivalence(db_path: str, queries: List[str]) -> bool:
+    """Выполняет запросы в SQLite и на зеркале и сравнивает результаты."""
+    mirror = LeadsMirror(db_path)
+    mirror.sync("check")
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    ok = True
+    try:
+        for sql in queries:
+            plan = plan_query(sql)
+            if plan is None:
+                print(f"SKIP (план не поддерживается): {sql}")
+                continue
+            expected = [dict(r) for r in conn.execute(sql).fetchall()]
+            actual = mirror.execute(plan)
+            if not plan["order"] or plan["limit"] is not None:
+                # порядок равных значений SQL не определён — сравниваем как мультимножества
+                same = sorted(map(repr, expected)) == sorted(map(repr, actual)) if plan["limit"] is None else len(expected) == len(actual)
+                if plan["limit"] is not None and plan["order"]:
+                    order_col = [name for name, _ in plan["items"]][plan["order"][0][0]]
+                    same = same and [r[order_col] for r in expected] == [r[order_col] for r in actual]
+                same = same and list(expected[0].keys() if expected else []) == list(actual[0].keys() if actual else [])
+            else:
+                same = expected == actual
+            ok = ok and same
+            print(f"{'OK  ' if same else 'FAIL'} rows={len(expected)}: {sql}")
+            if not same:
+                print("   sqlite:", expected[:5])
+                print("   mirror:", actual[:5])
+    finally:
+        conn.close()
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Проверка эквивалентности колоночного зеркала leads и SQLite")
+    parser.add_argument("--check", action="store_true", help="Сравнить результаты зеркала и SQLite")
+    parser.add_argument("--db", default=DB_PATH, help="Путь к БД (по умолчанию из config.DB_PATH)")
+    parser.add_argument("--synthetic", type=int, default=0, help="Проверить на синтетической БД из N строк")
+    args = parser.parse_args()
+    if not args.check:
+        parser.print_help()
+        return
+    if np is None:
+        raise SystemExit("NumPy не установлен — зеркало недоступно")
+    if args.synthetic:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "synthetic.db")
+            _build_synthetic(path, args.synthetic)
+            ok = check_equivalence(path, CHECK_QUERIES)
+    else:
+        ok = check_equivalence(args.db, CHECK_QUERIES)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,7 @@
 from typing import Optional
-from openai import AsyncOpenAI
 
-from config import OPENAI_API_KEY, TRANSCRIPTION_MODEL, logger
-
-
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+from config import TRANSCRIPTION_MODEL, logger
+from openai_client import create_transcription
 
 
 async def transcribe_voice(voice_data: bytes, file_name: str = "voice.ogg", language: Optional[str] = None) -> str:
@@ -16,7 +13,7 @@ async def transcribe_voice(voice_data: bytes, file_name: str = "voice.ogg", lang
         }
         if language:
             kwargs["language"] = language
-        transcript = await client.audio.transcriptions.create(**kwargs)
+        transcript = await create_transcription(**kwargs)
         text = transcript.text or ""
         return text.strip()
     except Exception as exc:
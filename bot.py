@@ -1,20 +1,78 @@
+import argparse
 import asyncio
 import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import requests
 
-from config import TELEGRAM_BOT_TOKEN, ALLOWED_CHAT_IDS, logger
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    ALLOWED_CHAT_IDS,
+    QUEUE_WORKERS,
+    QUEUE_POLL_INTERVAL_SEC,
+    QUEUE_VISIBILITY_TIMEOUT_SEC,
+    QUEUE_HEARTBEAT_SEC,
+    QUEUE_DELIVERY_RETRY_SEC,
+    WORKER_CONCURRENCY,
+    WORKER_PREFETCH,
+    ADMISSION_BUSY_QUEUE_DEPTH,
+    ADMISSION_BUSY_WAIT_SEC,
+    EXPORT_ROW_THRESHOLD,
+    METRICS_LOG_INTERVAL_SEC,
+    WARMUP_ENABLED,
+    WARMUP_RETRY_SEC,
+    logger,
+)
+from admission import llm_limiter, message_priority, set_request_priority
 from openai_sql_agent import generate_sql
 from openai_analyst_agent import generate_answer
 from audio_handler import transcribe_voice
 from db import execute_select
+from exporter import export_select, needs_export, wants_xlsx
+from charts import build_chart
+from result_memory import answer_followup, last_context, remember
+from digests import handle_command, init_digests, start_scheduler
+from model_router import can_escalate, choose_tier, model_for, record_escalation
+from openai_client import close_client
+import analytics_mirror
+from warmup import format_report, is_ready, log_report, run_async_step, run_warmup, warm_openai
+import metrics
+from update_queue import (
+    LeaseLostError,
+    complete_job,
+    enqueue_updates,
+    extend_lease,
+    get_offset,
+    init_queue,
+    lease_job,
+    pending_backlog,
+    purge_finished,
+    release_job,
+    save_stage,
+)
 
 
 API_BASE = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
 FILE_BASE = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}"
 
+# Сообщения SQLite о неверном запросе (в отличие от «database is locked», «unable to open» и т.п.)
+_INVALID_SQL_RE = re.compile(
+    r"syntax error|no such (column|function|table)|misuse of|ambiguous column|wrong number of arguments|"
+    r"incomplete input|unrecognized token|near \"",
+    re.IGNORECASE,
+)
+BUSY_REPLY = "Сейчас много запросов — ваш вопрос в очереди, ответ придёт чуть позже."
+
+# Keep-alive сессия Telegram на процесс: после fork соединения родителя не переиспользуем
+_tg_http: Optional[requests.Session] = None
+_tg_http_pid = 0
+
 
 def _is_allowed_chat(chat_id: Any) -> bool:
     if not ALLOWED_CHAT_IDS:
@@ -22,12 +80,27 @@ def _is_allowed_chat(chat_id: Any) -> bool:
     return str(chat_id) in set(str(x) for x in ALLOWED_CHAT_IDS)
 
 
+def _tg() -> requests.Session:
+    global _tg_http, _tg_http_pid
+    if _tg_http is None or _tg_http_pid != os.getpid():
+        _tg_http = requests.Session()
+        _tg_http_pid = os.getpid()
+    return _tg_http
+
+
+def tg_get_me() -> str:
+    """getMe: проверка токена и заодно прогрев TLS-соединения с api.telegram.org."""
+    resp = _tg().get(f"{API_BASE}/getMe", timeout=15)
+    resp.raise_for_status()
+    return "@" + str(resp.json().get("result", {}).get("username", ""))
+
+
 def tg_get_updates(offset: Optional[int] = None, timeout: int = 50) -> List[Dict[str, Any]]:
     params: Dict[str, Any] = {"timeout": timeout}
     if offset is not None:
         params["offset"] = offset
     params["allowed_updates"] = ["message", "channel_post"]
-    resp = requests.get(f"{API_BASE}/getUpdates", params=params, timeout=timeout + 5)
+    resp = _tg().get(f"{API_BASE}/getUpdates", params=params, timeout=timeout + 5)
     resp.raise_for_status()
     body = resp.json()
     if not body.get("ok"):
@@ -41,12 +114,33 @@ def tg_send_message(chat_id: Any, text: str) -> None:
         "text": text,
         "disable_web_page_preview": True,
     }
-    resp = requests.post(f"{API_BASE}/sendMessage", json=payload, timeout=15)
+    resp = _tg().post(f"{API_BASE}/sendMessage", json=payload, timeout=15)
+    resp.raise_for_status()
+
+
+def tg_send_document(chat_id: Any, path: str, file_name: str, caption: str = "") -> None:
+    with open(path, "rb") as fh:
+        resp = _tg().post(
+            f"{API_BASE}/sendDocument",
+            data={"chat_id": chat_id, "caption": caption[:1024]},
+            files={"document": (file_name, fh)},
+            timeout=120,
+        )
+    resp.raise_for_status()
+
+
+def tg_send_photo(chat_id: Any, png: bytes, caption: str = "") -> None:
+    resp = _tg().post(
+        f"{API_BASE}/sendPhoto",
+        data={"chat_id": chat_id, "caption": caption[:1024]},
+        files={"photo": ("chart.png", png, "image/png")},
+        timeout=60,
+    )
     resp.raise_for_status()
 
 
 def tg_get_file(file_id: str) -> str:
-    resp = requests.get(f"{API_BASE}/getFile", params={"file_id": file_id}, timeout=15)
+    resp = _tg().get(f"{API_BASE}/getFile", params={"file_id": file_id}, timeout=15)
     resp.raise_for_status()
     data = resp.json()
     if not data.get("ok"):
@@ -56,7 +150,7 @@ def tg_get_file(file_id: str) -> str:
 
 def tg_download_file(file_path: str) -> bytes:
     url = f"{FILE_BASE}/{file_path}"
-    resp = requests.get(url, timeout=60)
+    resp = _tg().get(url, timeout=60)
     resp.raise_for_status()
     return resp.content
 
@@ -76,106 +170,405 @@ def _format_final_text(answer: str, analysis: str) -> str:
     return answer
 
 
-async def _text_flow_async(text: str) -> str:
-    sql_obj = await generate_sql(text)
-    sql = sql_obj.get("sql") or ""
-    explanation = sql_obj.get("explanation") or ""
+async def _answer_job_async(job: Dict[str, Any], worker_id: str) -> str:
+    """Проходит этапы обработки апдейта, сохраняя прогресс после каждого дорогого шага.
+
+    После рестарта задача продолжается с последнего сохранённого этапа,
+    поэтому транскрибация и вызовы LLM не повторяются.
+    """
+    update_id = job["update_id"]
+    state = job["state"]
+    data = _extract_text_and_voice(job["payload"])
+
+    text = state.get("text") or data.get("text")
+    voice = data.get("voice")
+    if not text and voice:
+        file_id = voice.get("file_id")
+        if not file_id:
+            return "Голосовой файл не найден"
+        logger.info("Incoming voice from chat=%s", job["chat_id"])
+        # качаем файл и транскрибируем
+        file_path = await asyncio.to_thread(tg_get_file, file_id)
+        content = await asyncio.to_thread(tg_download_file, file_path)
+        text = await transcribe_voice(content, file_name="voice.ogg", language=None)
+        if not text:
+            return "Не удалось распознать голосовое сообщение"
+        state["text"] = text
+        await asyncio.to_thread(save_stage, update_id, worker_id, "transcribed", state)
+    if not text:
+        return "Поддерживаются текст и голосовые сообщения."
+
+    if "sql" not in state:
+        logger.info("Incoming text len=%s from chat=%s", len(text), job["chat_id"])
+        # Команды подписки на дайджесты обрабатываются без LLM
+        command_reply = await asyncio.to_thread(handle_command, job["chat_id"], text)
+        if command_reply is not None:
+            return command_reply
+        # Уточнение к прошлому результату чата считаем локально, без SQL и LLM
+        followup = answer_followup(job["chat_id"], text)
+        if followup is not None:
+            chart = await _safe_build_chart(followup["sql"], followup["rows"])
+            if chart:
+                try:
+                    await asyncio.to_thread(tg_send_photo, job["chat_id"], chart)
+                except Exception as exc:
+                    logger.error("sendPhoto error: %s", exc)
+            return followup["text"]
+        previous = last_context(job["chat_id"])
+        # Простые вопросы — быстрой модели, сложные — сильной
+        state["model_tier"] = choose_tier(text, has_previous=bool(previous))
+        sql_obj = await generate_sql(text, previous=previous, model=model_for(state["model_tier"]))
+        if sql_obj.get("api_error"):
+            # Сбой API, а не плохой SQL: сильная модель тут не поможет, этап не сохраняем
+            return sql_obj["explanation"]
+        state["sql"] = sql_obj.get("sql") or ""
+        state["explanation"] = sql_obj.get("explanation") or ""
+        await asyncio.to_thread(save_stage, update_id, worker_id, "sql_generated", state)
+
+    sql = state["sql"]
+    if not sql and can_escalate(state.get("model_tier")):
+        sql = await _escalate_sql(job, worker_id, text, state.get("explanation") or "пустой SQL")
     if not sql:
-        return explanation or "Не удалось сгенерировать SQL."
+        return state.get("explanation") or "Не удалось сгенерировать SQL."
+    if "export_summary" in state:
+        return state["export_summary"]
 
     try:
-        rows = execute_select(sql)
+        # Читаем на строку больше порога, чтобы понять, что результат нужно выгружать файлом
+        rows = await asyncio.to_thread(execute_select, sql, None, EXPORT_ROW_THRESHOLD + 1)
     except Exception as exc:
-        return f"Ошибка выполнения SQL: {exc}"
-
-    analyst = await generate_answer(text, sql, rows)
+        if not can_escalate(state.get("model_tier")) or not _is_invalid_sql(exc):
+            return f"Ошибка выполнения SQL: {exc}"
+        # SQL быстрой модели не прошёл проверку или выполнение — один повтор на сильной модели
+        sql = await _escalate_sql(job, worker_id, text, str(exc))
+        if not sql:
+            return state.get("explanation") or "Не удалось сгенерировать SQL."
+        try:
+            rows = await asyncio.to_thread(execute_select, sql, None, EXPORT_ROW_THRESHOLD + 1)
+        except Exception as exc:
+            return f"Ошибка выполнения SQL: {exc}"
+
+    if needs_export(rows):
+        return await _export_result(job, worker_id, text, sql)
+    remember(job["chat_id"], text, sql, rows)
+
+    # График рендерится в пуле процессов параллельно с ответом аналитика
+    analyst, chart = await asyncio.gather(
+        generate_answer(text, sql, rows, model=model_for(state.get("model_tier") or "fast")),
+        _safe_build_chart(sql, rows),
+    )
+    if chart and not state.get("chart_sent"):
+        # Этап фиксируется до отправки: после рестарта график не уйдёт повторно (не более одного раза)
+        state["chart_sent"] = True
+        await asyncio.to_thread(save_stage, update_id, worker_id, "chart_sent", state)
+        try:
+            await asyncio.to_thread(tg_send_photo, job["chat_id"], chart)
+        except Exception as exc:
+            logger.error("sendPhoto error: %s", exc)
     return _format_final_text(analyst.get("answer", ""), analyst.get("analysis", ""))
 
 
-def handle_text_flow_sync(text: str) -> str:
-    return asyncio.run(_text_flow_async(text))
+def _is_invalid_sql(exc: Exception) -> bool:
+    """Ошибка в самом SQL (проверка или разбор SQLite), а не в окружении: блокировка, диск, недоступная БД."""
+    if isinstance(exc, ValueError):
+        return True  # validate_select_sql
+    return isinstance(exc, sqlite3.Error) and bool(_INVALID_SQL_RE.search(str(exc)))
 
 
-def handle_voice_flow_sync(voice: Dict[str, Any]) -> str:
-    file_id = voice.get("file_id")
-    if not file_id:
-        return "Голосовой файл не найден"
+async def _escalate_sql(job: Dict[str, Any], worker_id: str, question: str, error: str) -> str:
+    """Перегенерирует SQL сильной моделью с текстом ошибки; этап сохраняется, повторной эскалации не будет."""
+    state = job["state"]
+    record_escalation(error)
+    failed = {"sql": state.get("sql") or "", "error": error}
+    sql_obj = await generate_sql(question, previous=last_context(job["chat_id"]), model=model_for("strong"), failed=failed)
+    if sql_obj.get("api_error"):
+        state["explanation"] = sql_obj["explanation"]
+        return ""
+    state["model_tier"] = "strong"
+    state["sql"] = sql_obj.get("sql") or ""
+    state["explanation"] = sql_obj.get("explanation") or ""
+    await asyncio.to_thread(save_stage, job["update_id"], worker_id, "sql_escalated", state)
+    return state["sql"]
 
-    # качаем файл и транскрибируем
-    file_path = tg_get_file(file_id)
-    content = tg_download_file(file_path)
 
-    async def _run() -> str:
-        text = await transcribe_voice(content, file_name="voice.ogg", language=None)
-        if not text:
-            return "Не удалось распознать голосовое сообщение"
-        return await _text_flow_async(text)
+async def _safe_build_chart(sql: str, rows: List[Dict[str, Any]]) -> Optional[bytes]:
+    try:
+        return await build_chart(sql, rows)
+    except Exception as exc:
+        logger.error("Chart: ошибка построения графика: %s", exc)
+        return None
 
-    return asyncio.run(_run())
 
+async def _export_result(job: Dict[str, Any], worker_id: str, question: str, sql: str) -> str:
+    """Большой результат уходит файлом, в чат — только локальная сводка (без вызова аналитика)."""
+    state = job["state"]
+    fmt = "xlsx" if wants_xlsx(question) else "csv"
+    export = await asyncio.to_thread(export_select, sql, None, fmt)
+    try:
+        caption = f"Результат запроса: {export['rows']} строк"
+        await asyncio.to_thread(tg_send_document, job["chat_id"], export["path"], export["file_name"], caption)
+    finally:
+        os.remove(export["path"])
+    reply = "Результат большой — отправил его файлом.\n\n" + export["summary"]
+    state["export_summary"] = reply
+    await asyncio.to_thread(save_stage, job["update_id"], worker_id, "exported", state)
+    return reply
+
+
+def _job_priority(payload: Dict[str, Any], state: Optional[Dict[str, Any]] = None) -> float:
+    data = _extract_text_and_voice(payload)
+    voice = data.get("voice")
+    text = (state or {}).get("text")
+    if voice and not text:
+        return message_priority(voice_duration=int(voice.get("duration") or 0))
+    return message_priority(text=text or data.get("text"))
+
+
+def _notify_busy(chat_ids: List[str], waiting: int, oldest_wait: float) -> None:
+    """«Вопрос в очереди» для новых сообщений, если воркеры не успевают разбирать очередь апдейтов."""
+    logger.info(
+        "Admission: в очереди ждут %s апдейтов (самый старый %.0f с) — уведомляем чаты: %s",
+        waiting, oldest_wait, len(chat_ids),
+    )
+    for chat_id in chat_ids:
+        try:
+            tg_send_message(chat_id, BUSY_REPLY)
+        except Exception as exc:
+            logger.error("sendMessage error: %s", exc)
+
+
+async def process_job(job: Dict[str, Any], worker_id: str) -> None:
+    update_id = job["update_id"]
+    chat_id = job["chat_id"]
+    state = job["state"]
+
+    # Ответ уже посчитан до падения — только доотправляем его
+    reply = state.get("reply")
+    if reply is None:
+        set_request_priority(_job_priority(job["payload"], state))
+        try:
+            reply = await _answer_job_async(job, worker_id)
+        except LeaseLostError:
+            raise
+        except Exception as exc:
+            logger.error("Обработка сообщения завершилась ошибкой: %s", exc)
+            reply = "Произошла ошибка при обработке сообщения."
+        state["reply"] = reply
+        await asyncio.to_thread(save_stage, update_id, worker_id, "answered", state)
+
+    try:
+        logger.info("Reply len=%s to chat=%s", len(reply or ""), chat_id)
+        await asyncio.to_thread(tg_send_message, chat_id, reply)
+    except Exception as exc:
+        # Ответ посчитан и сохранён: задача вернётся в очередь и будет только доотправлена
+        logger.error("sendMessage error: %s — повтор через %.0f с (попытка %s)", exc, QUEUE_DELIVERY_RETRY_SEC, job["attempts"])
+        await asyncio.to_thread(release_job, update_id, worker_id, QUEUE_DELIVERY_RETRY_SEC)
+        return
+    await asyncio.to_thread(complete_job, update_id, worker_id, reply)
+
+
+async def _heartbeat(job: Dict[str, Any], worker_id: str, work: asyncio.Task) -> None:
+    """Продлевает аренду, пока идёт обработка; при потере аренды останавливает задачу."""
+    while True:
+        await asyncio.sleep(QUEUE_HEARTBEAT_SEC)
+        try:
+            await asyncio.to_thread(extend_lease, job["update_id"], worker_id)
+        except LeaseLostError:
+            job["lease_lost"] = True
+            work.cancel()
+            return
+        except Exception as exc:
+            logger.error("Воркер %s: не удалось продлить аренду update_id=%s: %s", worker_id, job["update_id"], exc)
+
+
+async def _run_job(job: Dict[str, Any], worker_id: str) -> None:
+    work = asyncio.create_task(process_job(job, worker_id))
+    heartbeat = asyncio.create_task(_heartbeat(job, worker_id, work))
+    try:
+        await work
+    except asyncio.CancelledError:
+        if not job.get("lease_lost"):
+            raise
+        logger.error("Воркер %s: аренда update_id=%s потеряна — обработка остановлена", worker_id, job["update_id"])
+    except LeaseLostError as exc:
+        # Задачу уже обрабатывает другой воркер — просто бросаем её
+        logger.error("Воркер %s: %s", worker_id, exc)
+    except Exception as exc:
+        # Аренда истечёт, и задача будет выдана повторно
+        logger.error("Воркер %s: ошибка очереди для update_id=%s: %s", worker_id, job["update_id"], exc)
+    finally:
+        heartbeat.cancel()
+
+
+def _job_cap(max_jobs: int) -> int:
+    # Задач в работе чуть больше текущего лимита LLM: лимитер (а не число задач) ограничивает вызовы,
+    # AIMD может расти, а короткий запас в куче ожидания упорядочивается по приоритету
+    return max(1, min(max_jobs, int(llm_limiter.limit) + WORKER_PREFETCH))
+
+
+async def _worker_async(worker_id: str, max_jobs: int, shard: Optional[Tuple[int, int]]) -> None:
+    # Один event loop на процесс: несколько апдейтов обрабатываются параллельно,
+    # а общие лимитеры admission видят всю нагрузку процесса
+    ready = True
+    if WARMUP_ENABLED:
+        # Клиент OpenAI привязан к event loop, поэтому его соединения прогреваются здесь, в loop воркера
+        results = await asyncio.to_thread(run_warmup)
+        results.append(await run_async_step("openai", warm_openai))
+        ready = log_report(results, worker_id)
+    tasks: Set[asyncio.Task] = set()
+    last_metrics = time.monotonic()
+    while True:
+        if time.monotonic() - last_metrics > METRICS_LOG_INTERVAL_SEC:
+            last_metrics = time.monotonic()
+            metrics.log_snapshot(f"[{worker_id}]")
+        if not ready:
+            # Без обязательных шагов (БД) задачи не берём: они остаются в очереди для готовых воркеров
+            await asyncio.sleep(WARMUP_RETRY_SEC)
+            ready = log_report(await asyncio.to_thread(run_warmup), worker_id)
+            continue
+        if len(tasks) >= _job_cap(max_jobs):
+            # с таймаутом: лимит admission может вырасти и без завершения задач
+            await asyncio.wait(tasks, timeout=QUEUE_POLL_INTERVAL_SEC, return_when=asyncio.FIRST_COMPLETED)
+            continue
+        job = await asyncio.to_thread(lease_job, worker_id, QUEUE_VISIBILITY_TIMEOUT_SEC, shard)
+        if job is None:
+            await asyncio.sleep(QUEUE_POLL_INTERVAL_SEC)
+            continue
+        task = asyncio.create_task(_run_job(job, worker_id))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+
+def run_worker(worker_id: str, shard: Optional[Tuple[int, int]] = None) -> None:
+    logger.info(
+        "Воркер %s запущен (в работе лимит LLM + %s, но не больше %s апдейтов; шард %s)",
+        worker_id, WORKER_PREFETCH, WORKER_CONCURRENCY, shard,
+    )
+    try:
+        asyncio.run(_worker_async(worker_id, max(1, WORKER_CONCURRENCY), shard))
+    except KeyboardInterrupt:
+        pass
 
-def main() -> None:
-    if not TELEGRAM_BOT_TOKEN:
-        raise RuntimeError("TELEGRAM_BOT_TOKEN не задан в .env")
 
+def run_poller() -> None:
     logger.info("Старт поллинга Telegram")
-    offset: Optional[int] = None
-    try:
-        while True:
-            try:
-                updates = tg_get_updates(offset=offset, timeout=50)
-            except Exception as e:
-                logger.error("getUpdates error: %s", e)
-                time.sleep(2)
+    offset = get_offset()
+    last_purge = 0.0
+    while True:
+        try:
+            updates = tg_get_updates(offset=offset, timeout=50)
+        except Exception as e:
+            logger.error("getUpdates error: %s", e)
+            time.sleep(2)
+            continue
+
+        if not updates:
+            continue
+
+        batch: List[Dict[str, Any]] = []
+        for upd in updates:
+            data = _extract_text_and_voice(upd)
+            chat_id = data.get("chat_id")
+            if chat_id is None:
                 continue
-
-            if not updates:
+            if not _is_allowed_chat(chat_id):
+                logger.info("Сообщение из неразрешённого чата: %s", chat_id)
                 continue
+            batch.append({
+                "update_id": upd["update_id"],
+                "chat_id": str(chat_id),
+                "payload": upd,
+                "priority": _job_priority(upd),
+            })
+
+        # offset двигаем только вместе с записью в очередь: до коммита Telegram доставит апдейты повторно
+        offset = updates[-1]["update_id"] + 1
+        try:
+            inserted = enqueue_updates(batch, offset)
+            logger.info("Queue: получено %s апдейтов, поставлено в очередь %s", len(updates), len(inserted))
+        except Exception as exc:
+            logger.error("Queue: не удалось сохранить апдейты: %s", exc)
+            offset = get_offset()
+            time.sleep(2)
+            continue
+
+        if inserted:
+            try:
+                # Занятость — по очереди апдейтов: сколько задач ждут воркера без учёта только что добавленных
+                waiting, oldest_wait = pending_backlog(exclude=inserted)
+                if waiting >= ADMISSION_BUSY_QUEUE_DEPTH or (waiting and oldest_wait >= ADMISSION_BUSY_WAIT_SEC):
+                    chat_ids = sorted({job["chat_id"] for job in batch if job["update_id"] in set(inserted)})
+                    threading.Thread(target=_notify_busy, args=(chat_ids, waiting, oldest_wait), daemon=True).start()
+            except Exception as exc:
+                logger.error("Queue: не удалось оценить очередь: %s", exc)
+
+        if time.time() - last_purge > 3600:
+            last_purge = time.time()
+            try:
+                purge_finished()
+            except Exception as exc:
+                logger.error("Queue: ошибка очистки: %s", exc)
 
-            for upd in updates:
-                offset = upd["update_id"] + 1
-                data = _extract_text_and_voice(upd)
-                chat_id = data.get("chat_id")
-                if chat_id is None:
-                    continue
-                if not _is_allowed_chat(chat_id):
-                    logger.info("Сообщение из неразрешённого чата: %s", chat_id)
-                    continue
 
-                text = data.get("text")
-                voice = data.get("voice")
+async def _warm_openai_once() -> Dict[str, Any]:
+    try:
+        return await run_async_step("openai", warm_openai)
+    finally:
+        await close_client()
 
-                try:
-                    if text:
-                        try:
-                            logger.info("Incoming text len=%s from chat=%s", len(text or ""), chat_id)
-                        except Exception:
-                            pass
-                        reply = handle_text_flow_sync(text)
-                    elif voice:
-                        logger.info("Incoming voice from chat=%s", chat_id)
-                        reply = handle_voice_flow_sync(voice)
-                    else:
-                        reply = "Поддерживаются текст и голосовые сообщения."
-                except Exception as exc:
-                    logger.error("Обработка сообщения завершилась ошибкой: %s", exc)
-                    reply = "Произошла ошибка при обработке сообщения."
 
-                try:
-                    try:
-                        logger.info("Reply len=%s to chat=%s", len(reply or ""), chat_id)
-                    except Exception:
-                        pass
-                    tg_send_message(chat_id, reply)
-                except Exception as exc:
-                    logger.error("sendMessage error: %s", exc)
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Telegram SQL-аналитик")
+    parser.add_argument("--role", choices=["all", "poller", "worker"], default="all",
+                        help="all — поллер и пул воркеров; poller/worker — только одна роль")
+    parser.add_argument("--workers", type=int, default=QUEUE_WORKERS, help="Число процессов-воркеров")
+    parser.add_argument("--worker-index", type=int, default=None,
+                        help="Номер воркера 0..workers-1 для --role worker: чаты закрепляются за воркерами")
+    parser.add_argument("--warmup-only", action="store_true",
+                        help="Только прогрев: вывести время шагов и готовность и выйти (для замеров старта)")
+    args = parser.parse_args()
 
-            time.sleep(0.3)
+    if not TELEGRAM_BOT_TOKEN:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN не задан в .env")
+
+    init_queue()
+    init_digests()
+    analytics_mirror.configure(max(1, args.workers))
+    if args.warmup_only:
+        results = run_warmup([("telegram", tg_get_me)])
+        results.append(asyncio.run(_warm_openai_once()))
+        print(format_report(results))
+        raise SystemExit(0 if is_ready(results) else 1)
+    if args.role == "worker":
+        shard = (args.worker_index, args.workers) if args.worker_index is not None else None
+        run_worker(f"worker-{os.getpid()}", shard)
+        return
+
+    if WARMUP_ENABLED:
+        # До запуска воркеров и поллинга: после fork воркеры получают уже прогретое состояние
+        log_report(run_warmup([("telegram", tg_get_me)]), "poller" if args.role == "poller" else "main")
+
+    processes: List[multiprocessing.Process] = []
+    if args.role == "all":
+        for idx in range(max(1, args.workers)):
+            # не daemon: воркеру нужен собственный пул процессов для графиков
+            proc = multiprocessing.Process(target=run_worker, args=(f"worker-{idx}", (idx, args.workers)))
+            proc.start()
+            processes.append(proc)
+        logger.info("Запущено воркеров: %s", len(processes))
+
+    # Планировщик дайджестов живёт в поллере: он один на весь бот
+    start_scheduler(tg_send_message)
+    try:
+        run_poller()
     except KeyboardInterrupt:
         logger.info("Остановлено пользователем")
+    finally:
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            proc.join(timeout=5)
 
 
 if __name__ == "__main__":
     main()
-
-
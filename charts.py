@@ -0,0 +1,227 @@
+from typing import Any, Dict, List, Optional
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from config import (
+    CHARTS_ENABLED,
+    CHART_CACHE_DIR,
+    CHART_CACHE_MAX_AGE_SEC,
+    CHART_CACHE_MAX_MB,
+    CHART_PROCESSES,
+    CHART_MIN_POINTS,
+    CHART_MAX_SERIES,
+    logger,
+)
+from db import get_data_version
+from project_resolver import get_code_to_tag_map
+
+try:
+    import matplotlib  # опционально: без него графики просто не строятся
+except ImportError:
+    matplotlib = None
+
+
+# Метки времени, которые отдают типовые запросы: date(), strftime('%Y-%m'), strftime('%Y-%W')
+_TIME_LABEL = re.compile(r"^\d{4}-\d{2}(-\d{2})?([ T]\d{2}(:\d{2}){0,2})?$")
+_MAX_CATEGORIES = 30
+# Идентификаторы — не метрики, по ним графики не строим
+_NON_METRIC_COLUMNS = {"id", "phone", "google_sheets_id"}
+
+# Очистка кэша не чаще раза в минуту на процесс
+_PRUNE_INTERVAL_SEC = 60
+
+_pool: Optional[ProcessPoolExecutor] = None
+_last_prune = 0.0
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _label(value: Any, names: Dict[str, str]) -> str:
+    text = str(value)
+    return names.get(text) or text
+
+
+def detect_chart(rows: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Определяет форму результата: временной ряд (в т.ч. с разбивкой по категории) или группировка.
+
+    Возвращает готовую к отрисовке спецификацию с данными либо None, если график не нужен.
+    """
+    if not rows or len(rows) < CHART_MIN_POINTS:
+        return None
+    columns = list(rows[0].keys())
+    numeric = [c for c in columns if c.lower() not in _NON_METRIC_COLUMNS and all(r[c] is None or _is_number(r[c]) for r in rows)
+               and any(_is_number(r[c]) for r in rows)]
+    labels = [c for c in columns if c not in numeric and all(isinstance(r[c], str) for r in rows)]
+    if not numeric or not labels:
+        return None
+
+    time_cols = [c for c in labels if all(_TIME_LABEL.match(r[c]) for r in rows)]
+    names = get_code_to_tag_map()
+    if time_cols:
+        x_col = time_cols[0]
+        x_values = sorted({r[x_col] for r in rows})
+        if len(x_values) < CHART_MIN_POINTS:
+            return None
+        categories = [c for c in labels if c != x_col]
+        if categories:
+            # Длинный формат (период, категория, значение) → по линии на категорию
+            cat_col, value_col = categories[0], numeric[0]
+            totals: Dict[str, float] = {}
+            for r in rows:
+                totals[r[cat_col]] = totals.get(r[cat_col], 0) + (r[value_col] or 0)
+            top = sorted(totals, key=lambda k: -totals[k])[:CHART_MAX_SERIES]
+            series = {}
+            for cat in top:
+                points = {r[x_col]: r[value_col] or 0 for r in rows if r[cat_col] == cat}
+                series[_label(cat, names)] = [points.get(x, 0) for x in x_values]
+            title = f"{value_col} по {cat_col}"
+        else:
+            by_x = {r[x_col]: r for r in rows}
+            series = {c: [by_x[x][c] or 0 for x in x_values] for c in numeric[:CHART_MAX_SERIES]}
+            title = ", ".join(series)
+        return {"kind": "line", "x_label": x_col, "x": x_values, "series": series, "title": title}
+
+    cat_col = labels[0]
+    if len(rows) > _MAX_CATEGORIES or len({r[cat_col] for r in rows}) != len(rows):
+        return None
+    value_col = numeric[0]
+    ordered = sorted(rows, key=lambda r: r[value_col] or 0)
+    return {
+        "kind": "bar",
+        "x_label": cat_col,
+        "x": [_label(r[cat_col], names) for r in ordered],
+        "series": {value_col: [r[value_col] or 0 for r in ordered]},
+        "title": f"{value_col} по {cat_col}",
+    }
+
+
+def render_chart_png(spec: Dict[str, Any]) -> bytes:
+    """Рисует PNG. Выполняется в отдельном процессе, поэтому matplotlib импортируется здесь."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(9, 5), dpi=110)
+    try:
+        if spec["kind"] == "line":
+            positions = list(range(len(spec["x"])))
+            for name, values in spec["series"].items():
+                ax.plot(positions, values, marker="o", markersize=3, label=name)
+            step = max(1, len(positions) // 12)
+            ax.set_xticks(positions[::step])
+            ax.set_xticklabels(spec["x"][::step], rotation=45, ha="right")
+            if len(spec["series"]) > 1:
+                ax.legend(fontsize=8)
+            ax.grid(alpha=0.3)
+        else:
+            (name, values), = spec["series"].items()
+            ax.barh(spec["x"], values)
+            ax.set_xlabel(name)
+            ax.grid(axis="x", alpha=0.3)
+        ax.set_title(spec["title"])
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, а не fork: воркер многопоточный (логи, to_thread с соединениями БД), fork копировал бы
+        # захваченные другими потоками блокировки
+        _pool = ProcessPoolExecutor(max_workers=max(1, CHART_PROCESSES), mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def prune_cache(max_age_sec: float = CHART_CACHE_MAX_AGE_SEC, max_bytes: float = CHART_CACHE_MAX_MB * 1048576) -> int:
+    """Удаляет графики старше max_age_sec, затем самые давно использованные сверх max_bytes; число удалённых."""
+    try:
+        names = os.listdir(CHART_CACHE_DIR)
+    except FileNotFoundError:
+        return 0
+    now = time.time()
+    files = []
+    removed = 0
+    for name in names:
+        if not (name.endswith(".png") or name.endswith(".tmp")):
+            continue
+        path = os.path.join(CHART_CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if now - st.st_mtime > max_age_sec:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        elif name.endswith(".png"):
+            files.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+            total -= size
+        except OSError:
+            pass
+    return removed
+
+
+def _cache_path(sql: str) -> str:
+    # Ключ — SQL + версия данных БД: тот же запрос по тем же данным даёт тот же график
+    key = hashlib.sha256(f"{sql}\n{get_data_version()}".encode("utf-8")).hexdigest()
+    return os.path.join(CHART_CACHE_DIR, f"{key}.png")
+
+
+async def build_chart(sql: str, rows: List[Dict[str, Any]]) -> Optional[bytes]:
+    """Возвращает PNG для подходящего результата или None. Рендер идёт в пуле процессов, вне event loop."""
+    if not CHARTS_ENABLED or matplotlib is None:
+        return None
+    spec = detect_chart(rows)
+    if spec is None:
+        return None
+    path = _cache_path(sql)
+    if os.path.exists(path):
+        logger.info("Chart: из кэша %s", os.path.basename(path))
+        try:
+            with open(path, "rb") as fh:
+                png = fh.read()
+            os.utime(path)  # mtime — время последнего использования для вытеснения по размеру
+            return png
+        except OSError:
+            pass  # файл удалила очистка кэша — рендерим заново
+    loop = asyncio.get_running_loop()
+    png = await loop.run_in_executor(_get_pool(), render_chart_png, spec)
+    try:
+        os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+        # Свой временный файл у каждого писателя: один ключ могут рендерить несколько задач процесса
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(png)
+        os.replace(tmp_path, path)
+    except Exception as exc:
+        logger.error("Chart: не удалось сохранить в кэш: %s", exc)
+    global _last_prune
+    if time.monotonic() - _last_prune > _PRUNE_INTERVAL_SEC:
+        _last_prune = time.monotonic()
+        removed = await asyncio.to_thread(prune_cache)
+        if removed:
+            logger.info("Chart: из кэша удалено %s файлов", removed)
+    logger.info("Chart: %s, точек=%s, серий=%s", spec["kind"], len(spec["x"]), len(spec["series"]))
+    return png
@@ -1,7 +1,9 @@
 import os
-import logging
+import tempfile
 from dotenv import load_dotenv
 
+from structured_logging import configure_logger, parse_sampling
+
 # Загружаем .env из корня
 load_dotenv()
 
@@ -9,12 +11,34 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = "gpt-5-mini"  # по требованию
 TRANSCRIPTION_MODEL = "gpt-4o-mini-transcribe"  # по требованию
+# Маршрутизация по сложности вопроса: быстрая и сильная модели (по умолчанию обе — OPENAI_MODEL)
+OPENAI_MODEL_FAST = os.getenv("OPENAI_MODEL_FAST", OPENAI_MODEL)
+OPENAI_MODEL_STRONG = os.getenv("OPENAI_MODEL_STRONG", OPENAI_MODEL)
+MODEL_ROUTER_THRESHOLD = float(os.getenv("MODEL_ROUTER_THRESHOLD", "3"))
 
 # Параметры для Responses API (маппинг max_tokens обработаем в агентах)
 OPENAI_PARAMS = {
     "max_tokens": 50000,
 }
 
+# Общий клиент OpenAI: пул соединений, таймауты по агентам, ретраи и хеджирование
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_CONNECT_TIMEOUT_SEC = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SEC", "10"))
+OPENAI_AGENT_TIMEOUTS = {
+    "sql": float(os.getenv("OPENAI_TIMEOUT_SQL_SEC", "90")),
+    "analyst": float(os.getenv("OPENAI_TIMEOUT_ANALYST_SEC", "120")),
+    "transcription": float(os.getenv("OPENAI_TIMEOUT_TRANSCRIPTION_SEC", "60")),
+}
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_RETRY_BASE_SEC = float(os.getenv("OPENAI_RETRY_BASE_SEC", "0.5"))
+OPENAI_RETRY_MAX_SEC = float(os.getenv("OPENAI_RETRY_MAX_SEC", "8"))
+# Хеджирование: агенты через запятую (например "sql,analyst"); пусто — выключено
+OPENAI_HEDGE_AGENTS = {item.strip() for item in os.getenv("OPENAI_HEDGE_AGENTS", "").split(",") if item.strip()}
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95"))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+METRICS_LOG_INTERVAL_SEC = int(os.getenv("METRICS_LOG_INTERVAL_SEC", "300"))
+
 # Telegram
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 
@@ -28,11 +52,99 @@ if _allowed_from_env:
 # Путь к БД (по умолчанию leads.db в корне проекта)
 DB_PATH = os.getenv("DB_PATH", os.path.join(os.getcwd(), "leads.db"))
 
-# Логирование только в консоль (по требованию)
+# Выгрузка больших результатов файлом вместо текста в чат
+EXPORT_ROW_THRESHOLD = int(os.getenv("EXPORT_ROW_THRESHOLD", "200"))
+EXPORT_CHAR_THRESHOLD = int(os.getenv("EXPORT_CHAR_THRESHOLD", "20000"))
+EXPORT_CSV_DELIMITER = os.getenv("EXPORT_CSV_DELIMITER", ";")
+EXPORT_DIR = os.getenv("EXPORT_DIR", tempfile.gettempdir())
+
+# Графики для временных рядов и группировок (нужен matplotlib)
+CHARTS_ENABLED = os.getenv("CHARTS_ENABLED", "1") == "1"
+CHART_PROCESSES = int(os.getenv("CHART_PROCESSES", "1"))
+CHART_MIN_POINTS = int(os.getenv("CHART_MIN_POINTS", "4"))
+CHART_MAX_SERIES = int(os.getenv("CHART_MAX_SERIES", "8"))
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tg_sql_analyst_charts"))
+# Ключ кэша меняется с каждой записью в leads: старые графики удаляются по возрасту и по общему размеру
+CHART_CACHE_MAX_AGE_SEC = int(os.getenv("CHART_CACHE_MAX_AGE_SEC", "86400"))
+CHART_CACHE_MAX_MB = float(os.getenv("CHART_CACHE_MAX_MB", "50"))
+
+# Память последних результатов по чатам для уточняющих вопросов
+RESULT_MEMORY_PER_CHAT = int(os.getenv("RESULT_MEMORY_PER_CHAT", "3"))
+RESULT_MEMORY_BUDGET_MB = float(os.getenv("RESULT_MEMORY_BUDGET_MB", "64"))
+RESULT_MEMORY_MAX_ROWS = int(os.getenv("RESULT_MEMORY_MAX_ROWS", "50000"))
+RESULT_MEMORY_TTL_SEC = int(os.getenv("RESULT_MEMORY_TTL_SEC", "3600"))
+
+# Колоночное зеркало leads в памяти для COUNT/GROUP BY (нужен numpy; иначе всё идёт в SQLite).
+# Своя копия в каждом воркере (~20 байт на строку): 1 — всегда, 0 — никогда, auto — только при одном воркере
+ANALYTICS_MIRROR_ENABLED = os.getenv("ANALYTICS_MIRROR_ENABLED", "auto").strip().lower()
+# Переписывание date(created_at)/strftime(..., created_at) в диапазоны по индексу created_at
+SQL_REWRITE_ENABLED = os.getenv("SQL_REWRITE_ENABLED", "1") == "1"
+
+# Помесячные шарды leads: путь к manifest.json (пусто — одна БД DB_PATH) и потоки для запросов по шардам
+SHARD_MANIFEST_PATH = os.getenv("SHARD_MANIFEST_PATH", "")
+SHARD_QUERY_THREADS = int(os.getenv("SHARD_QUERY_THREADS", "4"))
+
+# Профиль данных leads (статистика колонок) для промпта SQL-агента
+PROFILE_CACHE_PATH = os.getenv("PROFILE_CACHE_PATH", os.path.join(tempfile.gettempdir(), "tg_sql_analyst_profile.json"))
+PROFILE_REFRESH_SEC = int(os.getenv("PROFILE_REFRESH_SEC", "300"))
+PROFILE_FULL_REFRESH_SEC = int(os.getenv("PROFILE_FULL_REFRESH_SEC", "86400"))
+PROFILE_MAX_DISTINCT = int(os.getenv("PROFILE_MAX_DISTINCT", "30"))
+
+# Локальная БД состояния бота: очередь апдейтов, прогресс этапов и результаты
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(os.getcwd(), "bot_state.db"))
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", "2"))
+QUEUE_VISIBILITY_TIMEOUT_SEC = int(os.getenv("QUEUE_VISIBILITY_TIMEOUT_SEC", "300"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+# Пока задача обрабатывается, аренда продлевается с этим интервалом (долгие вызовы LLM дольше таймаута аренды)
+QUEUE_HEARTBEAT_SEC = float(os.getenv("QUEUE_HEARTBEAT_SEC", str(max(1, QUEUE_VISIBILITY_TIMEOUT_SEC // 3))))
+# Пауза перед повторной отправкой недоставленного ответа
+QUEUE_DELIVERY_RETRY_SEC = float(os.getenv("QUEUE_DELIVERY_RETRY_SEC", "30"))
+QUEUE_POLL_INTERVAL_SEC = float(os.getenv("QUEUE_POLL_INTERVAL_SEC", "0.5"))
+# Апдейты чата достаются «своему» воркеру (там его память результатов); чужой забирает их после паузы
+QUEUE_AFFINITY_GRACE_SEC = float(os.getenv("QUEUE_AFFINITY_GRACE_SEC", "20"))
+# Сколько апдейтов воркер держит в работе: текущий лимит LLM admission + WORKER_PREFETCH, но не больше WORKER_CONCURRENCY.
+# Потолок выше LLM_CONCURRENCY_MAX, чтобы AIMD мог дорасти до максимума, а не упирался в число задач
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "32"))
+WORKER_PREFETCH = int(os.getenv("WORKER_PREFETCH", "2"))
+# Порядок выдачи задач: priority (короткий текст раньше, голос позже) минус столько за каждую секунду ожидания
+QUEUE_PRIORITY_AGING_PER_SEC = float(os.getenv("QUEUE_PRIORITY_AGING_PER_SEC", "10"))
+
+# Дайджесты по подпискам: время отправки в часовом поясе DIGEST_TZ, недельный — в день DIGEST_WEEKDAY (0 — понедельник)
+DIGEST_ENABLED = os.getenv("DIGEST_ENABLED", "1") == "1"
+DIGEST_TIME = os.getenv("DIGEST_TIME", "09:00")
+DIGEST_TZ = os.getenv("DIGEST_TZ", "Europe/Moscow")
+DIGEST_WEEKDAY = int(os.getenv("DIGEST_WEEKDAY", "0"))
+DIGEST_SEND_RATE_PER_SEC = float(os.getenv("DIGEST_SEND_RATE_PER_SEC", "20"))
+DIGEST_CHECK_INTERVAL_SEC = int(os.getenv("DIGEST_CHECK_INTERVAL_SEC", "30"))
+# Пауза после неудачной отправки дайджеста растёт вдвое с каждой ошибкой подряд, до потолка
+DIGEST_RETRY_BASE_SEC = float(os.getenv("DIGEST_RETRY_BASE_SEC", "60"))
+DIGEST_RETRY_MAX_SEC = float(os.getenv("DIGEST_RETRY_MAX_SEC", "3600"))
+
+# Прогрев перед поллингом/обработкой: маппинг проектов, страницы leads и индексов, зеркало, профиль, HTTPS-соединения
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_RECENT_ROWS = int(os.getenv("WARMUP_RECENT_ROWS", "50000"))
+# Воркер, не прошедший обязательные шаги прогрева, не берёт задачи и повторяет прогрев с этой паузой
+WARMUP_RETRY_SEC = float(os.getenv("WARMUP_RETRY_SEC", "10"))
+
+# Admission control для вызовов OpenAI (лимиты на процесс, подстраиваются AIMD)
+LLM_CONCURRENCY_INITIAL = int(os.getenv("LLM_CONCURRENCY_INITIAL", "4"))
+LLM_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "1"))
+LLM_CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", "16"))
+LLM_LATENCY_TARGET_SEC = float(os.getenv("LLM_LATENCY_TARGET_SEC", "30"))
+TRANSCRIPTION_CONCURRENCY_INITIAL = int(os.getenv("TRANSCRIPTION_CONCURRENCY_INITIAL", "2"))
+TRANSCRIPTION_CONCURRENCY_MIN = int(os.getenv("TRANSCRIPTION_CONCURRENCY_MIN", "1"))
+TRANSCRIPTION_CONCURRENCY_MAX = int(os.getenv("TRANSCRIPTION_CONCURRENCY_MAX", "8"))
+TRANSCRIPTION_LATENCY_TARGET_SEC = float(os.getenv("TRANSCRIPTION_LATENCY_TARGET_SEC", "15"))
+# Если в очереди апдейтов столько задач ждут воркера (или самая старая ждёт ADMISSION_BUSY_WAIT_SEC),
+# новому сообщению сразу уходит «занято, вопрос в очереди». Глубина ожидания лимитера — для хеджирования
+ADMISSION_BUSY_QUEUE_DEPTH = int(os.getenv("ADMISSION_BUSY_QUEUE_DEPTH", "4"))
+ADMISSION_BUSY_WAIT_SEC = float(os.getenv("ADMISSION_BUSY_WAIT_SEC", "20"))
+
+# Логирование только в консоль (по требованию); вывод — из фонового потока через очередь
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
-logger = logging.getLogger("tg_sql_analyst")
-if not logger.handlers:
-    handler = logging.StreamHandler()
-    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
-    logger.addHandler(handler)
-logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
\ No newline at end of file
+# text — прежний формат строк, json — структурированные записи
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Доля INFO-записей по категориям, например "sql=0.2,payload=0.05,model_output=0.1" (по умолчанию пишем всё)
+LOG_SAMPLING = parse_sampling(os.getenv("LOG_SAMPLING", ""))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+logger = configure_logger("tg_sql_analyst", LOG_LEVEL, LOG_FORMAT, LOG_SAMPLING, LOG_QUEUE_SIZE)
\ No newline at end of file
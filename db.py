@@ -1,11 +1,15 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 import os
 import sqlite3
+from contextlib import contextmanager
 import sqlparse
 from sqlparse.sql import Statement, Identifier, IdentifierList
 from sqlparse import tokens as T
 
 from config import DB_PATH, logger
+import analytics_mirror
+import shards
+import sql_rewriter
 
 
 def _to_uri_readonly(db_path: str) -> str:
@@ -84,24 +88,67 @@ def validate_select_sql(sql: str) -> str:
     return clean
 
 
-def execute_select(sql: str, params: Optional[tuple] = None) -> List[Dict[str, Any]]:
+def get_data_version(db_path: str = DB_PATH) -> str:
+    """Дешёвая версия данных БД: меняется при любой записи (mtime/размер файла и WAL)."""
+    if shards.enabled() and db_path == DB_PATH:
+        return shards.data_version()
+    parts = []
+    for path in (db_path, db_path + "-wal"):
+        try:
+            st = os.stat(path)
+            parts.append(f"{st.st_mtime_ns}:{st.st_size}")
+        except OSError:
+            parts.append("-")
+    return "/".join(parts)
+
+
+@contextmanager
+def select_cursor(sql: str, params: Optional[tuple] = None) -> Iterator[sqlite3.Cursor]:
+    """Открывает read-only курсор по проверенному SELECT; строки читаются лениво (для потоковой выгрузки)."""
     query = validate_select_sql(sql)
+    if shards.enabled():
+        with shards.select_cursor(query, params) as cur:
+            yield cur
+        return
+    uri = _to_uri_readonly(DB_PATH)
+
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        query = sql_rewriter.rewrite_for_index(query, conn, get_data_version())
+        logger.info("SQL(read-only, cursor) → %s; params=%s", query, (params or ()), extra={"category": "sql"})
+        cur = conn.cursor()
+        cur.execute(query, params or tuple())
+        yield cur
+    finally:
+        conn.close()
+
+
+def execute_select(sql: str, params: Optional[tuple] = None, max_rows: Optional[int] = None) -> List[Dict[str, Any]]:
+    query = validate_select_sql(sql)
+    if shards.enabled():
+        # Данные разложены по месяцам: отсечение по датам и параллельный запрос к шардам
+        return shards.execute_sharded(query, params, max_rows)
+    # Типовые агрегаты по leads считаем на колоночном зеркале; всё остальное — в SQLite
+    mirrored = analytics_mirror.try_execute(query, params)
+    if mirrored is not None:
+        return mirrored[:max_rows] if max_rows else mirrored
     uri = _to_uri_readonly(DB_PATH)
-    logger.info("SQL(read-only) → %s; params=%s", query, (params or ()))
 
     # URI режим
     conn = sqlite3.connect(uri, uri=True)
     try:
+        # date(created_at) = X → created_at >= X AND created_at < X+1 день (ищется по индексу)
+        query = sql_rewriter.rewrite_for_index(query, conn, get_data_version())
+        logger.info("SQL(read-only) → %s; params=%s", query, (params or ()), extra={"category": "sql"})
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         cur.execute(query, params or tuple())
-        rows = cur.fetchall()
-        logger.info("SQL rows fetched: %s", len(rows) if rows else 0)
+        # max_rows: читаем не больше нужного, чтобы не тянуть в память большие выборки
+        rows = cur.fetchmany(max_rows) if max_rows else cur.fetchall()
+        logger.info("SQL rows fetched: %s", len(rows) if rows else 0, extra={"category": "sql"})
         if not rows:
             return []
         columns = rows[0].keys()
         return [ {col: row[col] for col in columns} for row in rows ]
     finally:
         conn.close()
-
-
@@ -0,0 +1,389 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pytz
+
+from config import (
+    STATE_DB_PATH,
+    DIGEST_ENABLED,
+    DIGEST_TIME,
+    DIGEST_TZ,
+    DIGEST_WEEKDAY,
+    DIGEST_SEND_RATE_PER_SEC,
+    DIGEST_CHECK_INTERVAL_SEC,
+    DIGEST_RETRY_BASE_SEC,
+    DIGEST_RETRY_MAX_SEC,
+    logger,
+)
+from db import execute_select
+from project_resolver import get_code_to_tag_map, get_projects_mapping
+import metrics
+
+
+# Подписки чатов на ежедневные/еженедельные дайджесты по своим проектам.
+# Все подписчики считаются одним сгруппированным запросом к leads, текст собирается локально.
+
+PERIOD_DAILY = "daily"
+PERIOD_WEEKLY = "weekly"
+_PERIODS = {PERIOD_DAILY: "ежедневный", PERIOD_WEEKLY: "еженедельный"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS digest_subscriptions (
+    chat_id       TEXT NOT NULL,
+    period        TEXT NOT NULL,
+    project_codes TEXT NOT NULL,
+    last_sent     TEXT,
+    created_at    REAL NOT NULL,
+    failures      INTEGER NOT NULL DEFAULT 0,  -- неудачные отправки подряд
+    next_attempt  REAL,                        -- раньше этого времени не пробуем (backoff)
+    disabled      TEXT,                        -- причина отключения: бот заблокирован, чат не найден
+    PRIMARY KEY (chat_id, period)
+);
+"""
+# Колонки, добавленные после первой версии таблицы
+_MIGRATIONS = {
+    "failures": "ALTER TABLE digest_subscriptions ADD COLUMN failures INTEGER NOT NULL DEFAULT 0",
+    "next_attempt": "ALTER TABLE digest_subscriptions ADD COLUMN next_attempt REAL",
+    "disabled": "ALTER TABLE digest_subscriptions ADD COLUMN disabled TEXT",
+}
+# Ошибки Telegram, после которых отправка в этот чат не пройдёт никогда
+_PERMANENT_ERRORS = re.compile(r"chat not found|bot was blocked|user is deactivated|bot was kicked|not enough rights", re.IGNORECASE)
+
+USAGE = (
+    "Подписка на дайджест:\n"
+    "/subscribe daily [LR166] [LR165] — каждый день итоги за вчера\n"
+    "/subscribe weekly [LR166] — по понедельникам итоги прошлой недели\n"
+    "/unsubscribe [daily|weekly] — отписаться\n"
+    "/subscriptions — мои подписки"
+)
+
+_COMMAND_RE = re.compile(r"^/(subscribe|unsubscribe|subscriptions)(?:@\w+)?\b\s*(.*)$", re.IGNORECASE | re.DOTALL)
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(STATE_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_digests() -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(STATE_DB_PATH)), exist_ok=True)
+    conn = _connect()
+    try:
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(digest_subscriptions)")}
+        for column, ddl in _MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(ddl)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _resolve_codes(tokens: List[str]) -> Tuple[List[str], List[str]]:
+    """Токены → канонические project_code со скобками; нераспознанные возвращаются отдельно."""
+    mapping = get_projects_mapping()
+    codes: List[str] = []
+    unknown: List[str] = []
+    for token in tokens:
+        key = token.strip().strip(",").lower()
+        if not key:
+            continue
+        code = mapping.get(key) or mapping.get(f"[{key.strip('[]')}]")
+        if code is None:
+            unknown.append(token)
+        elif code not in codes:
+            codes.append(code)
+    return codes, unknown
+
+
+def handle_command(chat_id: Any, text: str) -> Optional[str]:
+    """Обрабатывает /subscribe, /unsubscribe, /subscriptions. None — если это не команда дайджеста."""
+    m = _COMMAND_RE.match((text or "").strip())
+    if not m:
+        return None
+    command, args = m.group(1).lower(), m.group(2).split()
+    chat_id = str(chat_id)
+    conn = _connect()
+    try:
+        if command == "subscriptions":
+            rows = conn.execute(
+                "SELECT period, project_codes, disabled FROM digest_subscriptions WHERE chat_id = ? ORDER BY period",
+                (chat_id,),
+            ).fetchall()
+            if not rows:
+                return "Подписок нет.\n\n" + USAGE
+            lines = [
+                f"{_PERIODS[r['period']]}: {', '.join(json.loads(r['project_codes']))}"
+                + (" (отключена — подпишитесь заново)" if r["disabled"] else "")
+                for r in rows
+            ]
+            return "Ваши подписки:\n" + "\n".join(lines) + f"\n\nОтправка в {DIGEST_TIME} ({DIGEST_TZ})."
+
+        if command == "unsubscribe":
+            periods = [a.lower() for a in args if a.lower() in _PERIODS] or list(_PERIODS)
+            cur = conn.execute(
+                f"DELETE FROM digest_subscriptions WHERE chat_id = ? AND period IN ({','.join('?' * len(periods))})",
+                (chat_id, *periods),
+            )
+            conn.commit()
+            return "Подписка отменена." if cur.rowcount else "Подписок не было."
+
+        if not args or args[0].lower() not in _PERIODS:
+            return USAGE
+        period = args[0].lower()
+        codes, unknown = _resolve_codes(args[1:])
+        if unknown:
+            return f"Не знаю проекты: {', '.join(unknown)}. Коды пишите как [LR166]."
+        if not codes:
+            return USAGE
+        conn.execute(
+            """
+            INSERT INTO digest_subscriptions (chat_id, period, project_codes, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id, period) DO UPDATE SET
+                project_codes = excluded.project_codes, failures = 0, next_attempt = NULL, disabled = NULL
+            """,
+            (chat_id, period, json.dumps(codes, ensure_ascii=False), time.time()),
+        )
+        conn.commit()
+        logger.info("Digest: chat=%s подписан (%s) на %s", chat_id, period, codes)
+        return f"Готово: {_PERIODS[period]} дайджест по {', '.join(codes)} в {DIGEST_TIME} ({DIGEST_TZ})."
+    finally:
+        conn.close()
+
+
+def _period_bounds(period: str, today: date) -> Tuple[date, date, date]:
+    """(начало отчётного периода, его конец [не включая], начало предыдущего периода для сравнения)."""
+    if period == PERIOD_DAILY:
+        start = today - timedelta(days=1)
+        return start, today, start - timedelta(days=1)
+    start = today - timedelta(days=today.weekday() + 7)  # понедельник прошлой недели
+    return start, start + timedelta(days=7), start - timedelta(days=7)
+
+
+def _period_key(period: str, today: date) -> str:
+    # last_sent хранит ключ уже отправленного периода: повторно за тот же период не шлём
+    return _period_bounds(period, today)[0].isoformat()
+
+
+def _due_subscriptions(now_local: datetime) -> List[sqlite3.Row]:
+    hour, minute = (int(x) for x in DIGEST_TIME.split(":"))
+    if (now_local.hour, now_local.minute) < (hour, minute):
+        return []
+    today = now_local.date()
+    periods = [PERIOD_DAILY] + ([PERIOD_WEEKLY] if today.weekday() == DIGEST_WEEKDAY else [])
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT * FROM digest_subscriptions
+            WHERE period IN ({','.join('?' * len(periods))})
+              AND disabled IS NULL AND (next_attempt IS NULL OR next_attempt <= ?)
+            """,
+            (*periods, time.time()),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [r for r in rows if r["last_sent"] != _period_key(r["period"], today)]
+
+
+def _load_counts(subs: List[sqlite3.Row], today: date) -> Dict[Tuple[str, str], Dict[str, int]]:
+    """Один запрос на всех подписчиков: (project_code, день) → {gck_tag: количество}."""
+    codes = sorted({c for r in subs for c in json.loads(r["project_codes"])})
+    start = min(_period_bounds(r["period"], today)[2] for r in subs)
+    placeholders = ",".join("?" * len(codes))
+    # Диапазон по «сырому» created_at, чтобы работал индекс
+    rows = execute_select(
+        f"""
+        SELECT project_code, date(created_at) AS day, gck_tag, COUNT(*) AS cnt
+        FROM leads
+        WHERE created_at >= ? AND created_at < ? AND project_code IN ({placeholders})
+        GROUP BY project_code, day, gck_tag
+        """,
+        (start.isoformat(), today.isoformat(), *codes),
+    )
+    counts: Dict[Tuple[str, str], Dict[str, int]] = {}
+    for r in rows:
+        counts.setdefault((r["project_code"], r["day"]), {})[r["gck_tag"]] = r["cnt"]
+    return counts
+
+
+def _sum_period(counts: Dict[Tuple[str, str], Dict[str, int]], code: str, start: date, end: date) -> Dict[str, int]:
+    total: Dict[str, int] = {}
+    day = start
+    while day < end:
+        for tag, cnt in counts.get((code, day.isoformat()), {}).items():
+            total[tag] = total.get(tag, 0) + cnt
+        day += timedelta(days=1)
+    return total
+
+
+def _fmt_date(value: date) -> str:
+    return value.strftime("%d.%m.%Y")
+
+
+def render_digest(period: str, codes: List[str], counts: Dict[Tuple[str, str], Dict[str, int]], today: date) -> str:
+    start, end, prev_start = _period_bounds(period, today)
+    names = get_code_to_tag_map()
+    if period == PERIOD_DAILY:
+        title = f"Дайджест за {_fmt_date(start)}"
+    else:
+        title = f"Дайджест за неделю {_fmt_date(start)}–{_fmt_date(end - timedelta(days=1))}"
+    lines = [title]
+    for code in codes:
+        current = _sum_period(counts, code, start, end)
+        previous = _sum_period(counts, code, prev_start, start)
+        total, prev_total = sum(current.values()), sum(previous.values())
+        if prev_total:
+            delta = f"{(total - prev_total) / prev_total * 100:+.0f}%"
+        else:
+            delta = "нет данных за прошлый период" if not total else "новые лиды"
+        name = names.get(code)
+        lines.append(f"\n{code}{' ' + name if name else ''}: {total} лидов ({delta}, было {prev_total})")
+        for tag, cnt in sorted(current.items(), key=lambda kv: -kv[1])[:5]:
+            lines.append(f"  {tag}: {cnt}")
+    return "\n".join(lines)
+
+
+class _TokenBucket:
+    """Ограничение скорости отправки (лимиты Telegram ~30 сообщений/с на бота)."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None or response.status_code != 429:
+        return None
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except Exception:
+        return 1.0
+
+
+def _permanent_error(exc: Exception) -> Optional[str]:
+    """Описание ошибки Telegram, если чат недоступен навсегда (403, «chat not found»); иначе None."""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        description = str(response.json().get("description") or "")
+    except Exception:
+        description = response.text or ""
+    if response.status_code == 403 or _PERMANENT_ERRORS.search(description):
+        return f"{response.status_code}: {description}"[:200]
+    return None
+
+
+def _mark_sent(chat_id: str, period: str, key: str) -> None:
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE digest_subscriptions SET last_sent = ?, failures = 0, next_attempt = NULL WHERE chat_id = ? AND period = ?",
+            (key, chat_id, period),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _mark_failed(sub: sqlite3.Row, exc: Exception) -> None:
+    """Постоянная ошибка отключает подписку, временная откладывает следующую попытку (экспоненциально)."""
+    reason = _permanent_error(exc)
+    conn = _connect()
+    try:
+        if reason:
+            conn.execute(
+                "UPDATE digest_subscriptions SET disabled = ? WHERE chat_id = ? AND period = ?",
+                (reason, sub["chat_id"], sub["period"]),
+            )
+            logger.warning("Digest: подписка chat=%s (%s) отключена: %s", sub["chat_id"], sub["period"], reason)
+            metrics.incr("digest.disabled")
+        else:
+            failures = (sub["failures"] or 0) + 1
+            delay = min(DIGEST_RETRY_MAX_SEC, DIGEST_RETRY_BASE_SEC * 2 ** (failures - 1))
+            conn.execute(
+                "UPDATE digest_subscriptions SET failures = ?, next_attempt = ? WHERE chat_id = ? AND period = ?",
+                (failures, time.time() + delay, sub["chat_id"], sub["period"]),
+            )
+            logger.error("Digest: не удалось отправить chat=%s (попытка %s, следующая через %.0fs): %s",
+                         sub["chat_id"], failures, delay, exc)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_due_digests(send: Callable[[str, str], None], now_local: Optional[datetime] = None) -> int:
+    """Считает и отправляет все наступившие дайджесты. Возвращает число отправленных сообщений."""
+    now_local = now_local or datetime.now(pytz.timezone(DIGEST_TZ))
+    subs = _due_subscriptions(now_local)
+    if not subs:
+        return 0
+    today = now_local.date()
+    started = time.monotonic()
+    counts = _load_counts(subs, today)
+    logger.info("Digest: %s подписок, один запрос за %.2fs", len(subs), time.monotonic() - started)
+
+    bucket = _TokenBucket(DIGEST_SEND_RATE_PER_SEC, max(1.0, DIGEST_SEND_RATE_PER_SEC))
+    sent = 0
+    for sub in subs:
+        text = render_digest(sub["period"], json.loads(sub["project_codes"]), counts, today)
+        for attempt in range(3):
+            bucket.take()
+            try:
+                send(sub["chat_id"], text)
+            except Exception as exc:
+                wait = _retry_after(exc)
+                if wait is not None and attempt < 2:
+                    logger.info("Digest: Telegram 429, пауза %.1fs", wait)
+                    time.sleep(wait)
+                    continue
+                metrics.incr("digest.errors")
+                _mark_failed(sub, exc)
+                break
+            _mark_sent(sub["chat_id"], sub["period"], _period_key(sub["period"], today))
+            metrics.incr("digest.sent")
+            sent += 1
+            break
+    return sent
+
+
+def _scheduler_loop(send: Callable[[str, str], None]) -> None:
+    while True:
+        try:
+            run_due_digests(send)
+        except Exception as exc:
+            logger.error("Digest: ошибка планировщика: %s", exc)
+        time.sleep(DIGEST_CHECK_INTERVAL_SEC)
+
+
+def start_scheduler(send: Callable[[str, str], None]) -> Optional[threading.Thread]:
+    """Фоновый поток планировщика; запускается в одном процессе (в поллере)."""
+    if not DIGEST_ENABLED:
+        return None
+    init_digests()
+    thread = threading.Thread(target=_scheduler_loop, args=(send,), name="digest-scheduler", daemon=True)
+    thread.start()
+    logger.info("Digest: планировщик запущен (%s %s, еженедельно в день %s)", DIGEST_TIME, DIGEST_TZ, DIGEST_WEEKDAY)
+    return thread
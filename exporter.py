@@ -0,0 +1,164 @@
+from typing import Any, Dict, List, Optional
+import csv
+import gzip
+import os
+import re
+import tempfile
+import time
+from collections import Counter
+
+from config import EXPORT_DIR, EXPORT_CSV_DELIMITER, EXPORT_ROW_THRESHOLD, EXPORT_CHAR_THRESHOLD, logger
+from db import select_cursor
+from pii import mask_phone
+from project_resolver import get_code_to_tag_map
+
+try:
+    from openpyxl import Workbook  # опционально: выгрузка в XLSX
+except ImportError:
+    Workbook = None
+
+
+# Колонки-идентификаторы не суммируем в сводке
+_NON_METRIC_COLUMNS = {"id", "phone", "google_sheets_id"}
+_XLSX_HINT = re.compile(r"xlsx|excel|эксель|иксель", re.IGNORECASE)
+
+
+def needs_export(rows: List[Dict[str, Any]]) -> bool:
+    """Результат слишком большой для чата и для модели-аналитика."""
+    if len(rows) > EXPORT_ROW_THRESHOLD:
+        return True
+    size = 0
+    for row in rows:
+        for value in row.values():
+            size += len(str(value)) + 2
+        if size > EXPORT_CHAR_THRESHOLD:
+            return True
+    return False
+
+
+def wants_xlsx(question: str) -> bool:
+    return bool(_XLSX_HINT.search(question or ""))
+
+
+class _Summary:
+    """Сводка, считаемая на лету при потоковой выгрузке (память не зависит от числа строк)."""
+
+    def __init__(self, columns: List[str]) -> None:
+        self.columns = columns
+        self.rows = 0
+        self.projects: Counter = Counter()
+        self.min_created: Optional[str] = None
+        self.max_created: Optional[str] = None
+        self.sums: Dict[str, float] = {
+            col: 0.0 for col in columns if col.lower() not in _NON_METRIC_COLUMNS
+        }
+        self._idx = {col: i for i, col in enumerate(columns)}
+
+    def add(self, row: tuple) -> None:
+        self.rows += 1
+        idx = self._idx
+        if "project_code" in idx:
+            code = row[idx["project_code"]]
+            if code is not None:
+                self.projects[str(code)] += 1
+        if "created_at" in idx:
+            created = row[idx["created_at"]]
+            if created is not None:
+                created = str(created)
+                if self.min_created is None or created < self.min_created:
+                    self.min_created = created
+                if self.max_created is None or created > self.max_created:
+                    self.max_created = created
+        for col in list(self.sums):
+            value = row[idx[col]]
+            if value is None:
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.sums[col] += value
+            else:
+                # нечисловая колонка — в сводке не суммируем
+                del self.sums[col]
+
+    def render(self, max_projects: int = 10) -> str:
+        lines = [f"Строк: {self.rows}", "Колонки: " + ", ".join(self.columns)]
+        if self.min_created and self.max_created:
+            lines.append(f"Период: {self.min_created} — {self.max_created}")
+        if self.projects:
+            names = get_code_to_tag_map()
+            lines.append("По проектам:")
+            for code, cnt in self.projects.most_common(max_projects):
+                lines.append(f"- {names.get(code) or code}: {cnt}")
+            rest = len(self.projects) - max_projects
+            if rest > 0:
+                lines.append(f"- … и ещё проектов: {rest}")
+        for col, total in self.sums.items():
+            total_fmt = int(total) if float(total).is_integer() else round(total, 2)
+            lines.append(f"Сумма {col}: {total_fmt}")
+        return "\n".join(lines)
+
+
+def _prepare_row(row: tuple, phone_idx: Optional[int]) -> list:
+    values = list(row)
+    if phone_idx is not None:
+        values[phone_idx] = mask_phone(values[phone_idx])
+    return values
+
+
+def _write_csv_gz(cur, columns: List[str], path: str, summary: _Summary) -> None:
+    phone_idx = columns.index("phone") if "phone" in columns else None
+    # utf-8-sig — чтобы Excel корректно открыл кириллицу
+    with gzip.open(path, "wt", encoding="utf-8-sig", newline="") as fh:
+        writer = csv.writer(fh, delimiter=EXPORT_CSV_DELIMITER)
+        writer.writerow(columns)
+        while True:
+            batch = cur.fetchmany(1000)
+            if not batch:
+                break
+            for row in batch:
+                summary.add(row)
+                writer.writerow(_prepare_row(row, phone_idx))
+
+
+def _write_xlsx(cur, columns: List[str], path: str, summary: _Summary) -> None:
+    phone_idx = columns.index("phone") if "phone" in columns else None
+    # write_only: строки сразу уходят во временные файлы openpyxl, а не копятся в памяти
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("result")
+    ws.append(columns)
+    while True:
+        batch = cur.fetchmany(1000)
+        if not batch:
+            break
+        for row in batch:
+            summary.add(row)
+            ws.append(_prepare_row(row, phone_idx))
+    wb.save(path)
+
+
+def export_select(sql: str, params: Optional[tuple] = None, fmt: str = "csv") -> Dict[str, Any]:
+    """Выгружает результат SELECT в файл потоково. Возвращает путь, имя файла и текст сводки."""
+    if fmt == "xlsx" and Workbook is None:
+        logger.info("Export: openpyxl не установлен — выгружаем в CSV")
+        fmt = "csv"
+    suffix = ".xlsx" if fmt == "xlsx" else ".csv.gz"
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="leads_export_", suffix=suffix, dir=EXPORT_DIR)
+    os.close(fd)
+    started = time.monotonic()
+    try:
+        with select_cursor(sql, params) as cur:
+            columns = [d[0] for d in cur.description or []]
+            summary = _Summary(columns)
+            if fmt == "xlsx":
+                _write_xlsx(cur, columns, path, summary)
+            else:
+                _write_csv_gz(cur, columns, path, summary)
+    except Exception:
+        os.remove(path)
+        raise
+    logger.info(
+        "Export: %s строк → %s (%s байт, %.2fs)",
+        summary.rows, os.path.basename(path), os.path.getsize(path), time.monotonic() - started,
+    )
+    file_name = time.strftime("leads_%Y%m%d_%H%M%S") + suffix
+    return {"path": path, "file_name": file_name, "rows": summary.rows, "summary": summary.render()}
@@ -1,10 +1,22 @@
 import os
 import json
+import time
+import hashlib
 import argparse
 import sqlite3
-from typing import Dict, Any, List
+import threading
+import uuid
+from typing import Dict, Any, List, Optional
 
-from config import DB_PATH, logger
+from config import (
+    DB_PATH,
+    PROFILE_CACHE_PATH,
+    PROFILE_REFRESH_SEC,
+    PROFILE_FULL_REFRESH_SEC,
+    PROFILE_MAX_DISTINCT,
+    logger,
+)
+from db import get_data_version
 
 
 def _to_uri_readonly(path: str) -> str:
@@ -99,12 +111,259 @@ def inspect(database_path: str) -> Dict[str, Any]:
         conn.close()
 
 
+# ---------------------------------------------------------------------------
+# Профиль данных leads для SQL-агента
+# ---------------------------------------------------------------------------
+
+# Значения этих колонок в профиль не попадают: PII или поля, которые агент игнорирует
+_NO_VALUES = {"phone", "unused", "check_mark", "google_sheets_id"}
+_TIME_COLUMNS = {"created_at", "updated_at"}
+_FORMAT_TEMPLATE = "YYYY-MM-DDTHH:MM:SS.ffffff"
+_MIN_ID = -(2 ** 63)
+
+
+def _schema_hash(conn: sqlite3.Connection) -> str:
+    rows = conn.execute("SELECT type, name, sql FROM sqlite_master WHERE tbl_name = 'leads' ORDER BY type, name").fetchall()
+    return hashlib.sha256(json.dumps(rows).encode("utf-8")).hexdigest()[:16]
+
+
+def _format_label(sample: str) -> str:
+    """'2025-10-01 12:30' → 'YYYY-MM-DD HH:MM' (цифры заменяются позиционным шаблоном)."""
+    return "".join(
+        (_FORMAT_TEMPLATE[i] if i < len(_FORMAT_TEMPLATE) else "9") if ch.isdigit() else ch
+        for i, ch in enumerate(sample)
+    )
+
+
+def _collect(conn: sqlite3.Connection, columns: List[Dict[str, Any]], after_id: int) -> Dict[str, Any]:
+    """Статистика по строкам с id > after_id (для полного пересчёта after_id = минимум)."""
+    names = [c["name"] for c in columns]
+    select = ", ".join(f'SUM("{n}" IS NULL), MIN("{n}"), MAX("{n}")' for n in names)
+    row = conn.execute(f"SELECT COUNT(*), MAX(id), {select} FROM leads WHERE id > ?", (after_id,)).fetchone()
+    delta: Dict[str, Any] = {"rows": row[0], "max_id": row[1], "columns": {}, "formats": {}}
+    for idx, col in enumerate(columns):
+        name = col["name"]
+        nulls, lo, hi = row[2 + idx * 3: 5 + idx * 3]
+        stats: Dict[str, Any] = {"nulls": nulls or 0}
+        if name not in ("phone", "unused", "check_mark"):
+            stats["min"], stats["max"] = lo, hi
+        if name not in _NO_VALUES and name not in _TIME_COLUMNS and name != "id":
+            values = conn.execute(
+                f'SELECT "{name}", COUNT(*) FROM leads WHERE id > ? GROUP BY 1 ORDER BY 2 DESC LIMIT ?',
+                (after_id, PROFILE_MAX_DISTINCT + 1),
+            ).fetchall()
+            stats["values"] = None if len(values) > PROFILE_MAX_DISTINCT else {str(v): c for v, c in values if v is not None}
+        delta["columns"][name] = stats
+    if "created_at" in names:
+        for length, sep, sample, cnt in conn.execute(
+            "SELECT length(created_at), substr(created_at, 11, 1), MIN(created_at), COUNT(*) FROM leads "
+            "WHERE id > ? GROUP BY 1, 2",
+            (after_id,),
+        ):
+            key = f"{length}|{sep}"
+            delta["formats"][key] = {"label": _format_label(str(sample or "")), "count": cnt}
+    return delta
+
+
+def _merge(profile: Dict[str, Any], delta: Dict[str, Any]) -> None:
+    profile["rows"] += delta["rows"]
+    profile["max_id"] = max(profile["max_id"] or 0, delta["max_id"] or 0) if delta["rows"] else profile["max_id"]
+    for name, stats in delta["columns"].items():
+        target = profile["columns"].setdefault(name, {"nulls": 0})
+        target["nulls"] += stats["nulls"]
+        for bound, pick in (("min", min), ("max", max)):
+            if stats.get(bound) is not None:
+                target[bound] = stats[bound] if target.get(bound) is None else pick(target[bound], stats[bound])
+        if "values" in stats:
+            if target.get("values", {}) is None or stats["values"] is None:
+                target["values"] = None  # стало много различных значений — дальше храним только признак
+            else:
+                merged = dict(target.get("values") or {})
+                for value, cnt in stats["values"].items():
+                    merged[value] = merged.get(value, 0) + cnt
+                target["values"] = merged if len(merged) <= PROFILE_MAX_DISTINCT else None
+    for key, fmt in delta["formats"].items():
+        target_fmt = profile["formats"].setdefault(key, {"label": fmt["label"], "count": 0})
+        target_fmt["count"] += fmt["count"]
+
+
+def _load_cache(cache_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_cache(cache_path: str, profile: Dict[str, Any]) -> None:
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        # Свой временный файл у каждого писателя: обновления из to_thread могут идти параллельно
+        tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(profile, fh, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    except OSError as exc:
+        logger.error("Profile: не удалось сохранить кэш: %s", exc)
+
+
+_refresh_lock = threading.Lock()
+
+
+def profile_leads(database_path: str = DB_PATH, cache_path: str = PROFILE_CACHE_PATH, force: bool = False,
+                  allow_full: bool = True) -> Optional[Dict[str, Any]]:
+    """Профиль таблицы leads с кэшем по (хэш схемы, версия данных).
+
+    Новые строки досчитываются инкрементально по id; при удалениях, смене схемы и раз в
+    PROFILE_FULL_REFRESH_SEC (чтобы учесть UPDATE) профиль пересчитывается целиком.
+    С allow_full=False полный пересчёт не делается: возвращается прежний профиль с пометкой
+    stale (или None, если кэша нет).
+    """
+    version = get_data_version(database_path)
+    cached = _load_cache(cache_path)
+    now = time.time()
+    if cached and not force and cached.get("database_path") == os.path.abspath(database_path):
+        if cached.get("data_version") == version or now - cached.get("computed_at", 0) < PROFILE_REFRESH_SEC:
+            return cached
+
+    started = time.monotonic()
+    conn = sqlite3.connect(_to_uri_readonly(database_path), uri=True)
+    try:
+        schema = _schema_hash(conn)
+        columns = _columns(conn, "leads")
+        total = conn.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+        incremental = (
+            cached is not None and not force
+            and cached.get("database_path") == os.path.abspath(database_path)
+            and cached.get("schema_hash") == schema
+            and now - cached.get("full_at", 0) < PROFILE_FULL_REFRESH_SEC
+        )
+        if incremental:
+            profile = cached
+            delta = _collect(conn, columns, profile["max_id"] or _MIN_ID)
+            if profile["rows"] + delta["rows"] != total:
+                incremental = False  # строки удалялись — инкремент по id неверен
+            else:
+                _merge(profile, delta)
+        if not incremental and not allow_full:
+            return dict(cached, stale=True) if cached else None
+        if not incremental:
+            profile = {
+                "database_path": os.path.abspath(database_path),
+                "schema_hash": schema,
+                "columns_decl": [{"name": c["name"], "type": c["type"], "notnull": c["notnull"], "pk": c["pk"]} for c in columns],
+                "indexes": [i["columns"] for i in _indexes(conn, "leads")],
+                "rows": 0,
+                "max_id": None,
+                "columns": {},
+                "formats": {},
+                "full_at": now,
+            }
+            _merge(profile, _collect(conn, columns, _MIN_ID))
+    finally:
+        conn.close()
+    profile["data_version"] = version
+    profile["computed_at"] = now
+    _save_cache(cache_path, profile)
+    logger.info(
+        "Profile: leads %s (%s строк) за %.2fs", "досчитан" if incremental else "пересчитан", profile["rows"],
+        time.monotonic() - started,
+    )
+    return profile
+
+
+def render_profile(profile: Dict[str, Any], max_values: int = 20) -> str:
+    """Компактный блок схемы и статистики для инструкций SQL-агента."""
+    rows = profile["rows"] or 0
+    stats = profile["columns"]
+
+    def pct(n: int) -> str:
+        return f"{n / rows * 100:.0f}%" if rows else "0%"
+
+    lines = ["СХЕМА И ДАННЫЕ (таблица leads, профиль по реальной БД):"]
+    decl = ", ".join(
+        f"{c['name']} {c['type'] or ''}{' PK' if c['pk'] else ''}{' NOT NULL' if c['notnull'] else ''}".strip()
+        for c in profile["columns_decl"]
+    )
+    lines.append(f"- leads({decl})")
+    lines.append(f"- строк: {rows}; индексы: {', '.join('(' + ', '.join(i) + ')' for i in profile['indexes']) or 'нет'}")
+    for col in profile["columns_decl"]:
+        name = col["name"]
+        st = stats.get(name, {})
+        parts = []
+        if st.get("nulls"):
+            parts.append(f"NULL {pct(st['nulls'])}")
+        if name in _TIME_COLUMNS and st.get("min") is not None:
+            parts.append(f"от {st['min']} до {st['max']}")
+        if name == "created_at" and profile["formats"]:
+            formats = sorted(profile["formats"].values(), key=lambda f: -f["count"])
+            parts.append("форматы: " + ", ".join(f"'{f['label']}' {pct(f['count'])}" for f in formats[:5]))
+        values = st.get("values")
+        if values:
+            top = sorted(values.items(), key=lambda kv: -kv[1])
+            shown = ", ".join(f"{v!r}" for v, _ in top[:max_values])
+            more = f" и ещё {len(top) - max_values}" if len(top) > max_values else ""
+            parts.append(f"значения ({len(top)}): {shown}{more}")
+        elif "values" in st and values is None:
+            parts.append(f"много различных значений (> {PROFILE_MAX_DISTINCT})")
+        if parts:
+            lines.append(f"- {name}: " + "; ".join(parts))
+    if len(profile["formats"]) > 1:
+        lines.append("- created_at хранится в разных форматах: для дат используй date(created_at)/strftime, не сравнивай как строку целиком")
+    return "\n".join(lines)
+
+
+def refresh_in_background() -> bool:
+    """Полный пересчёт профиля в фоновом потоке, не больше одного одновременно; False — уже идёт."""
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+
+    def run() -> None:
+        try:
+            # кэш перечитывается: если профиль уже пересчитал другой воркер, здесь будет только досчёт
+            profile_leads()
+        except Exception as exc:
+            logger.error("Profile: фоновый пересчёт не удался: %s", exc)
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=run, name="profile-refresh", daemon=True).start()
+    return True
+
+
+def get_prompt_profile() -> str:
+    """Блок профиля для промпта SQL-агента; пустая строка, если профиль недоступен.
+
+    На пути запроса профиль только досчитывается по новым строкам. Полный пересчёт уходит в фон,
+    а до его окончания в промпт идёт прежний профиль.
+    """
+    try:
+        profile = profile_leads(allow_full=False)
+    except Exception as exc:
+        logger.error("Profile: не удалось построить профиль leads: %s", exc)
+        return ""
+    if profile is None or profile.get("stale"):
+        if refresh_in_background():
+            logger.info("Profile: нужен полный пересчёт — запущен в фоне, пока используем %s",
+                        "прежний профиль" if profile else "промпт без профиля")
+    return render_profile(profile) if profile else ""
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Инспекция схемы SQLite в JSON")
     parser.add_argument("--db", dest="db", default=DB_PATH, help="Путь к БД (по умолчанию из config.DB_PATH)")
     parser.add_argument("--samples", type=int, default=0, help="Показать до N последних записей по каждой таблице (0 = не показывать)")
+    parser.add_argument("--profile", action="store_true", help="Профиль данных leads (кэшируется) и блок для промпта SQL-агента")
+    parser.add_argument("--refresh", action="store_true", help="С --profile: пересчитать профиль целиком")
     args = parser.parse_args()
 
+    if args.profile:
+        profile = profile_leads(args.db, force=args.refresh)
+        print(json.dumps(profile, ensure_ascii=False, indent=2))
+        print("\n===== Prompt block =====")
+        print(render_profile(profile))
+        return
+
     try:
         info = inspect(args.db)
         print(json.dumps(info, ensure_ascii=False, indent=2))
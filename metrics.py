@@ -0,0 +1,61 @@
+from typing import Deque, Dict, Optional
+import threading
+from collections import defaultdict, deque
+
+from config import logger
+
+
+# Простые метрики процесса: счётчики и скользящее окно значений (латентности).
+# Каждый процесс-воркер ведёт свои метрики и периодически пишет их в лог.
+_WINDOW = 500
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = defaultdict(int)
+_samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=_WINDOW))
+
+
+def incr(name: str, value: int = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float) -> None:
+    with _lock:
+        _samples[name].append(value)
+
+
+def percentile(name: str, pct: float, min_samples: int = 1) -> Optional[float]:
+    with _lock:
+        values = sorted(_samples.get(name) or ())
+    if len(values) < max(1, min_samples):
+        return None
+    idx = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return values[idx]
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    with _lock:
+        counters = dict(_counters)
+        series = {name: sorted(values) for name, values in _samples.items() if values}
+    result: Dict[str, Dict[str, float]] = {"counters": counters}
+    for name, values in series.items():
+        n = len(values)
+        result[name] = {
+            "n": n,
+            "p50": values[int(0.5 * (n - 1))],
+            "p95": values[int(0.95 * (n - 1))],
+            "max": values[-1],
+        }
+    return result
+
+
+def log_snapshot(prefix: str = "") -> None:
+    snap = snapshot()
+    counters = snap.pop("counters", {})
+    if counters:
+        logger.info("Metrics%s counters: %s", prefix, ", ".join(f"{k}={v}" for k, v in sorted(counters.items())))
+    for name, stats in sorted(snap.items()):
+        logger.info(
+            "Metrics%s %s: n=%s p50=%.2f p95=%.2f max=%.2f",
+            prefix, name, stats["n"], stats["p50"], stats["p95"], stats["max"],
+        )
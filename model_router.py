@@ -0,0 +1,113 @@
+from typing import List, Optional, Tuple
+import argparse
+import re
+
+from config import OPENAI_MODEL_FAST, OPENAI_MODEL_STRONG, MODEL_ROUTER_THRESHOLD, logger
+from project_resolver import PROJECT_CODE_RE, get_projects_mapping
+import metrics
+
+
+# Выбор модели по сложности вопроса: простые вопросы — быстрой модели, сложные — сильной.
+# Оценка считается локально по тексту вопроса, без вызова LLM.
+
+_DATE_PATTERNS = [
+    re.compile(r"\b\d{4}-\d{2}(?:-\d{2})?\b"),
+    re.compile(r"\b\d{1,2}[./]\d{1,2}(?:[./]\d{2,4})?\b"),
+    re.compile(r"(?i)\b(январ|феврал|март|апрел|ма[йя]|июн|июл|август|сентябр|октябр|ноябр|декабр)\w*"),
+    re.compile(r"(?i)\b(сегодня|вчера|позавчера|недел\w*|месяц\w*|квартал\w*|год\w*|дн[еяи]\w*|выходн\w*)"),
+]
+# Группы ключевых слов: каждая найденная группа добавляет свой вес
+_KEYWORD_GROUPS: List[Tuple[str, float, re.Pattern]] = [
+    ("comparison", 2.0, re.compile(r"(?i)(сравн\w*|\bvs\b|против|относительно|чем\s+в|разниц\w*|лучше|хуже)")),
+    ("trend", 2.0, re.compile(r"(?i)(динамик\w*|тренд\w*|рост\w*|выро\w*|паден\w*|упа\w*|снизил\w*|измени\w*|прирост\w*)")),
+    ("breakdown", 1.0, re.compile(r"(?i)(в\s+разрезе|по\s+(дням|неделям|месяцам|часам|проектам|тегам)|разбивк\w*|распределени\w*)")),
+    ("ratio", 1.5, re.compile(r"(?i)(дол[яию]\b|процент\w*|%|конверси\w*|средн\w*|медиан\w*|в\s+среднем)")),
+    ("ranking", 1.0, re.compile(r"(?i)(\bтоп\b|рейтинг\w*|больше\s+всего|меньше\s+всего|самы[йхе])")),
+]
+
+
+def _count_entities(text: str) -> int:
+    """Число упомянутых проектов: коды вида [AB123] и известные теги/названия из projects."""
+    found = {code.upper() for code in PROJECT_CODE_RE.findall(text)}
+    lowered = text.lower()
+    try:
+        mapping = get_projects_mapping()
+    except Exception:
+        mapping = {}
+    for key, code in mapping.items():
+        if len(key) >= 4 and not key.startswith("[") and key in lowered:
+            found.add(code.strip("[]").upper())
+    return len(found)
+
+
+def _count_dates(text: str) -> int:
+    return sum(len(pattern.findall(text)) for pattern in _DATE_PATTERNS)
+
+
+def score_question(question: str, has_previous: bool = False) -> Tuple[float, List[str]]:
+    """Оценка сложности вопроса и признаки, которые её дали (для логов)."""
+    text = question or ""
+    score = 0.0
+    reasons: List[str] = []
+    words = len(text.split())
+    if words > 25:
+        score += 2.0
+        reasons.append(f"words={words}")
+    elif words > 12:
+        score += 1.0
+        reasons.append(f"words={words}")
+    entities = _count_entities(text)
+    if entities >= 2:
+        # несколько проектов в одном вопросе — почти всегда сравнение
+        score += 1.0 + min(entities - 2, 2) * 0.5
+        reasons.append(f"entities={entities}")
+    dates = _count_dates(text)
+    if dates >= 2:
+        score += 1.0
+        reasons.append(f"dates={dates}")
+    for name, weight, pattern in _KEYWORD_GROUPS:
+        if pattern.search(text):
+            score += weight
+            reasons.append(name)
+    if has_previous:
+        # уточнение прошлого запроса — модель перестраивает готовый SQL
+        score += 0.5
+        reasons.append("followup")
+    return score, reasons
+
+
+def model_for(tier: str) -> str:
+    return OPENAI_MODEL_STRONG if tier == "strong" else OPENAI_MODEL_FAST
+
+
+def choose_tier(question: str, has_previous: bool = False) -> str:
+    """'fast' или 'strong' для вопроса; метрики router.routed.* и лог с признаками."""
+    score, reasons = score_question(question, has_previous)
+    tier = "strong" if score >= MODEL_ROUTER_THRESHOLD else "fast"
+    metrics.incr(f"router.routed.{tier}")
+    logger.info("Router: score=%.1f (%s) → %s (%s)", score, ", ".join(reasons) or "-", tier, model_for(tier))
+    return tier
+
+
+def can_escalate(tier: Optional[str]) -> bool:
+    """Переход на сильную модель имеет смысл, только если ответила быстрая и модели различаются."""
+    return tier == "fast" and OPENAI_MODEL_FAST != OPENAI_MODEL_STRONG
+
+
+def record_escalation(reason: str) -> None:
+    metrics.incr("router.escalations")
+    logger.info("Router: SQL быстрой модели не прошёл (%s) — повторяем на %s", reason[:200], OPENAI_MODEL_STRONG)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Оценка сложности вопроса и выбор модели")
+    parser.add_argument("question", nargs="+", help="Текст вопроса")
+    args = parser.parse_args()
+    question = " ".join(args.question)
+    score, reasons = score_question(question)
+    tier = "strong" if score >= MODEL_ROUTER_THRESHOLD else "fast"
+    print(f"score={score:.1f} порог={MODEL_ROUTER_THRESHOLD} признаки={', '.join(reasons) or '-'} → {tier} ({model_for(tier)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,17 @@
 from typing import Dict, Any, List
 import json
-from openai import AsyncOpenAI
 
-from config import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_PARAMS, logger
+from config import OPENAI_MODEL, OPENAI_PARAMS, logger
+from openai_client import create_response
 from prompts import ANALYST_SYSTEM_PROMPT
 from project_resolver import get_code_to_tag_map
+from structured_logging import LazyPreview, Truncated
 import re
 
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-
-
-def _build_kwargs(input_text: str) -> Dict[str, Any]:
+def _build_kwargs(input_text: str, model: str = OPENAI_MODEL) -> Dict[str, Any]:
     kwargs: Dict[str, Any] = {
-        "model": OPENAI_MODEL,
+        "model": model,
         "input": input_text,
         "instructions": ANALYST_SYSTEM_PROMPT,
     }
@@ -37,28 +35,9 @@ def _safe_json_loads(text: str) -> Dict[str, Any]:
     return {}
 
 
-def _sanitize_payload_for_log(payload: Dict[str, Any]) -> str:
-    """Возвращает безопасный для логов JSON payload: маскирует возможные PII (например, телефоны)."""
-    try:
-        # Глубокая копия через JSON сериализацию, чтобы не мутировать исходные объекты
-        data = json.loads(json.dumps(payload, ensure_ascii=False))
-        result = data.get("result")
-        if isinstance(result, list):
-            for row in result:
-                if isinstance(row, dict) and "phone" in row:
-                    raw = str(row.get("phone", ""))
-                    # Простая маскировка: оставим первые 2 и последние 2 символа, остальное заменим
-                    if len(raw) >= 4:
-                        row["phone"] = raw[:2] + "***" + raw[-2:]
-                    elif raw:
-                        row["phone"] = "***"
-        # Ограничим длину, чтобы не засорять логи
-        return json.dumps(data, ensure_ascii=False)[:2000]
-    except Exception:
-        try:
-            return str(payload)[:2000]
-        except Exception:
-            return "<payload>"
+def _sanitize_payload_for_log(payload: Dict[str, Any]) -> LazyPreview:
+    """Безопасное для логов превью payload: телефоны маскируются, строится лениво — только при выводе записи."""
+    return LazyPreview(payload, limit=2000, mask_fields=("phone",))
 
 
 def _format_input(user_question: str, sql: str, result_rows: List[Dict[str, Any]], code_names: Dict[str, str]) -> str:
@@ -70,14 +49,13 @@ def _format_input(user_question: str, sql: str, result_rows: List[Dict[str, Any]
         "note": "Отвечай на языке вопроса. В ответе показывай человеко-понятные названия проектов (project_names), а не только коды.",
     }
     # Логируем безопасный превью payload (с маскировкой PII)
-    try:
-        logger.info("Analyst payload preview (sanitized): %s", _sanitize_payload_for_log(payload))
-    except Exception:
-        pass
+    logger.info("Analyst payload preview (sanitized): %s", _sanitize_payload_for_log(payload),
+                extra={"category": "payload"})
     return json.dumps(payload, ensure_ascii=False)
 
 
-async def generate_answer(user_question: str, sql: str, result_rows: List[Dict[str, Any]]) -> Dict[str, str]:
+async def generate_answer(user_question: str, sql: str, result_rows: List[Dict[str, Any]],
+                          model: str = OPENAI_MODEL) -> Dict[str, str]:
     # Построим соответствия кодов -> имена из глобального маппинга, по кодам найденным в result или в тексте SQL
     code2name: Dict[str, str] = {}
     try:
@@ -126,11 +104,11 @@ async def generate_answer(user_question: str, sql: str, result_rows: List[Dict[s
             logger.info("Analyst: sending payload to model (chars=%s)", len(input_text or ""))
         except Exception:
             pass
-        kwargs = _build_kwargs(input_text)
-        resp = await client.responses.create(**kwargs)
+        kwargs = _build_kwargs(input_text, model)
+        resp = await create_response("analyst", **kwargs)
         text = getattr(resp, "output_text", "") or ""
         if text:
-            logger.info("Analyst raw output_text: %s", text[:400].replace("\n", " "))
+            logger.info("Analyst raw output_text: %s", Truncated(text, 400), extra={"category": "model_output"})
         data = _safe_json_loads(text)
         answer = str(data.get("answer") or "").strip()
         analysis = str(data.get("analysis") or "").strip()
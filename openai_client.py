@@ -0,0 +1,199 @@
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+import random
+import time
+
+import httpx
+from openai import (
+    AsyncOpenAI,
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+)
+
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE,
+    OPENAI_CONNECT_TIMEOUT_SEC,
+    OPENAI_AGENT_TIMEOUTS,
+    OPENAI_MAX_RETRIES,
+    OPENAI_RETRY_BASE_SEC,
+    OPENAI_RETRY_MAX_SEC,
+    OPENAI_HEDGE_AGENTS,
+    OPENAI_HEDGE_PERCENTILE,
+    OPENAI_HEDGE_MIN_SAMPLES,
+    logger,
+)
+from admission import AdaptiveLimiter, llm_limiter, transcription_limiter
+import metrics
+
+
+# Один клиент (и один пул соединений) на event loop процесса.
+# httpx-соединения привязаны к loop, поэтому при смене loop клиент пересоздаётся.
+_client: Optional[AsyncOpenAI] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+_RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+async def _close_quietly(client: AsyncOpenAI) -> None:
+    try:
+        await client.close()
+    except Exception as exc:
+        logger.info("OpenAI: старый клиент закрыт с ошибкой: %s", exc)
+
+
+def _close_stale(client: AsyncOpenAI, old_loop: Optional[asyncio.AbstractEventLoop],
+                 loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    """Закрывает пул клиента прежнего loop: в его loop, если тот ещё работает, иначе в текущем."""
+    if old_loop is not None and old_loop.is_running() and not old_loop.is_closed():
+        asyncio.run_coroutine_threadsafe(_close_quietly(client), old_loop)
+    elif loop is not None:
+        loop.create_task(_close_quietly(client))
+
+
+async def close_client() -> None:
+    """Закрывает пул соединений клиента текущего loop (перед завершением asyncio.run)."""
+    global _client, _client_loop
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        client, _client, _client_loop = _client, None, None
+        await _close_quietly(client)
+
+
+def get_client() -> AsyncOpenAI:
+    global _client, _client_loop
+    try:
+        loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if _client is not None and _client_loop is loop:
+        return _client
+    if _client is not None:
+        _close_stale(_client, _client_loop, loop)
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        ),
+        timeout=httpx.Timeout(max(OPENAI_AGENT_TIMEOUTS.values()), connect=OPENAI_CONNECT_TIMEOUT_SEC),
+    )
+    # Ретраи делаем сами (с джиттером и метриками), встроенные в SDK отключаем
+    _client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0)
+    _client_loop = loop
+    return _client
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in _RETRYABLE_STATUSES
+    return False
+
+
+def _retry_delay(exc: BaseException, attempt: int) -> float:
+    # Full jitter: случайная пауза до экспоненциального потолка; Retry-After от сервера уважаем
+    delay = random.uniform(0, min(OPENAI_RETRY_MAX_SEC, OPENAI_RETRY_BASE_SEC * (2 ** attempt)))
+    response = getattr(exc, "response", None)
+    retry_after = None
+    try:
+        retry_after = float(response.headers.get("retry-after")) if response is not None else None
+    except Exception:
+        retry_after = None
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, OPENAI_RETRY_MAX_SEC))
+    return delay
+
+
+def _latency_key(agent: str, model: str) -> str:
+    # Латентность зависит и от агента (длина промпта/ответа), и от модели маршрутизатора
+    return f"openai.{agent}.{model}.latency"
+
+
+async def _attempt(agent: str, model: str, make_call: Callable[[AsyncOpenAI, float], Awaitable[Any]],
+                   limiter: AdaptiveLimiter) -> Any:
+    timeout = OPENAI_AGENT_TIMEOUTS.get(agent, max(OPENAI_AGENT_TIMEOUTS.values()))
+    async with limiter.slot():
+        started = time.monotonic()
+        result = await make_call(get_client(), timeout)
+    latency = time.monotonic() - started
+    metrics.observe(_latency_key(agent, model), latency)
+    metrics.observe(f"openai.model.{model}.latency", latency)
+    return result
+
+
+async def _hedged(agent: str, model: str, make_call: Callable[[AsyncOpenAI, float], Awaitable[Any]],
+                  limiter: AdaptiveLimiter) -> Any:
+    threshold = None
+    if agent in OPENAI_HEDGE_AGENTS:
+        threshold = metrics.percentile(_latency_key(agent, model), OPENAI_HEDGE_PERCENTILE, min_samples=OPENAI_HEDGE_MIN_SAMPLES)
+    if threshold is None:
+        return await _attempt(agent, model, make_call, limiter)
+
+    primary = asyncio.create_task(_attempt(agent, model, make_call, limiter))
+    tasks = [primary]
+    # try сразу после создания задачи: отмена вызывающего (например, потеря аренды) отменяет и запросы
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+        # Под нагрузкой дубликат только усугубит очередь — ждём основной запрос
+        if done or limiter.is_busy():
+            return await primary
+
+        metrics.incr(f"openai.{agent}.hedges")
+        logger.info("OpenAI[%s]: запрос дольше p%s (%.1fs) — отправляем дубликат", agent, OPENAI_HEDGE_PERCENTILE, threshold)
+        hedge = asyncio.create_task(_attempt(agent, model, make_call, limiter))
+        tasks.append(hedge)
+        pending = {primary, hedge}
+        last_exc: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        metrics.incr(f"openai.{agent}.hedge_wins")
+                    return task.result()
+                last_exc = task.exception()
+        assert last_exc is not None
+        raise last_exc
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def _call(agent: str, model: str, make_call: Callable[[AsyncOpenAI, float], Awaitable[Any]],
+                limiter: AdaptiveLimiter) -> Any:
+    metrics.incr(f"openai.{agent}.calls")
+    attempt = 0
+    while True:
+        try:
+            return await _hedged(agent, model, make_call, limiter)
+        except Exception as exc:
+            if attempt >= OPENAI_MAX_RETRIES or not _is_retryable(exc):
+                metrics.incr(f"openai.{agent}.errors")
+                raise
+            delay = _retry_delay(exc, attempt)
+            attempt += 1
+            metrics.incr(f"openai.{agent}.retries")
+            logger.info("OpenAI[%s]: повтор %s/%s через %.1fs после ошибки: %s", agent, attempt, OPENAI_MAX_RETRIES, delay, exc)
+            await asyncio.sleep(delay)
+
+
+async def create_response(agent: str, **kwargs: Any) -> Any:
+    """Responses API через общий клиент: admission control, таймаут агента, ретраи и хеджирование."""
+    return await _call(
+        agent,
+        str(kwargs.get("model") or ""),
+        lambda client, timeout: client.responses.create(timeout=timeout, **kwargs),
+        llm_limiter,
+    )
+
+
+async def create_transcription(**kwargs: Any) -> Any:
+    return await _call(
+        "transcription",
+        str(kwargs.get("model") or ""),
+        lambda client, timeout: client.audio.transcriptions.create(timeout=timeout, **kwargs),
+        transcription_limiter,
+    )
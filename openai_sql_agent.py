@@ -1,20 +1,35 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+import asyncio
 import json
-from openai import AsyncOpenAI
 
-from config import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_PARAMS, logger
+from config import OPENAI_MODEL, OPENAI_PARAMS, logger
+from openai_client import create_response
 from prompts import SQL_AGENT_SYSTEM_PROMPT
 from project_resolver import build_mapping_context
+from inspect_schema import get_prompt_profile
+from structured_logging import Truncated
 
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# Статичный блок схемы в промпте заменяется профилем реальных данных (если он доступен)
+_SCHEMA_BLOCK_START = "СХЕМА (только таблица leads):"
+_SCHEMA_BLOCK_END = "Формат ответа"
 
 
-def _build_kwargs(input_text: str) -> Dict[str, Any]:
+def _build_instructions(profile_block: str) -> str:
+    if not profile_block:
+        return SQL_AGENT_SYSTEM_PROMPT
+    start = SQL_AGENT_SYSTEM_PROMPT.find(_SCHEMA_BLOCK_START)
+    end = SQL_AGENT_SYSTEM_PROMPT.find(_SCHEMA_BLOCK_END)
+    if start == -1 or end == -1:
+        return SQL_AGENT_SYSTEM_PROMPT + "\n\n" + profile_block
+    return SQL_AGENT_SYSTEM_PROMPT[:start] + profile_block + "\n\n" + SQL_AGENT_SYSTEM_PROMPT[end:]
+
+
+def _build_kwargs(input_text: str, instructions: str = SQL_AGENT_SYSTEM_PROMPT, model: str = OPENAI_MODEL) -> Dict[str, Any]:
     kwargs: Dict[str, Any] = {
-        "model": OPENAI_MODEL,
+        "model": model,
         "input": input_text,
-        "instructions": SQL_AGENT_SYSTEM_PROMPT,
+        "instructions": instructions,
     }
     max_tokens = OPENAI_PARAMS.get("max_tokens")
     if isinstance(max_tokens, int) and max_tokens > 0:
@@ -37,7 +52,9 @@ def _safe_json_loads(text: str) -> Dict[str, Any]:
     return {}
 
 
-async def generate_sql(question: str) -> Dict[str, str]:
+async def generate_sql(question: str, previous: Optional[Dict[str, str]] = None, model: str = OPENAI_MODEL,
+                       failed: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """{"sql", "explanation"}; при сбое вызова API ещё "api_error": True — пустой SQL тогда не вина модели."""
     if not question or not isinstance(question, str):
         return {"sql": "", "explanation": "Пустой запрос пользователя"}
 
@@ -51,6 +68,21 @@ async def generate_sql(question: str) -> Dict[str, str]:
             "Важно: значения project_code в БД хранятся в квадратных скобках (пример: '[LR166]')\n"
             "Не используй JOIN, только таблицу leads.\n"
         )
+        if previous and previous.get("sql"):
+            # Возможное уточнение прошлого вопроса этого чата
+            enriched_input += (
+                "\nPREVIOUS_QUESTION:\n" + (previous.get("question") or "").strip() + "\n"
+                "PREVIOUS_SQL:\n" + previous["sql"].strip() + "\n"
+                "Если текущий вопрос — уточнение предыдущего (например, «а теперь по неделям», «только по [LR166]»), "
+                "построй новый запрос на основе PREVIOUS_SQL; иначе игнорируй этот контекст.\n"
+            )
+        if failed:
+            # Повтор на сильной модели: прошлый SQL не прошёл проверку или выполнение
+            enriched_input += (
+                "\nFAILED_SQL:\n" + (failed.get("sql") or "(пусто)").strip() + "\n"
+                "ERROR:\n" + (failed.get("error") or "").strip() + "\n"
+                "Этот SQL не прошёл проверку или выполнение. Составь корректный запрос заново.\n"
+            )
 
         try:
             logger.info(
@@ -60,20 +92,22 @@ async def generate_sql(question: str) -> Dict[str, str]:
         except Exception:
             pass
 
-        kwargs = _build_kwargs(enriched_input)
-        resp = await client.responses.create(**kwargs)
+        # Профиль кэшируется по версии данных; при ошибке остаётся статичная схема из промпта
+        profile_block = await asyncio.to_thread(get_prompt_profile)
+        kwargs = _build_kwargs(enriched_input, _build_instructions(profile_block), model)
+        resp = await create_response("sql", **kwargs)
         text = getattr(resp, "output_text", "") or ""
         if text:
-            logger.info("SQL-agent raw output_text: %s", text[:400].replace("\n", " "))
+            logger.info("SQL-agent raw output_text: %s", Truncated(text, 400), extra={"category": "model_output"})
         data = _safe_json_loads(text)
         sql = str(data.get("sql") or "").strip()
         explanation = str(data.get("explanation") or "").strip()
-        logger.info("SQL-agent parsed: sql=%s | explanation=%s", sql, explanation)
+        logger.info("SQL-agent parsed: sql=%s | explanation=%s", sql, explanation, extra={"category": "sql"})
         if not sql:
             explanation = explanation or ("Не удалось распознать SQL из ответа модели: " + text[:200])
         return {"sql": sql, "explanation": explanation}
     except Exception as exc:
         logger.error("SQL-агент: ошибка Responses API: %s", exc)
-        return {"sql": "", "explanation": "Ошибка при генерации SQL"}
+        return {"sql": "", "explanation": "Ошибка при генерации SQL", "api_error": True}
 
 
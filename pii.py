@@ -0,0 +1,8 @@
+def mask_phone(value) -> str:
+    # Простая маскировка: оставим первые 2 и последние 2 символа, остальное заменим
+    raw = str(value if value is not None else "")
+    if len(raw) >= 4:
+        return raw[:2] + "***" + raw[-2:]
+    if raw:
+        return "***"
+    return raw
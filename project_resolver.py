@@ -1,5 +1,6 @@
 from typing import Dict, Tuple, List
 import os
+import re
 import time
 import sqlite3
 
@@ -7,6 +8,8 @@ from config import DB_PATH, logger
 
 
 _CACHE_TTL_SEC = 300
+# Код проекта в тексте вопроса: две буквы и номер, в скобках или без ([LR166], lr166, AB12)
+PROJECT_CODE_RE = re.compile(r"(?<![A-Za-z])\[?([A-Za-z]{2}\d+)\]?")
 _cache_data: Dict[str, str] = {}
 _cache_code2tag: Dict[str, str] = {}
 _cache_loaded_at: float = 0.0
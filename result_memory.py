@@ -0,0 +1,427 @@
+from typing import Any, Dict, List, Optional, Tuple
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from datetime import date
+
+from config import (
+    RESULT_MEMORY_PER_CHAT,
+    RESULT_MEMORY_BUDGET_MB,
+    RESULT_MEMORY_MAX_ROWS,
+    RESULT_MEMORY_TTL_SEC,
+    logger,
+)
+from project_resolver import PROJECT_CODE_RE, get_code_to_tag_map, get_projects_mapping
+from sql_text import has_comments, mask, single_call, split_clauses, split_select_item, split_top_level
+
+
+# ---------------------------------------------------------------------------
+# Компактное колоночное хранение результата
+# ---------------------------------------------------------------------------
+
+def _encode(values: List[Any]) -> Tuple[str, Any]:
+    """Кодирует колонку: целые/дробные — в array, строки — словарём (значения + коды)."""
+    if values and all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return "i", array("q", values)
+    if values and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return "f", array("d", values)
+    if all(v is None or isinstance(v, str) for v in values):
+        dictionary: List[Optional[str]] = []
+        index: Dict[Optional[str], int] = {}
+        codes = array("I")
+        for v in values:
+            code = index.get(v)
+            if code is None:
+                code = index[v] = len(dictionary)
+                dictionary.append(v)
+            codes.append(code)
+        return "s", (tuple(dictionary), codes)
+    return "o", tuple(values)
+
+
+def _decode(kind: str, data: Any) -> List[Any]:
+    if kind == "s":
+        dictionary, codes = data
+        return [dictionary[c] for c in codes]
+    return list(data)
+
+
+def _nbytes(kind: str, data: Any) -> int:
+    if kind in ("i", "f"):
+        return data.itemsize * len(data) + 64
+    if kind == "s":
+        dictionary, codes = data
+        return codes.itemsize * len(codes) + sum(sys.getsizeof(v) for v in dictionary) + 64
+    return sum(sys.getsizeof(v) for v in data) + 64
+
+
+class ResultSet:
+    """Результат запроса в колоночном виде вместе с вопросом и SQL, которые его породили."""
+
+    def __init__(self, question: str, sql: str, rows: List[Dict[str, Any]], complete: bool = True,
+                 time_grains: Optional[Dict[str, str]] = None) -> None:
+        self.question = question
+        self.sql = sql
+        self.complete = complete  # False — строки обрезаны лимитом, пересчитывать по ним нельзя
+        self.time_grains = time_grains or {}  # известная гранулярность колонок-периодов (после пересчёта)
+        self.created_at = time.time()
+        self.columns: List[str] = list(rows[0].keys()) if rows else []
+        self.row_count = len(rows)
+        self._cols = {c: _encode([r.get(c) for r in rows]) for c in self.columns}
+        self.nbytes = sum(_nbytes(kind, data) for kind, data in self._cols.values()) + sys.getsizeof(sql) + sys.getsizeof(question)
+
+    def column(self, name: str) -> List[Any]:
+        kind, data = self._cols[name]
+        return _decode(kind, data)
+
+    def is_numeric(self, name: str) -> bool:
+        return self._cols[name][0] in ("i", "f")
+
+    def is_text(self, name: str) -> bool:
+        return self._cols[name][0] == "s"
+
+
+class ResultMemory:
+    """Последние результаты по чатам: LRU по чатам плюс бюджет памяти на все чаты процесса."""
+
+    def __init__(self, per_chat: int, budget_bytes: int) -> None:
+        self.per_chat = per_chat
+        self.budget_bytes = budget_bytes
+        self._chats: "OrderedDict[str, deque]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, chat_id: str, result: ResultSet) -> None:
+        with self._lock:
+            items = self._chats.pop(chat_id, None) or deque()
+            items.append(result)
+            self._bytes += result.nbytes
+            while len(items) > self.per_chat:
+                self._bytes -= items.popleft().nbytes
+            self._chats[chat_id] = items
+            # Вытесняем самые давно активные чаты, пока не уложимся в бюджет
+            while self._bytes > self.budget_bytes and self._chats:
+                old_chat, old_items = next(iter(self._chats.items()))
+                if old_chat == chat_id and len(self._chats) == 1:
+                    if len(old_items) <= 1:
+                        break
+                    self._bytes -= old_items.popleft().nbytes
+                    continue
+                self._chats.pop(old_chat)
+                self._bytes -= sum(r.nbytes for r in old_items)
+
+    def last(self, chat_id: str) -> Optional[ResultSet]:
+        with self._lock:
+            items = self._chats.get(chat_id)
+            if not items:
+                return None
+            self._chats.move_to_end(chat_id)
+            result = items[-1]
+        if time.time() - result.created_at > RESULT_MEMORY_TTL_SEC:
+            return None
+        return result
+
+
+_memory = ResultMemory(RESULT_MEMORY_PER_CHAT, int(RESULT_MEMORY_BUDGET_MB * 1024 * 1024))
+
+
+def remember(chat_id: Any, question: str, sql: str, rows: List[Dict[str, Any]], complete: bool = True,
+             time_grains: Optional[Dict[str, str]] = None) -> None:
+    if not rows or len(rows) > RESULT_MEMORY_MAX_ROWS:
+        return
+    _memory.put(str(chat_id), ResultSet(question, sql, rows, complete=complete, time_grains=time_grains))
+
+
+def last_context(chat_id: Any) -> Optional[Dict[str, str]]:
+    """Прошлый вопрос и SQL чата — контекст для SQL-агента, если локально ответить нельзя."""
+    result = _memory.last(str(chat_id))
+    if result is None:
+        return None
+    return {"question": result.question, "sql": result.sql}
+
+
+# ---------------------------------------------------------------------------
+# Локальный пересчёт: фильтр, группировка, разворот, топ-N
+# ---------------------------------------------------------------------------
+
+_FOLLOWUP_MARK = re.compile(r"^\s*(а|и|теперь|только|тоже|также|ещё|еще|то же|and|now|only|what about)\b", re.IGNORECASE)
+_NEW_DATA_HINT = re.compile(
+    r"\d{4}-\d{2}|\d{1,2}\.\d{1,2}|вчера|сегодня|позавчера|\bза\b|\bс\s+\d|\bпо\s+\d|yesterday|today|\blast\b|\bfor\b",
+    re.IGNORECASE,
+)
+_BUCKETS = [
+    ("day", re.compile(r"по\s+(дням|датам|дню)|by\s+day|daily", re.IGNORECASE)),
+    ("week", re.compile(r"по\s+недел|by\s+week|weekly", re.IGNORECASE)),
+    ("month", re.compile(r"по\s+месяц|by\s+month|monthly", re.IGNORECASE)),
+]
+_DIMENSIONS = [
+    ("project_code", re.compile(r"по\s+проект|by\s+project", re.IGNORECASE)),
+    ("gck_tag", re.compile(r"по\s+(гцк|gck)", re.IGNORECASE)),
+    ("project_tag", re.compile(r"по\s+тег|by\s+tag", re.IGNORECASE)),
+]
+_TOP = re.compile(r"(?:топ|top|перв\w*)[\s-]*(\d{1,3})", re.IGNORECASE)
+_PIVOT = re.compile(r"сводн|pivot|в\s+разрезе|таблиц", re.IGNORECASE)
+_EXCLUDE = re.compile(r"\b(без|кроме|except|without)\b", re.IGNORECASE)
+_AGGREGATE_CALL = re.compile(r"\b(count|sum|min|max|avg|total|group_concat)\s*\(", re.IGNORECASE)
+# Суммы по группам снова складываются в суммы, количества — тоже; доли, средние и окна — нет
+_ADDITIVE_FUNCS = {"count", "sum"}
+_TIME_LABEL = re.compile(r"^\d{4}-\d{2}(-\d{2})?")
+_NON_KEY_COLUMNS = {"id", "phone", "google_sheets_id", "unused", "check_mark"}
+_DIMENSION_COLUMNS = ("project_code", "gck_tag", "project_tag")
+_MEASURE = "cnt"
+
+
+def _is_additive(result: ResultSet) -> bool:
+    """Можно ли доагрегировать прошлый результат локально.
+
+    Каждая числовая колонка должна быть ровно COUNT(...) или SUM(...) без DISTINCT, остальные колонки —
+    без агрегатов; без HAVING, LIMIT, DISTINCT и оконных функций. Что не удалось проверить — считаем в SQL.
+    """
+    sql = result.sql.strip().rstrip(";")
+    clauses = None if has_comments(sql) else split_clauses(sql)
+    if clauses is None or "HAVING" in clauses or "LIMIT" in clauses:
+        return False
+    select = clauses["SELECT"]
+    if re.match(r"(?i)DISTINCT\b", select) or re.search(r"(?i)\bOVER\b", mask(select)):
+        return False
+    sources = dict(split_select_item(item)[::-1] for item in split_top_level(select))
+    raw = "GROUP BY" not in clauses and not _AGGREGATE_CALL.search(select)
+    for col in result.columns:
+        expr = sources.get(col)
+        if not (result.is_numeric(col) and col not in _NON_KEY_COLUMNS):
+            if expr is not None and _AGGREGATE_CALL.search(expr):
+                return False  # MIN(created_at), GROUP_CONCAT(...) как разрез не пересчитать
+            continue
+        if expr is None:
+            # cnt — наш подсчёт строк по сырым лидам при прошлом локальном пересчёте
+            if col == _MEASURE and raw:
+                continue
+            return False
+        call = single_call(expr)
+        if call is None or call[0] not in _ADDITIVE_FUNCS:
+            return False
+        if re.match(r"(?i)DISTINCT\b", call[1]) or _AGGREGATE_CALL.search(call[1]):
+            return False
+    return True
+
+
+def _time_column(result: ResultSet) -> Optional[Tuple[str, str]]:
+    """Колонка-период и её гранулярность: day (есть дата), week или month (метка YYYY-NN)."""
+    for col in result.columns:
+        if not result.is_text(col):
+            continue
+        values = [v for v in result.column(col) if v is not None]
+        if not values or not all(_TIME_LABEL.match(v) for v in values):
+            continue
+        if col in result.time_grains:
+            return col, result.time_grains[col]
+        if all(len(v) >= 10 for v in values):
+            return col, "day"
+        return col, ("week" if "%W" in result.sql else "month")
+    return None
+
+
+def _bucket(label: str, source: str, target: str) -> Optional[str]:
+    if source == target:
+        return label[:10] if target == "day" else label
+    if source != "day":
+        return None  # из недель месяцы (и наоборот) честно не получить
+    try:
+        day = date.fromisoformat(label[:10])
+    except ValueError:
+        return None
+    if target == "week":
+        # Как strftime('%Y-%W') в SQLite: недели с понедельника
+        return day.strftime("%Y-%W")
+    return day.strftime("%Y-%m")
+
+
+def _filters(question: str, result: ResultSet) -> List[Tuple[str, set, bool]]:
+    """Ищет в вопросе значения текстовых колонок результата: коды/названия проектов, gck_tag и т.п."""
+    negate = bool(_EXCLUDE.search(question))
+    q_lower = question.lower()
+    found: List[Tuple[str, set, bool]] = []
+    codes = {f"[{m.upper()}]" for m in PROJECT_CODE_RE.findall(question)}
+    mapping = get_projects_mapping()
+    for tag, code in mapping.items():
+        if len(tag) >= 4 and tag in q_lower:
+            codes.add(code)
+    for col in result.columns:
+        if not result.is_text(col) or col in _NON_KEY_COLUMNS:
+            continue
+        distinct = {v for v in result.column(col) if v}
+        if col == "project_code":
+            wanted = {c for c in codes if c in distinct}
+        else:
+            wanted = {v for v in distinct if len(v) >= 3 and v.lower() in q_lower}
+        if wanted:
+            found.append((col, wanted, negate))
+    return found
+
+
+def _plan(question: str, result: ResultSet) -> Optional[Dict[str, Any]]:
+    if not _FOLLOWUP_MARK.search(question) or _NEW_DATA_HINT.search(question):
+        return None
+    if not result.complete or not _is_additive(result):
+        return None
+    plan: Dict[str, Any] = {"bucket": None, "dimension": None, "filters": [], "top": None, "pivot": False}
+    for name, pattern in _BUCKETS:
+        if pattern.search(question):
+            plan["bucket"] = name
+            break
+    for name, pattern in _DIMENSIONS:
+        if pattern.search(question):
+            plan["dimension"] = name
+            break
+    top = _TOP.search(question)
+    if top:
+        plan["top"] = int(top.group(1))
+    plan["pivot"] = bool(_PIVOT.search(question))
+    plan["filters"] = _filters(question, result)
+    if PROJECT_CODE_RE.search(question) and not any(col == "project_code" for col, _, _ in plan["filters"]):
+        return None  # проект назван, но в прошлом результате его нет — нужен новый запрос
+    if not (plan["bucket"] or plan["dimension"] or plan["filters"] or plan["top"]):
+        return None
+    if plan["dimension"] and plan["dimension"] not in result.columns:
+        return None
+    if plan["bucket"]:
+        time_col = _time_column(result)
+        if time_col is None:
+            return None
+        plan["time_column"], plan["time_grain"] = time_col
+    return plan
+
+
+def _apply(plan: Dict[str, Any], result: ResultSet) -> Optional[Dict[str, Any]]:
+    columns = {c: result.column(c) for c in result.columns}
+    measures = [c for c in result.columns if result.is_numeric(c) and c not in _NON_KEY_COLUMNS]
+    keys = [c for c in result.columns if result.is_text(c) and c not in _NON_KEY_COLUMNS]
+    raw = not measures
+    if raw:
+        # Сырые строки лидов: мерой будет количество строк, разрезы — только измерения
+        measures = [_MEASURE]
+        columns[_MEASURE] = [1] * result.row_count
+        keys = [c for c in keys if c in _DIMENSION_COLUMNS]
+
+    idx = list(range(result.row_count))
+    for col, values, negate in plan["filters"]:
+        idx = [i for i in idx if (columns[col][i] in values) != negate]
+
+    time_col = plan.get("time_column")
+    bucket = plan["bucket"]
+    group_keys: List[str] = []
+    if bucket:
+        group_keys.append(time_col)
+    if plan["dimension"]:
+        group_keys.append(plan["dimension"])
+    elif bucket:
+        # «а теперь по неделям» — остальные разрезы прошлого результата сохраняем
+        group_keys += [c for c in keys if c != time_col]
+    elif raw:
+        if not plan["top"] or not keys:
+            return None  # отфильтровать список лидов лучше новым SQL
+        group_keys = keys[:1]
+    else:
+        group_keys = list(keys)
+
+    groups: "OrderedDict[tuple, List[float]]" = OrderedDict()
+    for i in idx:
+        key = []
+        for col in group_keys:
+            value = columns[col][i]
+            if bucket and col == time_col and value is not None:
+                value = _bucket(value, plan["time_grain"], bucket)
+                if value is None:
+                    return None
+            key.append(value)
+        acc = groups.setdefault(tuple(key), [0] * len(measures))
+        for m_idx, m in enumerate(measures):
+            acc[m_idx] += columns[m][i] or 0
+
+    key_names = [bucket if (bucket and c == time_col) else c for c in group_keys]
+    out_cols = key_names + measures
+    rows = [dict(zip(out_cols, list(k) + v)) for k, v in groups.items()]
+    if plan["top"]:
+        rows.sort(key=lambda r: -(r[measures[0]] or 0))
+        rows = rows[: plan["top"]]
+    else:
+        rows.sort(key=lambda r: tuple("" if r[c] is None else str(r[c]) for c in key_names))
+
+    if plan["pivot"] and len(key_names) == 2 and len(measures) == 1:
+        row_key, col_key = key_names
+        pivot: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+        col_values: List[str] = []
+        for r in rows:
+            if str(r[col_key]) not in col_values:
+                col_values.append(str(r[col_key]))
+            pivot.setdefault(r[row_key], {row_key: r[row_key]})[str(r[col_key])] = r[measures[0]]
+        out_cols = [row_key] + col_values
+        rows = [{c: p.get(c, 0) for c in out_cols} for p in pivot.values()]
+
+    ops = []
+    if plan["filters"]:
+        prefix = "без " if plan["filters"][0][2] else "только "
+        ops.append(prefix + ", ".join(sorted(v for _, values, _ in plan["filters"] for v in values)))
+    if bucket:
+        ops.append({"day": "по дням", "week": "по неделям", "month": "по месяцам"}[bucket])
+    if plan["dimension"]:
+        ops.append(f"по {plan['dimension']}")
+    if plan["pivot"]:
+        ops.append("сводная таблица")
+    if plan["top"]:
+        ops.append(f"топ {plan['top']}")
+    grains = {bucket: bucket} if bucket else {}
+    return {"columns": out_cols, "rows": rows, "ops": ", ".join(ops), "time_grains": grains}
+
+
+def _render(columns: List[str], rows: List[Dict[str, Any]], ops: str, max_lines: int = 40) -> str:
+    names = get_code_to_tag_map()
+    lines = [f"Пересчитал прошлый результат ({ops}):"]
+    if not rows:
+        lines.append("- Данных не найдено")
+    for row in rows[:max_lines]:
+        parts = []
+        for col in columns:
+            value = row.get(col)
+            if isinstance(value, str):
+                parts.append(names.get(value) or value)
+            elif isinstance(value, float) and value.is_integer():
+                parts.append(f"{col}={int(value)}")
+            else:
+                parts.append(f"{col}={value}")
+        lines.append("- " + " · ".join(parts))
+    if len(rows) > max_lines:
+        lines.append(f"- … и ещё строк: {len(rows) - max_lines}")
+    return "\n".join(lines)
+
+
+def answer_followup(chat_id: Any, question: str) -> Optional[Dict[str, Any]]:
+    """Пробует ответить на уточнение по закэшированным строкам прошлого результата чата.
+
+    Возвращает {"text", "rows", "sql"} или None, если нужен новый SQL-запрос.
+    """
+    result = _memory.last(str(chat_id))
+    if result is None or not question:
+        return None
+    started = time.monotonic()
+    try:
+        plan = _plan(question, result)
+        if plan is None:
+            return None
+        applied = _apply(plan, result)
+    except Exception as exc:
+        logger.error("Result memory: ошибка локального пересчёта: %s", exc)
+        return None
+    if applied is None:
+        return None
+    rows, ops = applied["rows"], applied["ops"]
+    logger.info(
+        "Result memory: уточнение chat=%s посчитано локально (%s) за %.1f мс: %s → %s строк",
+        chat_id, ops, (time.monotonic() - started) * 1000, result.row_count, len(rows),
+    )
+    sql = f"{result.sql}\n-- локальный пересчёт: {ops}"
+    remember(chat_id, question, result.sql, rows, time_grains=applied["time_grains"])
+    return {"text": _render(applied["columns"], rows, ops), "rows": rows, "sql": sql}
@@ -0,0 +1,550 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date
+
+from config import DB_PATH, SHARD_MANIFEST_PATH, SHARD_QUERY_THREADS, logger
+from sql_text import (
+    created_at_range,
+    has_comments,
+    mask,
+    normalize,
+    single_call,
+    split_clauses,
+    split_conjuncts,
+    split_select_item,
+    split_top_level,
+)
+import metrics
+
+
+# Помесячные шарды таблицы leads: манифест JSON {"shards": [{"month": "2025-10", "path": "leads_2025_10.db"}, ...]}.
+# Пути в манифесте — относительно его каталога. Запрос отсекается по датам из WHERE, выполняется
+# параллельно на оставшихся шардах и сливается во временной in-memory SQLite.
+
+# Агрегаты, которые раскладываются на частичные по шардам и сливаются
+_DECOMPOSABLE = {"count", "sum", "min", "max", "avg", "total"}
+_ANY_AGGREGATE_RE = re.compile(r"\b(count|sum|min|max|avg|total|group_concat)\s*\(", re.IGNORECASE)
+# SQLITE_MAX_ATTACHED (10 по умолчанию): больше шардов ATTACH-ем подключаются пачками
+_MAX_ATTACHED = 10
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_manifest_cache: Dict[str, Any] = {"mtime": None, "shards": []}
+
+
+def enabled() -> bool:
+    return bool(SHARD_MANIFEST_PATH)
+
+
+def load_manifest() -> List[Dict[str, Any]]:
+    """Шарды из манифеста (перечитывается при изменении файла), по возрастанию месяца."""
+    mtime = os.stat(SHARD_MANIFEST_PATH).st_mtime_ns
+    if _manifest_cache["mtime"] != mtime:
+        with open(SHARD_MANIFEST_PATH, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+        base = os.path.dirname(os.path.abspath(SHARD_MANIFEST_PATH))
+        shards = []
+        for item in data.get("shards", []):
+            year, month = (int(x) for x in item["month"].split("-"))
+            shards.append({
+                "month": item["month"],
+                "path": os.path.join(base, item["path"]),
+                "start": date(year, month, 1).isoformat(),
+                "end": date(year + month // 12, month % 12 + 1, 1).isoformat(),
+            })
+        _manifest_cache.update(mtime=mtime, shards=sorted(shards, key=lambda s: s["month"]))
+    return _manifest_cache["shards"]
+
+
+def data_version() -> str:
+    """Версия данных всех шардов — для кэшей (графики и т.п.)."""
+    manifest = load_manifest()
+    parts = [str(_manifest_cache["mtime"])]
+    for shard in manifest:
+        for path in (shard["path"], shard["path"] + "-wal"):
+            try:
+                st = os.stat(path)
+                parts.append(f"{st.st_mtime_ns}:{st.st_size}")
+            except OSError:
+                parts.append("-")
+    return "/".join(parts)
+
+
+def prune(sql: str, shards: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Оставляет шарды, чей месяц пересекается с диапазоном дат из AND-условий WHERE."""
+    clauses = split_clauses(sql)
+    if not clauses or not clauses.get("WHERE"):
+        return shards
+    # Подзапрос или второе обращение к leads видят свои даты, а не диапазон внешнего WHERE
+    code = _STRING_RE.sub("''", sql)
+    if len(re.findall(r"(?i)\bSELECT\b", code)) > 1 or len(re.findall(r"(?i)\bleads\b", code)) > 1:
+        return shards
+    conjuncts = split_conjuncts(clauses["WHERE"])
+    if conjuncts is None:
+        return shards  # есть OR — без отсечения
+    lo, hi = None, None
+    for cond in conjuncts:
+        # Только date(created_at): шард определяется датой, а сравнение сырого текста created_at
+        # с датой не совпадает с ней для значений со смещением часового пояса
+        bounds = created_at_range(cond) if re.match(r"(?i)date\s*\(", cond) else None
+        if bounds is None:
+            continue
+        if bounds[0] and (lo is None or bounds[0] > lo):
+            lo = bounds[0]
+        if bounds[1] and (hi is None or bounds[1] < hi):
+            hi = bounds[1]
+    return [s for s in shards if (lo is None or s["end"] > lo) and (hi is None or s["start"] < hi)]
+
+
+def _connect_ro(path: str) -> sqlite3.Connection:
+    return sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, SHARD_QUERY_THREADS), thread_name_prefix="shard")
+        return _pool
+
+
+def _run_on_shard(shard: Dict[str, Any], sql: str, params: tuple, cap: Optional[int]) -> Tuple[List[str], List[tuple]]:
+    from db import validate_select_sql  # локально: db импортирует этот модуль
+
+    # Проверка и read-only — на каждом шарде, а не только для исходного запроса
+    query = validate_select_sql(sql)
+    conn = _connect_ro(shard["path"])
+    try:
+        cur = conn.execute(query, params)
+        rows = cur.fetchmany(cap) if cap else cur.fetchall()
+        return [d[0] for d in cur.description or []], rows
+    finally:
+        conn.close()
+
+
+def _fan_out(shards: List[Dict[str, Any]], sql: str, params: tuple,
+             cap: Optional[int] = None) -> List[Tuple[List[str], List[tuple]]]:
+    futures = [_get_pool().submit(_run_on_shard, shard, sql, params, cap) for shard in shards]
+    return [f.result() for f in futures]
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _limit_cap(limit: Optional[str]) -> Optional[int]:
+    if not limit:
+        return None
+    m = re.fullmatch(r"(?is)\s*(\d+)\s*(?:(OFFSET|,)\s*(\d+))?\s*", limit)
+    if not m:
+        return None
+    if m.group(2) == ",":
+        return int(m.group(1)) + int(m.group(3))
+    return int(m.group(1)) + int(m.group(3) or 0)
+
+
+def _merge(columns: List[str], rows: List[tuple], merge_sql: str) -> List[Dict[str, Any]]:
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute(f"CREATE TABLE partial ({', '.join(_quote(c) for c in columns)})")
+        conn.executemany(f"INSERT INTO partial VALUES ({', '.join('?' * len(columns))})", rows)
+        conn.row_factory = sqlite3.Row
+        result = conn.execute(merge_sql).fetchall()
+        if not result:
+            return []
+        # как в execute_select: словарь по именам колонок
+        names = result[0].keys()
+        return [{name: row[name] for name in names} for row in result]
+    finally:
+        conn.close()
+
+
+def _plan_aggregate(clauses: Dict[str, str]) -> Optional[Tuple[str, str]]:
+    """Разложение GROUP BY/агрегатов: (запрос частичных агрегатов на шард, запрос слияния) или None."""
+    items = [split_select_item(i) for i in split_top_level(clauses["SELECT"])]
+    group_exprs: List[str] = []
+    for raw in split_top_level(clauses.get("GROUP BY", "")):
+        if raw.isdigit() and 1 <= int(raw) <= len(items):
+            raw = items[int(raw) - 1][0]
+        else:
+            raw = next((expr for expr, name in items if name == raw.strip('"') and expr != name), raw)
+        group_exprs.append(raw)
+    group_norm = [normalize(g) for g in group_exprs]
+
+    partial_cols: List[str] = [f"{g} AS _g{i}" for i, g in enumerate(group_exprs)]
+    merge_cols: List[str] = []
+    names: List[str] = []
+    agg_idx = 0
+    for expr, name in items:
+        norm = normalize(expr)
+        # Раскладываем только «голый» вызов агрегата: COUNT(*) + 1, SUM(x) OVER () и т.п. — целиком через ATTACH
+        call = single_call(expr)
+        if call and call[0] in _DECOMPOSABLE and not re.match(r"(?i)DISTINCT\b", call[1]) \
+                and not _ANY_AGGREGATE_RE.search(call[1]) and split_top_level(call[1]) == [call[1]]:
+            func, arg = call
+            a = f"_a{agg_idx}"
+            agg_idx += 1
+            if func == "avg":
+                partial_cols += [f"SUM({arg}) AS {a}s", f"COUNT({arg}) AS {a}c"]
+                merge_cols.append(f"CASE WHEN SUM({a}c) > 0 THEN CAST(SUM({a}s) AS REAL) / SUM({a}c) END AS {_quote(name)}")
+            else:
+                partial_cols.append(f"{func.upper()}({arg}) AS {a}")
+                merged = {"count": "SUM", "sum": "SUM", "total": "TOTAL", "min": "MIN", "max": "MAX"}[func]
+                merge_cols.append(f"{merged}({a}) AS {_quote(name)}")
+        elif _ANY_AGGREGATE_RE.search(expr):
+            return None  # агрегат внутри выражения (ROUND(AVG(x), 2) и т.п.)
+        elif norm in group_norm:
+            merge_cols.append(f"_g{group_norm.index(norm)} AS {_quote(name)}")
+        else:
+            return None  # «голая» колонка вне GROUP BY
+        names.append(name)
+
+    order_terms: List[str] = []
+    for raw in split_top_level(clauses.get("ORDER BY", "")):
+        m = re.fullmatch(r"(?is)(.+?)(\s+(?:ASC|DESC))?(\s+NULLS\s+(?:FIRST|LAST))?", raw.strip())
+        ref, suffix = m.group(1).strip(), (m.group(2) or "") + (m.group(3) or "")
+        if ref.isdigit():
+            order_terms.append(ref + suffix)
+        elif ref.strip('"') in names:
+            order_terms.append(_quote(ref.strip('"')) + suffix)
+        elif normalize(ref) in [normalize(e) for e, _ in items]:
+            order_terms.append(_quote(names[[normalize(e) for e, _ in items].index(normalize(ref))]) + suffix)
+        elif normalize(ref) in group_norm:
+            order_terms.append(f"_g{group_norm.index(normalize(ref))}" + suffix)
+        else:
+            return None
+
+    where = f" WHERE {clauses['WHERE']}" if clauses.get("WHERE") else ""
+    group_by = f" GROUP BY {', '.join(group_exprs)}" if group_exprs else ""
+    partial_sql = f"SELECT {', '.join(partial_cols)} FROM leads{where}{group_by}"
+    merge_sql = f"SELECT {', '.join(merge_cols)} FROM partial"
+    if group_exprs:
+        merge_sql += " GROUP BY " + ", ".join(f"_g{i}" for i in range(len(group_exprs)))
+    if order_terms:
+        merge_sql += " ORDER BY " + ", ".join(order_terms)
+    if clauses.get("LIMIT"):
+        merge_sql += " LIMIT " + clauses["LIMIT"]
+    return partial_sql, merge_sql
+
+
+def _plan_rows(clauses: Dict[str, str]) -> Optional[Tuple[str, List[Tuple[str, str, str]], bool]]:
+    """Строковый запрос: (запрос на шард со скрытыми колонками сортировки, термы ORDER BY, DISTINCT).
+
+    Терм сортировки — (вид, ссылка, ASC/DESC…): "pos" — номер видимой колонки, "alias" — её алиас,
+    "hidden" — скрытая колонка _oN с выражением сортировки.
+    """
+    select = clauses["SELECT"]
+    distinct = bool(re.match(r"(?i)DISTINCT\b", select))
+    aliases = [name for expr, name in (split_select_item(i) for i in split_top_level(select)) if expr != name]
+    hidden: List[str] = []
+    order_terms: List[Tuple[str, str, str]] = []
+    for i, raw in enumerate(split_top_level(clauses.get("ORDER BY", ""))):
+        m = re.fullmatch(r"(?is)(.+?)(\s+(?:ASC|DESC))?(\s+NULLS\s+(?:FIRST|LAST))?", raw.strip())
+        ref, suffix = m.group(1).strip(), (m.group(2) or "") + (m.group(3) or "")
+        if ref.isdigit():
+            order_terms.append(("pos", ref, suffix))
+        elif ref.strip('"') in aliases:
+            order_terms.append(("alias", ref.strip('"'), suffix))
+        else:
+            hidden.append(f"{ref} AS _o{i}")
+            order_terms.append(("hidden", f"_o{i}", suffix))
+    if distinct and hidden:
+        return None
+    where = f" WHERE {clauses['WHERE']}" if clauses.get("WHERE") else ""
+    order = f" ORDER BY {clauses['ORDER BY']}" if clauses.get("ORDER BY") else ""
+    cap = _limit_cap(clauses.get("LIMIT"))
+    limit = f" LIMIT {cap}" if cap is not None else ""
+    extra = (", " + ", ".join(hidden)) if hidden else ""
+    return f"SELECT {select}{extra} FROM leads{where}{order}{limit}", order_terms, distinct
+
+
+def _execute_decomposed(sql: str, params: tuple, shards: List[Dict[str, Any]],
+                        max_rows: Optional[int]) -> Optional[List[Dict[str, Any]]]:
+    """Запрос, разложенный на части по шардам и слитый в памяти; None — если разложить нельзя."""
+    clauses = split_clauses(sql)
+    if not clauses or clauses.get("HAVING") or re.search(r"(?i)\bOVER\s*\(", sql):
+        return None
+    if clauses.get("FROM", "").strip().strip('"').lower() != "leads" or re.search(r"(?i)\bSELECT\b", clauses["SELECT"]):
+        return None  # подзапросы и JOIN — через ATTACH
+    if clauses.get("WHERE") and re.search(r"(?i)\bSELECT\b", clauses["WHERE"]):
+        return None
+    # Параметры вне WHERE при разложении сменили бы порядок; COLLATE теряется в промежуточной таблице
+    for name, text in clauses.items():
+        if name != "WHERE" and re.search(r"\?|[:@$][A-Za-z_]", mask(text)):
+            return None
+    if re.search(r"(?i)\bCOLLATE\b", mask(clauses.get("ORDER BY", ""))):
+        return None
+    is_aggregate = bool(clauses.get("GROUP BY")) or bool(_ANY_AGGREGATE_RE.search(clauses["SELECT"]))
+
+    if is_aggregate:
+        plan = _plan_aggregate(clauses)
+        if plan is None:
+            return None
+        partial_sql, merge_sql = plan
+        results = _fan_out(shards, partial_sql, params)
+        columns = results[0][0]
+        rows = [row for _, shard_rows in results for row in shard_rows]
+        merged = _merge(columns, rows, merge_sql)
+        return merged[:max_rows] if max_rows else merged
+
+    row_plan = _plan_rows(clauses)
+    if row_plan is None:
+        return None
+    shard_sql, order_terms, distinct = row_plan
+    cap = _limit_cap(clauses.get("LIMIT"))
+    if max_rows and not clauses.get("LIMIT"):
+        cap = max_rows
+    results = _fan_out(shards, shard_sql, params, cap)
+    columns = results[0][0]
+    visible = len(columns) - sum(1 for kind, _, _ in order_terms if kind == "hidden")
+    storage = [f"c{i}" for i in range(visible)] + columns[visible:]
+    rows = [row for _, shard_rows in results for row in shard_rows]
+    select = ", ".join(f"c{i} AS {_quote(columns[i])}" for i in range(visible))
+    order = []
+    for kind, ref, suffix in order_terms:
+        if kind == "pos":
+            order.append(f"c{int(ref) - 1}" + suffix)
+        elif kind == "alias":
+            order.append(f"c{columns.index(ref)}" + suffix)
+        else:
+            order.append(ref + suffix)
+    merge_sql = f"SELECT {'DISTINCT ' if distinct else ''}{select} FROM partial"
+    if order:
+        merge_sql += " ORDER BY " + ", ".join(order)
+    if clauses.get("LIMIT"):
+        merge_sql += " LIMIT " + clauses["LIMIT"]
+    merged = _merge(storage, rows, merge_sql)
+    return merged[:max_rows] if max_rows else merged
+
+
+def _copy_batched(conn: sqlite3.Connection, shards: List[Dict[str, Any]]) -> None:
+    started = time.monotonic()
+    metrics.incr("shards.attach_batched")
+    for start in range(0, len(shards), _MAX_ATTACHED):
+        batch = shards[start:start + _MAX_ATTACHED]
+        for idx, shard in enumerate(batch):
+            conn.execute(f"ATTACH DATABASE ? AS s{idx}", (f"file:{os.path.abspath(shard['path'])}?mode=ro",))
+        if start == 0:
+            conn.execute("CREATE TEMP TABLE leads AS SELECT * FROM s0.leads WHERE 0")
+        conn.execute("BEGIN")
+        for idx in range(len(batch)):
+            conn.execute(f"INSERT INTO temp.leads SELECT * FROM s{idx}.leads")
+        conn.execute("COMMIT")
+        for idx in range(len(batch)):
+            conn.execute(f"DETACH DATABASE s{idx}")
+    logger.info("Shards: %s шардов скопированы пачками по %s за %.2fs", len(shards), _MAX_ATTACHED,
+                time.monotonic() - started, extra={"category": "sql"})
+
+
+@contextmanager
+def attached_connection(shards: List[Dict[str, Any]]) -> Iterator[sqlite3.Connection]:
+    """In-memory соединение, где leads — временное представление UNION ALL по шардам (только чтение).
+
+    Если шардов больше, чем можно подключить разом, они по очереди пачками копируются во временную
+    таблицу leads (temp store SQLite, на диске); шарды при этом только читаются.
+    """
+    conn = sqlite3.connect("file::memory:", uri=True, isolation_level=None)
+    try:
+        if len(shards) > _MAX_ATTACHED:
+            _copy_batched(conn, shards)
+            yield conn
+            return
+        for idx, shard in enumerate(shards):
+            conn.execute(f"ATTACH DATABASE ? AS s{idx}", (f"file:{os.path.abspath(shard['path'])}?mode=ro",))
+        if shards:
+            union = " UNION ALL ".join(f"SELECT * FROM s{idx}.leads" for idx in range(len(shards)))
+        else:
+            # Период вне всех шардов: пустая выборка со схемой последнего шарда
+            manifest = load_manifest()
+            if not manifest:
+                raise ValueError("Манифест шардов пуст")
+            conn.execute("ATTACH DATABASE ? AS s0", (f"file:{os.path.abspath(manifest[-1]['path'])}?mode=ro",))
+            union = "SELECT * FROM s0.leads WHERE 0"
+        conn.execute(f"CREATE TEMP VIEW leads AS {union}")
+        yield conn
+    finally:
+        conn.close()
+
+
+def execute_sharded(sql: str, params: Optional[tuple] = None, max_rows: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Выполняет проверенный SELECT по шардам: отсечение по датам, параллельный fan-out и слияние."""
+    params = tuple(params or ())
+    all_shards = load_manifest()
+    shards = prune(sql, all_shards)
+    metrics.incr("shards.queries")
+    metrics.observe("shards.fanout", len(shards))
+    logger.info("Shards: запрос затрагивает %s из %s шардов", len(shards), len(all_shards), extra={"category": "sql"})
+
+    if len(shards) == 1:
+        columns, rows = _run_on_shard(shards[0], sql, params, max_rows)
+        return [dict(zip(columns, row)) for row in rows]
+    if shards and not has_comments(sql):
+        merged = _execute_decomposed(sql, params, shards, max_rows)
+        if merged is not None:
+            return merged
+
+    # Общий случай (оконные функции, подзапросы, HAVING …): один запрос по представлению UNION ALL
+    from db import validate_select_sql
+
+    metrics.incr("shards.attach_fallback")
+    query = validate_select_sql(sql)
+    with attached_connection(shards) as conn:
+        conn.row_factory = sqlite3.Row
+        cur = conn.execute(query, params)
+        rows = cur.fetchmany(max_rows) if max_rows else cur.fetchall()
+        if not rows:
+            return []
+        names = rows[0].keys()
+        return [{name: row[name] for name in names} for row in rows]
+
+
+@contextmanager
+def select_cursor(sql: str, params: Optional[tuple] = None) -> Iterator[sqlite3.Cursor]:
+    """Ленивый курсор по шардам (для потоковой выгрузки)."""
+    from db import validate_select_sql
+
+    query = validate_select_sql(sql)
+    with attached_connection(prune(sql, load_manifest())) as conn:
+        cur = conn.cursor()
+        cur.execute(query, tuple(params or ()))
+        yield cur
+
+
+def split_database(source: str, out_dir: str) -> str:
+    """Раскладывает leads из одной БД по помесячным шардам и пишет манифест. Исходная БД только читается."""
+    os.makedirs(out_dir, exist_ok=True)
+    src = _connect_ro(source)
+    try:
+        ddl = [row[0] for row in src.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = 'leads' AND sql IS NOT NULL ORDER BY type DESC"
+        )]
+        months = [row[0] for row in src.execute(
+            "SELECT DISTINCT strftime('%Y-%m', created_at) FROM leads WHERE created_at IS NOT NULL ORDER BY 1"
+        ) if row[0]]
+        unparsed = src.execute("SELECT COUNT(*) FROM leads WHERE strftime('%Y-%m', created_at) IS NULL").fetchone()[0]
+    finally:
+        src.close()
+    if unparsed:
+        raise ValueError(f"{unparsed} строк с нераспознаваемым created_at — их нельзя отнести к месяцу")
+
+    manifest = {"shards": []}
+    for month in months:
+        name = f"leads_{month.replace('-', '_')}.db"
+        path = os.path.join(out_dir, name)
+        if os.path.exists(path):
+            raise FileExistsError(path)
+        conn = sqlite3.connect(path)
+        try:
+            for statement in ddl:
+                conn.execute(statement)
+            conn.execute("ATTACH DATABASE ? AS src", (f"file:{os.path.abspath(source)}?mode=ro",))
+            conn.execute("INSERT INTO main.leads SELECT * FROM src.leads WHERE strftime('%Y-%m', created_at) = ?", (month,))
+            conn.commit()
+            conn.execute("DETACH DATABASE src")
+        finally:
+            conn.close()
+        manifest["shards"].append({"month": month, "path": name})
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    with open(manifest_path, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=2)
+    return manifest_path
+
+
+CHECK_QUERIES = [
+    "SELECT COUNT(*) AS cnt FROM leads",
+    "SELECT COUNT(*) AS cnt FROM leads WHERE date(created_at) = date('now','-1 day')",
+    "SELECT project_code, COUNT(*) AS cnt FROM leads GROUP BY project_code ORDER BY cnt DESC, project_code",
+    "SELECT strftime('%Y-%m', created_at) AS month, COUNT(*) AS cnt, MIN(created_at) AS first, MAX(id) AS last_id "
+    "FROM leads GROUP BY month ORDER BY month",
+    "SELECT date(created_at) AS day, COUNT(*) FROM leads WHERE date(created_at) >= date('now','-40 day') "
+    "GROUP BY 1 ORDER BY 1 DESC LIMIT 7",
+    "SELECT gck_tag, AVG(phone % 100) AS avg_tail, SUM(id) AS s, TOTAL(id) AS t FROM leads GROUP BY gck_tag ORDER BY gck_tag",
+    "SELECT id, created_at, project_code FROM leads WHERE project_code = '[LR166]' ORDER BY id DESC LIMIT 20",
+    "SELECT id, phone FROM leads WHERE date(created_at) BETWEEN date('now','-50 day') AND date('now','-20 day') "
+    "ORDER BY phone % 1000, id LIMIT 15 OFFSET 5",
+    "SELECT DISTINCT project_code FROM leads ORDER BY 1",
+    "SELECT COUNT(DISTINCT project_code) AS projects FROM leads",
+    "SELECT project_code, COUNT(*) AS cnt FROM leads GROUP BY project_code HAVING COUNT(*) > 10 ORDER BY project_code",
+    "SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS rn FROM leads WHERE date(created_at) >= date('now','-3 day') "
+    "ORDER BY id LIMIT 10",
+    "SELECT ROUND(AVG(id), 2) AS a FROM leads WHERE project_code = ?",
+    "SELECT COUNT(*) + (1) AS c, (MAX(id)) AS m FROM leads",
+    "SELECT project_code, SUM(id) * 1.0 / COUNT(*) AS avg_id FROM leads GROUP BY project_code ORDER BY project_code",
+    "SELECT COUNT(*) AS cnt FROM leads WHERE date(created_at) >= date('now','-3 day') "
+    "AND phone % 1000 IN (SELECT phone % 1000 FROM leads WHERE date(created_at) < date('now','-60 day'))",
+]
+CHECK_PARAMS = {"SELECT ROUND(AVG(id), 2) AS a FROM leads WHERE project_code = ?": ("[LR165]",)}
+
+
+def check_equivalence(db_path: str, out_dir: str, queries: List[str]) -> bool:
+    """Раскладывает БД по шардам и сравнивает результаты шардированного выполнения с исходной БД."""
+    global SHARD_MANIFEST_PATH
+
+    SHARD_MANIFEST_PATH = split_database(db_path, out_dir)
+    conn = _connect_ro(db_path)
+    conn.row_factory = sqlite3.Row
+    ok = True
+    try:
+        for sql in queries:
+            params = CHECK_PARAMS.get(sql, ())
+            expected = [dict(row) for row in conn.execute(sql, params).fetchall()]
+            pruned = len(prune(sql, load_manifest()))
+            try:
+                actual = execute_sharded(sql, params)
+            except Exception as exc:
+                print(f"FAIL ({exc}): {sql}")
+                ok = False
+                continue
+            same = len(expected) == len(actual) and all(
+                e.keys() == a.keys() and all(
+                    e[k] == a[k] or (isinstance(e[k], float) and isinstance(a[k], float) and abs(e[k] - a[k]) < 1e-9)
+                    for k in e
+                )
+                for e, a in zip(expected, actual)
+            )
+            print(f"{'OK  ' if same else 'DIFF'} [{pruned}/{len(load_manifest())} шардов] {sql}")
+            if not same:
+                ok = False
+                print(f"  SQLite: {expected[:5]}\n  shards: {actual[:5]}")
+    finally:
+        conn.close()
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Помесячные шарды таблицы leads")
+    parser.add_argument("--split", action="store_true", help="Разложить leads из --db по месяцам в --out")
+    parser.add_argument("--check", action="store_true", help="Сравнить шардированное выполнение с одной БД")
+    parser.add_argument("--db", default=DB_PATH, help="Исходная БД (по умолчанию config.DB_PATH)")
+    parser.add_argument("--out", default="shards", help="Каталог для шардов и manifest.json")
+    parser.add_argument("--synthetic", type=int, default=0, help="Проверить на синтетической БД из N строк")
+    args = parser.parse_args()
+    if args.split:
+        path = split_database(args.db, args.out)
+        print(f"Манифест: {path}. Укажите SHARD_MANIFEST_PATH={path}")
+    elif args.check:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = args.db
+            if args.synthetic:
+                from analytics_mirror import _build_synthetic
+
+                source = os.path.join(tmp, "synthetic.db")
+                _build_synthetic(source, args.synthetic)
+            ok = check_equivalence(source, os.path.join(tmp, "shards"), CHECK_QUERIES)
+        raise SystemExit(0 if ok else 1)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
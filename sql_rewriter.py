@@ -0,0 +1,365 @@
+from typing import List, Optional, Tuple
+import argparse
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from config import SQL_REWRITE_ENABLED, logger
+from sql_text import CREATED_AT, DATE_VALUE, _LITERAL, eval_date_value, is_iso_day, split_top_level
+import metrics
+
+
+# Переписывает предикаты вида date(created_at) = X / strftime('%Y-%m', created_at) = X
+# в полуинтервалы по «сырому» created_at (created_at >= A AND created_at < B), которые SQLite
+# может искать по индексу. Эквивалентность держится на инварианте: для каждой строки
+# date(created_at) = substr(created_at, 1, 10) — тогда сравнение строк совпадает со сравнением дат
+# для всех форматов, что есть в базе ('YYYY-MM-DD', 'YYYY-MM-DD HH:MM[:SS[.fff]]', 'YYYY-MM-DDTHH:MM:SS').
+# Если хоть одна строка нарушает инвариант (часовой пояс, другой формат даты), SQL не трогаем.
+
+_DATE_COL = rf"date\s*\(\s*{CREATED_AT}\s*\)"
+_STRFTIME_COL = rf"strftime\s*\(\s*'(%Y-%m|%Y|%Y-%W)'\s*,\s*{CREATED_AT}\s*\)"
+_STRFTIME_VALUE = rf"(?:{_LITERAL}|strftime\s*\(\s*{_LITERAL}(?:\s*,\s*{_LITERAL})+\s*\))"
+
+_BETWEEN_RE = re.compile(rf"{_DATE_COL}\s+BETWEEN\s+({DATE_VALUE})\s+AND\s+({DATE_VALUE})", re.IGNORECASE)
+_DATE_CMP_RE = re.compile(rf"{_DATE_COL}\s*(==|=|>=|>|<=|<)\s*({DATE_VALUE})", re.IGNORECASE)
+_STRFTIME_EQ_RE = re.compile(rf"{_STRFTIME_COL}\s*(==|=)\s*({_STRFTIME_VALUE})", re.IGNORECASE)
+
+# Переписываем только целые булевы операнды: слева/справа — граница условия
+_BEFORE_OK = re.compile(r"(?:\bWHERE|\bAND|\bOR|\bNOT|\bON|\bWHEN|\bHAVING|\()\s*$", re.IGNORECASE)
+_AFTER_OK = re.compile(
+    r"^\s*(?:$|\)|;|\b(?:AND|OR|GROUP|ORDER|LIMIT|THEN|HAVING|UNION|EXCEPT|INTERSECT|WINDOW)\b)", re.IGNORECASE
+)
+
+_INVARIANT_SQL = "SELECT COUNT(*) FROM leads WHERE date(created_at) IS NOT substr(created_at, 1, 10)"
+# Если инвариант нарушен, полную перепроверку делаем не чаще, чем раз в 10 минут
+_UNSAFE_RECHECK_SEC = 600
+# Без индекса по updated_at обновлённые строки ловит только полный проход — не чаще раза в час
+_UPDATED_RECHECK_SEC = 3600
+
+_lock = threading.Lock()
+_state = {"version": None, "safe": False, "max_id": None, "updated_at": "", "checked_at": 0.0, "full_at": 0.0}
+
+
+def _string_spans(sql: str) -> List[Tuple[int, int]]:
+    return [(m.start(), m.end()) for m in re.finditer(rf"{_LITERAL}|\"[^\"]*\"", sql)]
+
+
+def _in_spans(pos: int, spans: List[Tuple[int, int]]) -> bool:
+    return any(start <= pos < end for start, end in spans)
+
+
+def _next_day(value_sql: str, value: str) -> str:
+    """SQL-выражение для дня, следующего за value_sql (значение уже вычислено как value)."""
+    if value_sql.startswith("'"):
+        return f"'{(date.fromisoformat(value) + timedelta(days=1)).isoformat()}'"
+    # date('now','-1 day') → date('now','-1 day','+1 day'): тот же 'now' в рамках запроса
+    return value_sql[:value_sql.rindex(")")].rstrip() + ", '+1 day')"
+
+
+def _date_value(value_sql: str) -> Optional[str]:
+    value_sql = value_sql.strip()
+    value = eval_date_value(value_sql)
+    if not is_iso_day(value):
+        return None  # и '2025-02-30': SQLite такой литерал примет, а следующий день не посчитать
+    if not value_sql.startswith("'") and not value_sql.lower().startswith("date"):
+        return None
+    return value
+
+
+def _range(column: str, lo: Optional[str], hi: Optional[str]) -> str:
+    if lo and hi:
+        return f"({column} >= {lo} AND {column} < {hi})"
+    return f"{column} >= {lo}" if lo else f"{column} < {hi}"
+
+
+def _rewrite_between(m: "re.Match") -> Optional[str]:
+    column = m.group(0)[m.group(0).index("(") + 1:m.group(0).index(")")].strip()
+    lo_sql, hi_sql = m.group(1).strip(), m.group(2).strip()
+    lo, hi = _date_value(lo_sql), _date_value(hi_sql)
+    if lo is None or hi is None:
+        return None
+    return _range(column, lo_sql, _next_day(hi_sql, hi))
+
+
+def _rewrite_date_cmp(m: "re.Match") -> Optional[str]:
+    column = m.group(0)[m.group(0).index("(") + 1:m.group(0).index(")")].strip()
+    op, value_sql = m.group(1), m.group(2).strip()
+    value = _date_value(value_sql)
+    if value is None:
+        return None
+    if op in ("=", "=="):
+        return _range(column, value_sql, _next_day(value_sql, value))
+    if op == ">=":
+        return _range(column, value_sql, None)
+    if op == ">":
+        return _range(column, _next_day(value_sql, value), None)
+    if op == "<":
+        return _range(column, None, value_sql)
+    return _range(column, None, _next_day(value_sql, value))  # <=
+
+
+def _week_bounds(year: int, week: int) -> Optional[Tuple[date, date]]:
+    """Дни года с strftime('%Y-%W') = 'year-week' (неделя с понедельника, 00 — до первого понедельника)."""
+    start_of_year = date(year, 1, 1)
+    first_monday = start_of_year + timedelta(days=(7 - start_of_year.weekday()) % 7)
+    lo = start_of_year if week == 0 else first_monday + timedelta(days=7 * (week - 1))
+    hi = first_monday if week == 0 else lo + timedelta(days=7)
+    hi = min(hi, date(year + 1, 1, 1))
+    return (lo, hi) if lo < hi and lo.year == year else None
+
+
+def _rewrite_strftime(m: "re.Match") -> Optional[str]:
+    text = m.group(0)
+    fmt = m.group(1)
+    column = re.search(CREATED_AT, text[text.index(",") + 1:], re.IGNORECASE).group(0)
+    value_sql = m.group(3).strip()
+    if value_sql.startswith("'"):
+        literal = value_sql[1:-1]
+        if fmt == "%Y" and re.fullmatch(r"\d{4}", literal):
+            lo, hi = date(int(literal), 1, 1), date(int(literal) + 1, 1, 1)
+        elif fmt == "%Y-%m" and re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", literal):
+            year, month = int(literal[:4]), int(literal[5:])
+            lo = date(year, month, 1)
+            hi = date(year + month // 12, month % 12 + 1, 1)
+        elif fmt == "%Y-%W" and re.fullmatch(r"\d{4}-\d{2}", literal):
+            bounds = _week_bounds(int(literal[:4]), int(literal[5:]))
+            if bounds is None:
+                return None
+            lo, hi = bounds
+        else:
+            return None
+        return _range(column, f"'{lo.isoformat()}'", f"'{hi.isoformat()}'")
+
+    # strftime('<тот же формат>', 'now', модификаторы...) → границы периода через date() с теми же модификаторами
+    args = split_top_level(value_sql[value_sql.index("(") + 1:value_sql.rindex(")")])
+    if args[0] != f"'{fmt}'":
+        return None
+    base = ", ".join(args[1:])
+    if eval_date_value(f"date({base})") is None:
+        return None
+    if fmt == "%Y":
+        lo_sql, hi_sql = f"date({base}, 'start of year')", f"date({base}, 'start of year', '+1 year')"
+    elif fmt == "%Y-%m":
+        lo_sql, hi_sql = f"date({base}, 'start of month')", f"date({base}, 'start of month', '+1 month')"
+    else:
+        # Неделя с понедельника, обрезанная границами года (как у %W)
+        lo_sql = f"max(date({base}, '-6 days', 'weekday 1'), date({base}, 'start of year'))"
+        hi_sql = f"min(date({base}, '+1 day', 'weekday 1'), date({base}, 'start of year', '+1 year'))"
+    return _range(column, lo_sql, hi_sql)
+
+
+def rewrite_date_predicates(sql: str) -> str:
+    """Чистое текстовое переписывание (без проверки инварианта)."""
+    for pattern, build in ((_BETWEEN_RE, _rewrite_between), (_DATE_CMP_RE, _rewrite_date_cmp),
+                           (_STRFTIME_EQ_RE, _rewrite_strftime)):
+        out, last = [], 0
+        spans = _string_spans(sql)
+        for m in pattern.finditer(sql):
+            if _in_spans(m.start(), spans):
+                continue
+            if not _BEFORE_OK.search(sql[:m.start()]) or not _AFTER_OK.match(sql[m.end():]):
+                continue
+            try:
+                replacement = build(m)
+            except ValueError:
+                replacement = None  # дата вне календаря (год 0000 и т.п.) — предикат оставляем как есть
+            if replacement is None:
+                continue
+            out.append(sql[last:m.start()])
+            out.append(replacement)
+            last = m.end()
+        out.append(sql[last:])
+        sql = "".join(out)
+    return sql
+
+
+def _watermark() -> str:
+    # updated_at с точностью до секунды: последние пару секунд перепроверим в следующий раз
+    return datetime.utcfromtimestamp(time.time() - 2).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _has_updated_at_index(conn: sqlite3.Connection) -> bool:
+    for index in conn.execute("PRAGMA index_list(leads)").fetchall():
+        if index[4]:  # частичный индекс не покрывает все строки
+            continue
+        columns = conn.execute(f'PRAGMA index_info("{index[1]}")').fetchall()
+        if columns and columns[0][2] == "updated_at":
+            return True
+    return False
+
+
+def _invariant_holds(conn: sqlite3.Connection, data_version: str) -> bool:
+    """Инвариант date(created_at) = substr(created_at, 1, 10); проверяется инкрементально.
+
+    Новые строки — диапазоном по первичному ключу (id > max_id). Обновлённые — по индексу updated_at,
+    а если его нет, полным проходом не чаще _UPDATED_RECHECK_SEC: запись в leads не должна стоить скана.
+    """
+    with _lock:
+        if _state["version"] == data_version:
+            return _state["safe"]
+        now = time.time()
+        if _state["max_id"] is None or (not _state["safe"] and now - _state["checked_at"] >= _UNSAFE_RECHECK_SEC):
+            bad = conn.execute(_INVARIANT_SQL).fetchone()[0]
+            _state.update(safe=bad == 0, checked_at=now, full_at=now)
+        elif _state["safe"]:
+            bad = conn.execute(_INVARIANT_SQL + " AND id > ?", (_state["max_id"],)).fetchone()[0]
+            if not bad and _has_updated_at_index(conn):
+                # без COALESCE: иначе индекс не используется; строки с NULL updated_at и не обновлялись
+                bad = conn.execute(_INVARIANT_SQL + " AND updated_at > ?", (_state["updated_at"],)).fetchone()[0]
+            elif not bad and now - _state["full_at"] >= _UPDATED_RECHECK_SEC:
+                bad = conn.execute(_INVARIANT_SQL).fetchone()[0]
+                _state["full_at"] = now
+            _state["safe"] = bad == 0
+            if bad:
+                _state["checked_at"] = now
+        else:
+            return False
+        _state["max_id"] = conn.execute("SELECT COALESCE(MAX(id), 0) FROM leads").fetchone()[0]
+        _state["updated_at"] = _watermark()
+        _state["version"] = data_version
+        if not _state["safe"]:
+            logger.info("SQL rewrite: есть created_at вне инварианта date() = substr(…,1,10) — переписывание выключено")
+        return _state["safe"]
+
+
+def warm(conn: sqlite3.Connection, data_version: str) -> Optional[bool]:
+    """Первая (полная) проверка инварианта заранее, а не на первом запросе; None — если переписывание выключено."""
+    if not SQL_REWRITE_ENABLED:
+        return None
+    return _invariant_holds(conn, data_version)
+
+
+def rewrite_for_index(sql: str, conn: sqlite3.Connection, data_version: str) -> str:
+    """Возвращает SQL с индексируемыми диапазонами по created_at или исходный SQL."""
+    if not SQL_REWRITE_ENABLED or "created_at" not in sql.lower():
+        return sql
+    rewritten = rewrite_date_predicates(sql)
+    if rewritten == sql:
+        return sql
+    try:
+        if not _invariant_holds(conn, data_version):
+            metrics.incr("sql_rewrite.skipped_unsafe")
+            return sql
+    except sqlite3.Error as exc:
+        logger.error("SQL rewrite: проверка инварианта не удалась: %s", exc)
+        return sql
+    metrics.incr("sql_rewrite.applied")
+    logger.info("SQL rewrite → %s", rewritten, extra={"category": "sql"})
+    return rewritten
+
+
+# ---------------------------------------------------------------------------
+# Дифференциальная проверка: исходный и переписанный SQL на синтетической БД
+# ---------------------------------------------------------------------------
+
+CHECK_QUERIES = [
+    "SELECT COUNT(*) AS cnt FROM leads WHERE date(created_at) = date('now','-1 day')",
+    "SELECT project_code, COUNT(*) AS cnt FROM leads WHERE project_tag = 'tag [LR166]' "
+    "AND date(created_at) >= date('now','-6 day') GROUP BY project_code",
+    "SELECT gck_tag, COUNT(*) AS cnt FROM leads WHERE date(created_at) = date('now') GROUP BY gck_tag",
+    "SELECT COUNT(*) AS cnt FROM leads WHERE project_code = '[LR166]' "
+    "AND date(created_at) BETWEEN date('2025-10-01') AND date('2025-10-10')",
+    "SELECT strftime('%Y-%W', created_at) AS week, COUNT(*) AS cnt FROM leads "
+    "WHERE date(created_at) >= date('now','-27 day') GROUP BY strftime('%Y-%W', created_at) ORDER BY week",
+    "SELECT COUNT(*) FROM leads WHERE date(created_at) = '2025-12-31'",
+    "SELECT COUNT(*) FROM leads WHERE date(created_at) > '2025-12-31' AND date(created_at) <= '2026-01-02'",
+    "SELECT COUNT(*) FROM leads WHERE date(created_at) < '2026-01-01' OR project_code = '[LR100]'",
+    "SELECT COUNT(*) FROM leads WHERE NOT date(created_at) == '2025-10-01'",
+    "SELECT COUNT(*) FROM leads WHERE strftime('%Y-%m', created_at) = '2025-12'",
+    "SELECT COUNT(*) FROM leads WHERE strftime('%Y-%m', created_at) = strftime('%Y-%m', 'now', '-1 month')",
+    "SELECT COUNT(*) FROM leads WHERE strftime('%Y', created_at) = '2026'",
+    "SELECT COUNT(*) FROM leads WHERE strftime('%Y-%W', created_at) = '2026-00'",
+    "SELECT COUNT(*) FROM leads WHERE strftime('%Y-%W', created_at) = '2025-52'",
+    "SELECT COUNT(*) FROM leads WHERE strftime('%Y-%W', created_at) = strftime('%Y-%W', 'now')",
+    "SELECT COUNT(*) FROM leads WHERE strftime('%Y-%W', created_at) = strftime('%Y-%W', '2026-01-03')",
+    "SELECT COUNT(*) FROM leads WHERE project_tag = 'date(created_at) = date(''now'')'",
+]
+
+
+def _build_synthetic(path: str, rows: int) -> None:
+    """Строки около границ суток/недель/месяцев/года во всех встречающихся форматах created_at."""
+    rnd = random.Random(7)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(
+            """
+            CREATE TABLE leads(id INTEGER PRIMARY KEY, created_at TEXT NOT NULL, phone INTEGER NOT NULL,
+                               project_tag TEXT NOT NULL, project_code TEXT NOT NULL, gck_tag TEXT NOT NULL,
+                               updated_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+            CREATE INDEX idx_leads_created ON leads(created_at);
+            """
+        )
+        formats = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S.%f"]
+        anchors = [datetime(2025, 10, 1), datetime(2025, 10, 10), datetime(2025, 12, 29), datetime(2026, 1, 1),
+                   datetime(2026, 1, 5), datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)]
+        batch = []
+        for _ in range(rows):
+            anchor = rnd.choice(anchors)
+            moment = anchor + timedelta(seconds=rnd.choice([-1, 0, 1, 59, 86399, -86400]) + rnd.randint(-40, 40) * 86400)
+            created = moment.strftime(rnd.choice(formats))
+            code = rnd.choice(["[LR100]", "[LR165]", "[LR166]"])
+            batch.append((created, rnd.randint(79000000000, 79999999999), f"tag {code}", code, rnd.choice(["ГЦК1", "ГЦК2"])))
+        conn.executemany(
+            "INSERT INTO leads(created_at, phone, project_tag, project_code, gck_tag) VALUES (?, ?, ?, ?, ?)", batch
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _uses_index(conn: sqlite3.Connection, sql: str) -> bool:
+    plan = " ".join(str(row[-1]) for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+    return "created_at" in plan and "SEARCH" in plan.upper()
+
+
+def check_differential(db_path: str, queries: List[str]) -> bool:
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    ok = True
+    try:
+        bad = conn.execute(_INVARIANT_SQL).fetchone()[0]
+        print(f"Инвариант date(created_at) = substr(created_at,1,10): {'выполняется' if not bad else f'нарушен в {bad} строках'}")
+        for sql in queries:
+            rewritten = rewrite_date_predicates(sql)
+            expected = sorted(map(repr, conn.execute(sql).fetchall()))
+            actual = sorted(map(repr, conn.execute(rewritten).fetchall()))
+            same = expected == actual or bool(bad)
+            ok = ok and same
+            status = "OK  " if same else "FAIL"
+            index = "index" if _uses_index(conn, rewritten) else "scan"
+            print(f"{status} [{'rewritten, ' + index if rewritten != sql else 'unchanged'}] {sql}")
+            if rewritten != sql:
+                print(f"     → {rewritten}")
+            if not same:
+                print("   original: ", expected[:5])
+                print("   rewritten:", actual[:5])
+    finally:
+        conn.close()
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Дифференциальная проверка переписывания date(created_at) в диапазоны")
+    parser.add_argument("--check", action="store_true", help="Сравнить результаты исходных и переписанных запросов")
+    parser.add_argument("--db", default=None, help="Проверить на реальной БД (read-only) вместо синтетической")
+    parser.add_argument("--rows", type=int, default=20000, help="Размер синтетической БД")
+    args = parser.parse_args()
+    if not args.check:
+        parser.print_help()
+        return
+    if args.db:
+        ok = check_differential(args.db, CHECK_QUERIES)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "synthetic.db")
+            _build_synthetic(path, args.rows)
+            ok = check_differential(path, CHECK_QUERIES)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
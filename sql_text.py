@@ -0,0 +1,232 @@
+from typing import Dict, List, Optional, Tuple
+import re
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+
+# Лёгкий разбор текста SQL на верхнем уровне (вне строк и скобок) — без полноценного парсера.
+# Используется маршрутизатором аналитики, переписчиком дат и шардированием.
+
+_CLAUSES = ["SELECT", "FROM", "WHERE", "GROUP BY", "HAVING", "ORDER BY", "LIMIT"]
+_CLAUSE_RE = re.compile(r"\b(SELECT|FROM|WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|UNION|INTERSECT|EXCEPT|WINDOW)\b", re.IGNORECASE)
+
+# Значение даты, которое можно безопасно вычислить заранее: строковый литерал
+# или date(...)/datetime(...) только со строковыми литералами внутри.
+_LITERAL = r"'(?:[^']|'')*'"
+DATE_VALUE = rf"(?:{_LITERAL}|(?:date|datetime)\s*\(\s*{_LITERAL}(?:\s*,\s*{_LITERAL})*\s*\))"
+CREATED_AT = r"(?:(?:leads|\"leads\")\.)?(?:created_at|\"created_at\")"
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+_local = threading.local()
+
+
+def mask(sql: str) -> str:
+    """Копия SQL, где содержимое строк и скобок заменено пробелами (позиции сохраняются)."""
+    out = []
+    depth = 0
+    quote: Optional[str] = None
+    for ch in sql:
+        if quote:
+            out.append(" ")
+            if ch == quote:
+                quote = None
+            continue
+        if ch in ("'", '"'):
+            quote = ch
+            out.append(" " if depth else ch)
+            continue
+        if ch == "(":
+            depth += 1
+            out.append("(" if depth == 1 else " ")
+            continue
+        if ch == ")":
+            depth = max(0, depth - 1)
+            out.append(")" if depth == 0 else " ")
+            continue
+        out.append(" " if depth else ch)
+    return "".join(out)
+
+
+def has_comments(sql: str) -> bool:
+    masked = mask(sql)
+    return "--" in masked or "/*" in masked
+
+
+def split_clauses(sql: str) -> Optional[Dict[str, str]]:
+    """Делит одиночный SELECT на предложения верхнего уровня. None — если есть UNION/WINDOW и т.п."""
+    masked = mask(sql)
+    found: List[Tuple[str, int, int]] = []
+    for m in _CLAUSE_RE.finditer(masked):
+        name = re.sub(r"\s+", " ", m.group(1).upper())
+        if name not in _CLAUSES:
+            return None
+        found.append((name, m.start(), m.end()))
+    names = [f[0] for f in found]
+    if not names or names[0] != "SELECT" or len(set(names)) != len(names):
+        return None
+    if names != sorted(names, key=_CLAUSES.index):
+        return None
+    parts: Dict[str, str] = {}
+    for idx, (name, _, end) in enumerate(found):
+        stop = found[idx + 1][1] if idx + 1 < len(found) else len(sql)
+        parts[name] = sql[end:stop].strip()
+    return parts
+
+
+def split_top_level(text: str, sep: str = ",") -> List[str]:
+    masked = mask(text)
+    items, start = [], 0
+    for idx, ch in enumerate(masked):
+        if ch == sep:
+            items.append(text[start:idx].strip())
+            start = idx + 1
+    items.append(text[start:].strip())
+    return [item for item in items if item]
+
+
+def split_conjuncts(where: str) -> Optional[List[str]]:
+    """Делит WHERE по AND верхнего уровня (AND внутри BETWEEN не считается). None — если есть OR."""
+    masked = mask(where)
+    parts, start, pending_between = [], 0, False
+    for m in re.finditer(r"\b(AND|OR|BETWEEN)\b", masked, re.IGNORECASE):
+        word = m.group(1).upper()
+        if word == "OR":
+            return None
+        if word == "BETWEEN":
+            pending_between = True
+            continue
+        if pending_between:
+            pending_between = False
+            continue
+        parts.append(where[start:m.start()].strip())
+        start = m.end()
+    parts.append(where[start:].strip())
+    return [strip_parens(p) for p in parts if p]
+
+
+def _closing_paren(text: str) -> int:
+    """Индекс скобки, закрывающей text[0] == '(' (с учётом строк), или -1."""
+    depth = 0
+    quote: Optional[str] = None
+    for idx, ch in enumerate(text):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                return idx
+    return -1
+
+
+def strip_parens(expr: str) -> str:
+    expr = expr.strip()
+    # снимаем только внешние скобки вокруг всего выражения, а не «(a) AND (b)»
+    while expr.startswith("(") and _closing_paren(expr) == len(expr) - 1:
+        expr = expr[1:-1].strip()
+    return expr
+
+
+def single_call(expr: str) -> Optional[Tuple[str, str]]:
+    """Выражение — ровно один вызов func(arg) (скобка после имени закрывается в самом конце) → (func, arg).
+
+    «COUNT(*) + (1)» или «SUM(x) OVER ()» — уже не один вызов: None.
+    """
+    expr = strip_parens(expr)
+    m = re.match(r"([A-Za-z_]\w*)\s*\(", expr)
+    if not m:
+        return None
+    start = m.end() - 1
+    if start + _closing_paren(expr[start:]) != len(expr) - 1:
+        return None
+    return m.group(1).lower(), expr[start + 1:-1].strip()
+
+
+def split_select_item(item: str) -> Tuple[str, str]:
+    """'expr AS alias' → (expr, alias); без алиаса имя колонки — текст выражения, как в SQLite."""
+    item = item.strip()
+    m = re.fullmatch(r"(?is)(.+?)\s+(AS\s+)?(\"[^\"]+\"|[A-Za-z_]\w*)", item)
+    if m and not re.fullmatch(r"(?i)END", m.group(3)) and (m.group(2) or re.search(r"[\w)\"']$", m.group(1))):
+        return m.group(1).strip(), m.group(3).strip('"')
+    column = re.fullmatch(r"(?:\w+|\"[^\"]+\")\.(\w+|\"[^\"]+\")", item)
+    return item, (column.group(1) if column else item).strip('"')
+
+
+def normalize(expr: str) -> str:
+    """Нормализация выражения для сравнения: регистр и пробелы вне строк."""
+    out, last = [], 0
+    for m in re.finditer(_LITERAL, expr):
+        out.append(re.sub(r"\s+", "", expr[last:m.start()]).lower())
+        out.append(m.group(0))
+        last = m.end()
+    out.append(re.sub(r"\s+", "", expr[last:]).lower())
+    return "".join(out)
+
+
+def _memory_conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(":memory:")
+        _local.conn = conn
+    return conn
+
+
+def eval_date_value(expr: str) -> Optional[str]:
+    """Вычисляет DATE_VALUE тем же SQLite (та же семантика 'now' и модификаторов)."""
+    if not re.fullmatch(DATE_VALUE, expr.strip(), re.IGNORECASE):
+        return None
+    row = _memory_conn().execute("SELECT " + expr).fetchone()
+    value = row[0] if row else None
+    return value if isinstance(value, str) else None
+
+
+def is_iso_day(value: Optional[str]) -> bool:
+    """YYYY-MM-DD и настоящая дата календаря: SQLite сравнит и '2025-02-30', а date.fromisoformat — нет."""
+    if not value or not ISO_DATE.match(value):
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _next_iso_day(value: str) -> str:
+    return (date.fromisoformat(value) + timedelta(days=1)).isoformat()
+
+
+def created_at_range(cond: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """Полуинтервал ISO-дат [lo, hi) для условия на date(created_at) / created_at; None — если это не оно.
+
+    Поддерживается date(created_at) =, >=, >, <=, < и BETWEEN, а также форма после переписчика дат
+    created_at >= 'YYYY-MM-DD' / created_at < 'YYYY-MM-DD'. Значение должно вычисляться в существующую
+    ISO-дату; иначе ('2025-02-30', '2025-13-01') — None, и условие остаётся SQLite.
+    """
+    m = re.fullmatch(rf"(?is)date\s*\(\s*{CREATED_AT}\s*\)\s+BETWEEN\s+({DATE_VALUE})\s+AND\s+({DATE_VALUE})", cond)
+    if m:
+        lo, hi = eval_date_value(m.group(1)), eval_date_value(m.group(2))
+        if not is_iso_day(lo) or not is_iso_day(hi):
+            return None
+        return lo, _next_iso_day(hi)
+    m = re.fullmatch(rf"(?is)date\s*\(\s*{CREATED_AT}\s*\)\s*(=|==|>=|>|<=|<)\s*({DATE_VALUE})", cond)
+    if m:
+        value = eval_date_value(m.group(2))
+        if not is_iso_day(value):
+            return None
+        op = m.group(1)
+        if op in ("=", "=="):
+            return value, _next_iso_day(value)
+        return {">=": (value, None), ">": (_next_iso_day(value), None),
+                "<=": (None, _next_iso_day(value)), "<": (None, value)}[op]
+    m = re.fullmatch(rf"(?is){CREATED_AT}\s*(>=|<)\s*({DATE_VALUE})", cond)
+    if m:
+        value = eval_date_value(m.group(2))
+        if not is_iso_day(value):
+            return None
+        return (value, None) if m.group(1) == ">=" else (None, value)
+    return None
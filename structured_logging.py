@@ -0,0 +1,207 @@
+from typing import Any, Dict, Iterable, Optional
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import queue
+import random
+import re
+import sys
+
+from pii import mask_phone
+
+
+# Неблокирующее логирование: в горячем пути запись только кладётся в очередь,
+# форматирование, превью payload и маскирование PII выполняются в фоновом потоке при выводе.
+# Модуль не импортирует config (его настраивает сам config).
+
+# Телефоны вида 79XXXXXXXXX / +7 9XX XXX-XX-XX / 89XXXXXXXXX в свободном тексте сообщений
+_PHONE_RE = re.compile(r"(?<!\d)(?:\+?7|8)[\s\-()]*\d{3}[\s\-()]*\d{3}[\s\-]*\d{2}[\s\-]*\d{2}(?!\d)")
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def mask_pii(text: str) -> str:
+    return _PHONE_RE.sub(lambda m: mask_phone(re.sub(r"\D", "", m.group(0))), text)
+
+
+class LazyPreview:
+    """Превью большого объекта для лога: строится только если запись реально выводится.
+
+    Строки результата сериализуются по одной до лимита — без копии всего результата через json.
+    """
+
+    def __init__(self, payload: Any, limit: int = 2000, mask_fields: Iterable[str] = ("phone",)) -> None:
+        self.payload = payload
+        self.limit = limit
+        self.mask_fields = set(mask_fields)
+
+    def _mask_row(self, row: Any) -> Any:
+        if isinstance(row, dict) and self.mask_fields.intersection(row):
+            return {k: (mask_phone(v) if k in self.mask_fields else v) for k, v in row.items()}
+        return row
+
+    def _dump(self, value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False, default=str)
+
+    def __str__(self) -> str:
+        payload = self.payload
+        try:
+            if isinstance(payload, dict):
+                parts = []
+                size = 0
+                for key, value in payload.items():
+                    if isinstance(value, list):
+                        items = []
+                        for row in value:
+                            if size >= self.limit:
+                                items.append('"…"')
+                                break
+                            chunk = self._dump(self._mask_row(row))
+                            items.append(chunk)
+                            size += len(chunk) + 1
+                        chunk = f"{self._dump(key)}: [{', '.join(items)}]"
+                    else:
+                        chunk = f"{self._dump(key)}: {self._dump(value)}"
+                    parts.append(chunk)
+                    size += len(chunk) + 2
+                    if size >= self.limit:
+                        break
+                return ("{" + ", ".join(parts) + "}")[:self.limit]
+            if isinstance(payload, list):
+                return self._dump([self._mask_row(r) for r in payload[:50]])[:self.limit]
+            return str(payload)[:self.limit]
+        except Exception:
+            return "<payload>"
+
+
+class Truncated:
+    """Обрезанный однострочный текст (сырой ответ модели и т.п.), считается при выводе."""
+
+    def __init__(self, text: str, limit: int = 400) -> None:
+        self.text = text
+        self.limit = limit
+
+    def __str__(self) -> str:
+        return (self.text or "")[:self.limit].replace("\n", " ")
+
+
+class SamplingFilter(logging.Filter):
+    """Доля INFO/DEBUG-записей по категориям (extra={"category": ...}); WARNING и выше проходят всегда."""
+
+    def __init__(self, rates: Dict[str, float]) -> None:
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "category", ""), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class StructuredFormatter(logging.Formatter):
+    """text — прежний формат строки; json — одна JSON-запись на строку с категорией и полями из extra."""
+
+    def __init__(self, fmt: str = "text") -> None:
+        super().__init__("%(asctime)s - %(levelname)s - %(message)s")
+        self.mode = fmt
+
+    def format(self, record: logging.LogRecord) -> str:
+        if self.mode != "json":
+            return mask_pii(super().format(record))
+        entry: Dict[str, Any] = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "pid": record.process,
+            "category": getattr(record, "category", None),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and key != "category":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return mask_pii(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Стандартный prepare форматирует запись в вызывающем потоке — здесь это делает слушатель
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Вывод не успевает: теряем запись, а не тормозим обработку сообщений
+            _NonBlockingQueueHandler.dropped += 1
+
+
+class _DropReportingHandler(logging.StreamHandler):
+    def emit(self, record: logging.LogRecord) -> None:
+        if _NonBlockingQueueHandler.dropped:
+            dropped, _NonBlockingQueueHandler.dropped = _NonBlockingQueueHandler.dropped, 0
+            self.stream.write(f"logging: пропущено {dropped} записей (очередь логов переполнена)\n")
+        super().emit(record)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _start_listener(logger: logging.Logger, fmt: str, queue_size: int) -> None:
+    global _listener
+    for handler in list(logger.handlers):
+        if isinstance(handler, _NonBlockingQueueHandler):
+            logger.removeHandler(handler)
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    stream = _DropReportingHandler(sys.stderr)
+    stream.setFormatter(StructuredFormatter(fmt))
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+    logger.addHandler(_NonBlockingQueueHandler(log_queue))
+
+
+def shutdown_logging() -> None:
+    """Дописывает очередь логов; в дочерних процессах multiprocessing вызывать явно (atexit там не срабатывает)."""
+    if _listener is not None:
+        try:
+            _listener.stop()  # дописывает всё, что осталось в очереди
+        except Exception:
+            pass
+
+
+def configure_logger(name: str, level: str, fmt: str = "text", sampling: Optional[Dict[str, float]] = None,
+                     queue_size: int = 10000) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(getattr(logging, level, logging.INFO))
+    logger.propagate = False
+    if _listener is None:
+        _start_listener(logger, fmt, queue_size)
+        atexit.register(shutdown_logging)
+        # После fork поток слушателя в дочернем процессе не существует — поднимаем свой
+        os.register_at_fork(after_in_child=lambda: _start_listener(logger, fmt, queue_size))
+        # Процессы multiprocessing завершаются через os._exit без atexit — дописываем очередь их финализатором
+        multiprocessing.util.register_after_fork(
+            logger, lambda _: multiprocessing.util.Finalize(logger, shutdown_logging, exitpriority=10)
+        )
+    if sampling:
+        logger.filters = [f for f in logger.filters if not isinstance(f, SamplingFilter)]
+        logger.addFilter(SamplingFilter(sampling))
+    return logger
+
+
+def parse_sampling(value: str) -> Dict[str, float]:
+    """"sql=0.1,payload=0.05" → {"sql": 0.1, "payload": 0.05}."""
+    rates: Dict[str, float] = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            key, _, rate = item.partition("=")
+            try:
+                rates[key.strip()] = max(0.0, min(1.0, float(rate)))
+            except ValueError:
+                continue
+    return rates
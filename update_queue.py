@@ -0,0 +1,297 @@
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import time
+
+from config import (
+    STATE_DB_PATH,
+    QUEUE_VISIBILITY_TIMEOUT_SEC,
+    QUEUE_MAX_ATTEMPTS,
+    QUEUE_AFFINITY_GRACE_SEC,
+    QUEUE_PRIORITY_AGING_PER_SEC,
+    logger,
+)
+
+
+# Статусы задач в очереди
+STATUS_PENDING = "pending"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS updates_queue (
+    update_id   INTEGER PRIMARY KEY,
+    chat_id     TEXT,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    stage       TEXT NOT NULL DEFAULT 'received',
+    state       TEXT NOT NULL DEFAULT '{}',
+    result      TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    priority    REAL NOT NULL DEFAULT 100,
+    lease_owner TEXT,
+    lease_until REAL,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_updates_queue_status ON updates_queue(status, lease_until);
+CREATE TABLE IF NOT EXISTS kv (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class LeaseLostError(RuntimeError):
+    """Аренда задачи истекла и её забрал другой воркер."""
+
+
+def _connect() -> sqlite3.Connection:
+    # isolation_level=None: транзакциями управляем явно (BEGIN IMMEDIATE)
+    conn = sqlite3.connect(STATE_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_queue() -> None:
+    db_dir = os.path.dirname(os.path.abspath(STATE_DB_PATH))
+    os.makedirs(db_dir, exist_ok=True)
+    conn = _connect()
+    try:
+        # WAL позволяет поллеру писать, пока воркеры читают
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(updates_queue)")}
+        if "priority" not in columns:
+            # очередь, созданная до появления приоритетов
+            conn.execute("ALTER TABLE updates_queue ADD COLUMN priority REAL NOT NULL DEFAULT 100")
+    finally:
+        conn.close()
+
+
+def get_offset() -> Optional[int]:
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT value FROM kv WHERE key = 'offset'").fetchone()
+        return int(row["value"]) if row and row["value"] is not None else None
+    finally:
+        conn.close()
+
+
+def enqueue_updates(updates: List[Dict[str, Any]], next_offset: int) -> List[int]:
+    """Сохраняет апдейты и новый offset одной транзакцией; возвращает update_id реально добавленных.
+
+    Повторы по update_id игнорируются. priority апдейта (меньше — раньше) задаёт порядок выдачи воркерам.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        inserted: List[int] = []
+        for upd in updates:
+            cur = conn.execute(
+                """
+                INSERT OR IGNORE INTO updates_queue (update_id, chat_id, payload, priority, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (upd["update_id"], upd.get("chat_id"), json.dumps(upd["payload"], ensure_ascii=False),
+                 float(upd.get("priority", 100.0)), now, now),
+            )
+            if cur.rowcount:
+                inserted.append(upd["update_id"])
+        conn.execute(
+            "INSERT INTO kv (key, value) VALUES ('offset', ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (str(next_offset),),
+        )
+        conn.execute("COMMIT")
+        return inserted
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "update_id": row["update_id"],
+        "chat_id": row["chat_id"],
+        "payload": json.loads(row["payload"]),
+        "stage": row["stage"],
+        "state": json.loads(row["state"] or "{}"),
+        "attempts": row["attempts"],
+    }
+
+
+def lease_job(worker_id: str, visibility_timeout: int = QUEUE_VISIBILITY_TIMEOUT_SEC,
+              shard: Optional[Tuple[int, int]] = None) -> Optional[Dict[str, Any]]:
+    """Берёт в аренду доступную задачу (новую или с истёкшей арендой) с наименьшим приоритетом.
+
+    Приоритет «стареет» на QUEUE_PRIORITY_AGING_PER_SEC в секунду ожидания, так что длинные
+    сообщения и голос не голодают за потоком коротких вопросов.
+
+    shard=(index, total): воркер берёт новые апдейты только «своих» чатов (chat_id % total == index),
+    чужие — если они ждут дольше QUEUE_AFFINITY_GRACE_SEC (например, их воркер упал).
+    """
+    now = time.time()
+    if shard is not None and shard[1] > 1:
+        affinity = "(ABS(CAST(chat_id AS INTEGER)) % ? = ? OR created_at < ?)"
+        affinity_params: tuple = (shard[1], shard[0], now - QUEUE_AFFINITY_GRACE_SEC)
+    else:
+        affinity, affinity_params = "1", ()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # Задачи, упавшие слишком много раз, больше не выдаём
+        conn.execute(
+            """
+            UPDATE updates_queue SET status = ?, lease_owner = NULL, updated_at = ?
+            WHERE status = ? AND lease_until < ? AND attempts >= ?
+            """,
+            (STATUS_FAILED, now, STATUS_LEASED, now, QUEUE_MAX_ATTEMPTS),
+        )
+        row = conn.execute(
+            f"""
+            SELECT * FROM updates_queue
+            WHERE (status = ? AND {affinity}) OR (status = ? AND lease_until < ?)
+            ORDER BY priority - (? - created_at) * ?, update_id
+            LIMIT 1
+            """,
+            (STATUS_PENDING, *affinity_params, STATUS_LEASED, now, now, QUEUE_PRIORITY_AGING_PER_SEC),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            """
+            UPDATE updates_queue
+            SET status = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+            WHERE update_id = ?
+            """,
+            (STATUS_LEASED, worker_id, now + visibility_timeout, now, row["update_id"]),
+        )
+        conn.execute("COMMIT")
+        job = _row_to_job(row)
+        job["attempts"] += 1
+        if job["attempts"] > 1:
+            logger.info("Queue: повторная выдача update_id=%s (попытка %s, stage=%s)", job["update_id"], job["attempts"], job["stage"])
+        return job
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def save_stage(update_id: int, worker_id: str, stage: str, state: Dict[str, Any],
+               visibility_timeout: int = QUEUE_VISIBILITY_TIMEOUT_SEC) -> None:
+    """Фиксирует прогресс задачи и продлевает аренду. Если аренду забрали — LeaseLostError."""
+    now = time.time()
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            """
+            UPDATE updates_queue
+            SET stage = ?, state = ?, lease_until = ?, updated_at = ?
+            WHERE update_id = ? AND status = ? AND lease_owner = ?
+            """,
+            (stage, json.dumps(state, ensure_ascii=False), now + visibility_timeout, now,
+             update_id, STATUS_LEASED, worker_id),
+        )
+        if cur.rowcount != 1:
+            raise LeaseLostError(f"update_id={update_id}: аренда потеряна")
+    finally:
+        conn.close()
+
+
+def extend_lease(update_id: int, worker_id: str, visibility_timeout: int = QUEUE_VISIBILITY_TIMEOUT_SEC) -> None:
+    """Продлевает аренду без смены этапа (heartbeat долгих этапов). Если аренду забрали — LeaseLostError."""
+    now = time.time()
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            """
+            UPDATE updates_queue SET lease_until = ?, updated_at = ?
+            WHERE update_id = ? AND status = ? AND lease_owner = ?
+            """,
+            (now + visibility_timeout, now, update_id, STATUS_LEASED, worker_id),
+        )
+        if cur.rowcount != 1:
+            raise LeaseLostError(f"update_id={update_id}: аренда потеряна")
+    finally:
+        conn.close()
+
+
+def release_job(update_id: int, worker_id: str, retry_after_sec: float) -> None:
+    """Возвращает задачу в очередь с задержкой (например, ответ не доставлен); attempts ограничивает повторы."""
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            """
+            UPDATE updates_queue SET lease_until = ?, updated_at = ?
+            WHERE update_id = ? AND status = ? AND lease_owner = ?
+            """,
+            (now + retry_after_sec, now, update_id, STATUS_LEASED, worker_id),
+        )
+    finally:
+        conn.close()
+
+
+def complete_job(update_id: int, worker_id: str, result: str) -> None:
+    now = time.time()
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            """
+            UPDATE updates_queue
+            SET status = ?, stage = 'replied', result = ?, lease_owner = NULL, lease_until = NULL, updated_at = ?
+            WHERE update_id = ? AND status = ? AND lease_owner = ?
+            """,
+            (STATUS_DONE, result, now, update_id, STATUS_LEASED, worker_id),
+        )
+        if cur.rowcount != 1:
+            raise LeaseLostError(f"update_id={update_id}: аренда потеряна")
+    finally:
+        conn.close()
+
+
+def purge_finished(older_than_sec: int = 7 * 24 * 3600) -> int:
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            "DELETE FROM updates_queue WHERE status IN (?, ?) AND updated_at < ?",
+            (STATUS_DONE, STATUS_FAILED, time.time() - older_than_sec),
+        )
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+def pending_backlog(exclude: Optional[List[int]] = None) -> Tuple[int, float]:
+    """Сколько задач ждут воркера и сколько секунд ждёт самая старая (без задач из exclude)."""
+    exclude = exclude or []
+    placeholders = ", ".join("?" * len(exclude))
+    where = f" AND update_id NOT IN ({placeholders})" if exclude else ""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            f"SELECT COUNT(*) AS cnt, MIN(created_at) AS oldest FROM updates_queue WHERE status = ?{where}",
+            (STATUS_PENDING, *exclude),
+        ).fetchone()
+        oldest = row["oldest"]
+        return row["cnt"], (time.time() - oldest) if oldest is not None else 0.0
+    finally:
+        conn.close()
+
+
+def queue_stats() -> Dict[str, int]:
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT status, COUNT(*) AS cnt FROM updates_queue GROUP BY status").fetchall()
+        return {r["status"]: r["cnt"] for r in rows}
+    finally:
+        conn.close()
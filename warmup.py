@@ -0,0 +1,151 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import os
+import sqlite3
+import time
+
+from config import DB_PATH, OPENAI_CONNECT_TIMEOUT_SEC, OPENAI_MODEL_FAST, WARMUP_RECENT_ROWS, logger
+import analytics_mirror
+import shards
+import sql_rewriter
+from db import get_data_version
+from inspect_schema import profile_leads, render_profile
+from openai_client import get_client
+from project_resolver import get_code_to_tag_map, get_projects_mapping
+
+
+# Прогрев процесса перед приёмом сообщений: всё, за что иначе заплатил бы первый пользователь.
+# Шаги идемпотентны: в дочернем процессе после fork уже прогретое состояние проверяется быстро.
+
+# Без этих шагов бот не готов отвечать; остальные только ускоряют первый ответ
+_REQUIRED_STEPS = {"database"}
+
+# Версия данных, для которой страницы БД уже прочитаны. Кэш страниц — общий кэш ОС, поэтому
+# воркер, форкнутый после прогрева родителя, наследует это значение и не читает БД повторно.
+_database_warmed_for: Optional[str] = None
+
+
+def warm_projects() -> str:
+    mapping = get_projects_mapping()
+    code2tag = get_code_to_tag_map()
+    return f"тегов={len(mapping)}, кодов={len(code2tag)}"
+
+
+def _preread(path: str) -> Tuple[int, int]:
+    """Читает индексы leads целиком и последние строки таблицы — страницы оказываются в кэше ОС."""
+    conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+    try:
+        indexes = [row[1] for row in conn.execute("PRAGMA index_list(leads)")]
+        for name in indexes:
+            try:
+                conn.execute(f'SELECT COUNT(*) FROM leads INDEXED BY "{name}"').fetchone()
+            except sqlite3.Error:
+                continue  # частичный индекс или индекс по выражению не годится для полного обхода
+        rows = 0
+        for _ in conn.execute("SELECT * FROM leads ORDER BY rowid DESC LIMIT ?", (WARMUP_RECENT_ROWS,)):
+            rows += 1
+        if path == DB_PATH:
+            # первая проверка инварианта переписчика дат — полный проход по leads
+            sql_rewriter.warm(conn, get_data_version())
+        return len(indexes), rows
+    finally:
+        conn.close()
+
+
+def warm_database() -> str:
+    global _database_warmed_for
+    version = get_data_version()
+    if version == _database_warmed_for:
+        return "уже прогрета (данные не менялись)"
+    paths = [shard["path"] for shard in shards.load_manifest()] if shards.enabled() else [DB_PATH]
+    total_indexes, total_rows, total_bytes = 0, 0, 0
+    for path in paths:
+        indexes, rows = _preread(path)
+        total_indexes += indexes
+        total_rows += rows
+        total_bytes += os.path.getsize(path)
+    _database_warmed_for = version
+    return f"файлов={len(paths)} ({total_bytes / 1048576:.1f} МБ), индексов={total_indexes}, последних строк={total_rows}"
+
+
+def warm_mirror() -> str:
+    if shards.enabled():
+        return "пропущено (шарды)"
+    rows = analytics_mirror.warm()
+    return f"строк={rows}" if rows else "выключено"
+
+
+def warm_profile() -> str:
+    # При старте допустим полный пересчёт: на пути запроса он только фоновый
+    block = render_profile(profile_leads())
+    return f"{len(block)} символов"
+
+
+async def warm_openai() -> str:
+    """TLS-соединение пула OpenAI в текущем event loop (клиент привязан к loop) без расхода токенов."""
+    model = await get_client().models.retrieve(OPENAI_MODEL_FAST, timeout=OPENAI_CONNECT_TIMEOUT_SEC * 2)
+    return f"модель {getattr(model, 'id', OPENAI_MODEL_FAST)} доступна"
+
+
+def _result(step: str, started: float, detail: str = "", error: Optional[BaseException] = None) -> Dict[str, Any]:
+    return {
+        "step": step,
+        "ok": error is None,
+        "seconds": time.monotonic() - started,
+        "detail": detail if error is None else f"{type(error).__name__}: {error}",
+    }
+
+
+def run_step(step: str, func: Callable[[], str]) -> Dict[str, Any]:
+    started = time.monotonic()
+    try:
+        return _result(step, started, func())
+    except Exception as exc:
+        return _result(step, started, error=exc)
+
+
+async def run_async_step(step: str, func: Callable[[], Awaitable[str]]) -> Dict[str, Any]:
+    started = time.monotonic()
+    try:
+        return _result(step, started, await func())
+    except Exception as exc:
+        return _result(step, started, error=exc)
+
+
+def run_warmup(extra_steps: Optional[List[Tuple[str, Callable[[], str]]]] = None) -> List[Dict[str, Any]]:
+    """Локальные шаги прогрева (маппинг проектов, БД, зеркало, профиль) и дополнительные шаги вызывающего."""
+    steps: List[Tuple[str, Callable[[], str]]] = [
+        ("projects", warm_projects),
+        ("database", warm_database),
+        ("mirror", warm_mirror),
+        ("profile", warm_profile),
+    ]
+    return [run_step(step, func) for step, func in steps + list(extra_steps or [])]
+
+
+def is_ready(results: List[Dict[str, Any]]) -> bool:
+    return all(r["ok"] for r in results if r["step"] in _REQUIRED_STEPS)
+
+
+def log_report(results: List[Dict[str, Any]], role: str) -> bool:
+    """Пишет время каждого шага и итоговую готовность; возвращает готовность."""
+    for r in results:
+        if r["ok"]:
+            logger.info("Warm-up[%s] %s: %.2f с — %s", role, r["step"], r["seconds"], r["detail"])
+        else:
+            logger.warning("Warm-up[%s] %s: ошибка за %.2f с — %s", role, r["step"], r["seconds"], r["detail"])
+    ready = is_ready(results)
+    total = sum(r["seconds"] for r in results)
+    if ready:
+        logger.info("Warm-up[%s]: готов за %.2f с", role, total)
+    else:
+        logger.error("Warm-up[%s]: не готов (обязательные шаги: %s) — %.2f с", role, ", ".join(sorted(_REQUIRED_STEPS)), total)
+    return ready
+
+
+def format_report(results: List[Dict[str, Any]]) -> str:
+    """Таблица шагов для --warmup-only."""
+    lines = [f"{'шаг':<10} {'сек':>7}  результат"]
+    for r in results:
+        lines.append(f"{r['step']:<10} {r['seconds']:>7.3f}  {'OK ' if r['ok'] else 'ERR'} {r['detail']}")
+    lines.append(f"{'итого':<10} {sum(r['seconds'] for r in results):>7.3f}  {'готов' if is_ready(results) else 'не готов'}")
+    return "\n".join(lines)